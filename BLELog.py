@@ -23,11 +23,20 @@ from blelog.ConsumerMgr import ConsumerMgr
 from blelog.consumers.log2csv import Consumer_log2csv
 from blelog.consumers.log2sqlite import Consumer_log2sqlite
 from blelog.consumers.plotter import Consumer_plotter
+from blelog.consumers.sequence import Consumer_sequence
 from blelog.consumers.throughput import Consumer_throughput
+from blelog.consumers.worker import Consumer_worker
 from blelog.curses_tui_components.Connections_TUI import Connections_TUI
 from blelog.curses_tui_components.Log_TUI import Log_TUI
+from blelog.curses_tui_components.Loop_TUI import Loop_TUI
 from blelog.curses_tui_components.q_debug_TUI import q_TUI
 from blelog.curses_tui_components.Scanner_TUI import Scanner_TUI
+from blelog.curses_tui_components.Sequence_TUI import Sequence_TUI
+from blelog.curses_tui_components.Throughput_TUI import Throughput_TUI
+from blelog.LoopMonitor import LoopLagMonitor
+from blelog.Metrics import MetricsServer
+from blelog.Profiler import SamplingProfiler
+from blelog.Registry import Registry
 from blelog.Scanner import Scanner
 from blelog.TUI import TUI
 
@@ -41,29 +50,47 @@ async def main():
     # Setup log:
     Logging.setup_logging(configuration)
 
+    # Assign ids to devices and characteristics:
+    registry = Registry(configuration)
+
     # Create Data Consumers and Consumer Manager:
     consume_mgr = ConsumerMgr(configuration)
 
     if configuration.log2csv_enabled:
-        consume_log2csv = Consumer_log2csv(configuration)
+        if configuration.consumer_workers:
+            consume_log2csv = Consumer_worker(configuration, registry, Consumer_log2csv)
+        else:
+            consume_log2csv = Consumer_log2csv(configuration, registry)
         consume_mgr.add_consumer(consume_log2csv)
 
     if configuration.log2sqlite_enabled:
-        consume_log2sqlite = Consumer_log2sqlite(configuration)
+        if configuration.consumer_workers:
+            consume_log2sqlite = Consumer_worker(configuration, registry, Consumer_log2sqlite)
+        else:
+            consume_log2sqlite = Consumer_log2sqlite(configuration, registry)
         consume_mgr.add_consumer(consume_log2sqlite)
 
     consume_plot = Consumer_plotter(configuration)
     consume_mgr.add_consumer(consume_plot)
-    
+
+    consume_throughput = None
     if configuration.throughput_period_s is not None:
         consume_throughput = Consumer_throughput(configuration)
         consume_mgr.add_consumer(consume_throughput)
 
+    consume_sequence = None
+    if any(c.sequence_column is not None for c in configuration.characteristics):
+        consume_sequence = Consumer_sequence(configuration)
+        consume_mgr.add_consumer(consume_sequence)
+
     # Create the scanner:
     scnr = Scanner(config=configuration)
 
     # Create the connection manager:
-    con_mgr = ConnectionMgr(configuration, scnr, consume_mgr.input_q)
+    con_mgr = ConnectionMgr(configuration, scnr, consume_mgr.input_q, registry)
+
+    # Create the event loop monitor:
+    loop_monitor = LoopLagMonitor(configuration)
 
     # Create the TUI:
     tui = TUI(configuration)
@@ -74,11 +101,31 @@ async def main():
     tui.add_component(tui_conns)
     tui_q = q_TUI(con_mgr, consume_mgr)
     tui.add_component(tui_q)
+    if consume_throughput is not None:
+        tui_throughput = Throughput_TUI(consume_throughput)
+        tui.add_component(tui_throughput)
+    if consume_sequence is not None:
+        tui_sequence = Sequence_TUI(consume_sequence)
+        tui.add_component(tui_sequence)
+    tui_loop = Loop_TUI(loop_monitor)
+    tui.add_component(tui_loop)
     tui_log = Log_TUI(configuration)
     tui.add_component(tui_log)
 
     tui.set_plot_toggle(consume_plot.toggle_on_off)
 
+    # Profiler, toggled at runtime by the TUI or SIGUSR1. Profiles BLELog and
+    # the plotting process:
+    profiler = SamplingProfiler('blelog', configuration.profiler_output_dir, asyncio.get_running_loop())
+
+    def profile_toggle():
+        profiler.toggle()
+        consume_plot.set_profiling(profiler.running)
+
+    tui.set_profile_toggle(profile_toggle)
+    if hasattr(signal, 'SIGUSR1'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, profile_toggle)
+
     # Re-route SIGINT (Interruption, i.e. due to CTRL-C) to a handler to
     # allow cleanup:
     halt_event = Event()
@@ -109,10 +156,21 @@ async def main():
     con_mgr_task = asyncio.create_task(con_mgr.run(halt_event))
     tui_task = asyncio.create_task(tui.run(halt_event))
     consume_mgr_task = asyncio.create_task(consume_mgr.run(halt_event))
+    loop_monitor_task = asyncio.create_task(loop_monitor.run(halt_event))
+    tasks = [scnr_task, con_mgr_task, tui_task, consume_mgr_task, loop_monitor_task]
+
+    # Run the metrics endpoint, if enabled:
+    if configuration.metrics_port is not None:
+        metrics = MetricsServer(configuration, scnr, con_mgr, consume_mgr, loop_monitor)
+        tasks.append(asyncio.create_task(metrics.run(halt_event)))
 
     logging.getLogger('log').info('Starting!')
 
-    await asyncio.gather(scnr_task, con_mgr_task, tui_task, consume_mgr_task)
+    await asyncio.gather(*tasks)
+
+    profiler.stop(wait=True)
 
 if __name__ == '__main__':
-    asyncio.run(main(), debug=True)
+    # asyncio debug mode is expensive, and only enabled on request. The
+    # loop monitor (see LoopMonitor.py) catches slow callbacks either way.
+    asyncio.run(main(), debug=config.config.asyncio_debug)
@@ -0,0 +1,123 @@
+"""
+blelog/AcquireNotify.py
+Receives notifications through a socket acquired from BlueZ, instead of as
+D-Bus signals (Linux only).
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+With bleak's start_notify, BlueZ sends every notification as a D-Bus
+'PropertiesChanged' signal, which has to be parsed in Python. At high
+notification rates, this becomes the main CPU cost of BLELog.
+
+BlueZ's 'AcquireNotify' method instead hands out a SOCK_SEQPACKET socket
+that delivers each notification's value as a single packet. NotifySocket
+reads it directly from the event loop (loop.add_reader), without involving
+D-Bus. Closing the socket stops the notifications.
+
+This relies on bleak's BlueZ backend internals (its D-Bus connection and the
+D-Bus path of characteristics), so any failure to acquire a socket should
+be handled by falling back to start_notify.
+"""
+import asyncio
+import logging
+import socket
+import sys
+from typing import Callable, Tuple, Union
+
+from bleak import BleakClient
+from bleak.backends.characteristic import BleakGATTCharacteristic
+from bleak.exc import BleakDBusError, BleakError
+
+# Maximum number of packets read per wake-up, so that a busy socket can't
+# starve the event loop:
+max_packets_per_read = 64
+
+
+def acquire_notify_supported(client: BleakClient) -> bool:
+    """Check if a client is using bleak's BlueZ backend"""
+    return sys.platform.startswith('linux') and getattr(client._backend, '_bus', None) is not None
+
+
+async def acquire_notify(client: BleakClient, char: BleakGATTCharacteristic) -> Tuple[int, int]:
+    """
+    Call BlueZ's AcquireNotify for a characteristic.
+    Returns the socket file descriptor and the MTU.
+    """
+    from dbus_fast import Message, MessageType
+
+    bus = getattr(client._backend, '_bus', None)
+    path = getattr(char, 'path', None)
+    if bus is None or path is None:
+        raise BleakError('AcquireNotify requires the BlueZ backend')
+
+    reply = await bus.call(Message(
+        destination='org.bluez',
+        path=path,
+        interface='org.bluez.GattCharacteristic1',
+        member='AcquireNotify',
+        signature='a{sv}',
+        body=[{}],
+    ))
+
+    if reply.message_type == MessageType.ERROR:
+        raise BleakDBusError(reply.error_name, reply.body)
+
+    fd = reply.unix_fds[reply.body[0]]
+    mtu = reply.body[1]
+    return fd, mtu
+
+
+class NotifySocket:
+    """
+    Reads notifications from a SOCK_SEQPACKET socket (one packet per
+    notification), and passes each one to 'callback'.
+    """
+
+    def __init__(self, fd: int, mtu: int, callback: Callable[[bytearray], None],
+                 closed_callback: Union[None, Callable[[], None]] = None) -> None:
+        self.sock = socket.socket(fileno=fd)
+        self.sock.setblocking(False)
+        self.mtu = mtu
+        self.callback = callback
+        self.closed_callback = closed_callback
+        self.loop = None  # type: Union[None, asyncio.AbstractEventLoop]
+
+    def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def close(self) -> None:
+        if self.sock.fileno() == -1:
+            return
+        if self.loop is not None:
+            self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+    def _on_readable(self) -> None:
+        log = logging.getLogger('log')
+        for _ in range(max_packets_per_read):
+            try:
+                data = self.sock.recv(self.mtu)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.warning('Notification socket failed: %s' % str(e))
+                self._closed()
+                return
+
+            if len(data) == 0:
+                # Closed by BlueZ (disconnected):
+                self._closed()
+                return
+
+            self.callback(bytearray(data))
+
+    def _closed(self) -> None:
+        self.close()
+        if self.closed_callback is not None:
+            self.closed_callback()
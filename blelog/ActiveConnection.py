@@ -13,18 +13,25 @@ import asyncio
 import enum
 import functools
 import logging
+import sys
 import time
 from asyncio import Event
 from asyncio.queues import Queue, QueueFull
 from enum import Enum
-from typing import Dict, Union
+from typing import Callable, Dict, List, Tuple, Union
 
-from bleak import BleakClient
+from bleak import BleakClient, BleakScanner
 from bleak.backends.characteristic import BleakGATTCharacteristic
+from bleak.backends.device import BLEDevice
 from bleak.exc import BleakDBusError, BleakError
 
+from blelog.AcquireNotify import NotifySocket, acquire_notify, acquire_notify_supported
 from blelog.Configuration import Characteristic, Configuration
+from blelog.ConnectionTiming import format_durations
 from blelog.ConsumerMgr import NotifData
+from blelog.DeadlineScheduler import DeadlineScheduler
+from blelog.Registry import Registry
+from blelog.Util import adapter_kwargs
 
 
 @enum.unique
@@ -37,16 +44,52 @@ class ConnectionState(Enum):
         return super().__str__().split('.')[1]
 
 
+@enum.unique
+class FailureType(Enum):
+    CONNECT_FAILED = 0
+    TIMEOUT = 1
+    DBUS_ERROR = 2
+    BLEAK_ERROR = 3
+    OS_ERROR = 4
+    EARLY_DISCONNECT = 5
+    CHARACTERISTIC_TIMEOUT = 6
+    EXCEPTION = 7
+
+    def __str__(self):
+        return super().__str__().split('.')[1]
+
+
 class ActiveConnectionException(Exception):
     pass
 
 
+# Interval (in seconds) at which an idle connection checks if BLELog is
+# shutting down:
+halt_check_interval_s = 0.5
+
+
 class ActiveConnection:
-    def __init__(self, adr: str, name: str, config: Configuration, output: Queue) -> None:
+    def __init__(self, adr: str, name: str, config: Configuration, output: Queue,
+                 state_callback: Union[None, Callable[['ActiveConnection'], None]] = None,
+                 adapter: Union[None, str] = None,
+                 deadlines: Union[None, DeadlineScheduler] = None,
+                 ble_device: Union[None, BLEDevice] = None,
+                 registry: Union[None, Registry] = None) -> None:
         self.adr = adr
         self.name = name
+
+        # Ids that data from this connection is tagged with (see Registry.py):
+        if registry is not None:
+            self.device_id = registry.device_id(adr)
+            self.char_ids = {c.uuid: registry.characteristic(c.uuid).id for c in config.characteristics}
+        else:
+            self.device_id = -1
+            self.char_ids = {c.uuid: -1 for c in config.characteristics}
+        self.ble_device = ble_device
+        self.adapter = adapter
         self.config = config
         self.state = ConnectionState.CONNECTING
+        self.state_callback = state_callback
         self.disconnected_callback_flag = False
         self.did_disconnect = False
 
@@ -56,148 +99,348 @@ class ActiveConnection:
 
         self.initial_connection_time = None
         self.last_notif = {c.uuid: None for c in config.characteristics}  # type: Dict[str, Union[None, int]]
+        self.notif_count = 0
+        self.decoder_errors = 0
+
+        # Why this connection failed, if it did:
+        self.failure = None  # type: Union[None, FailureType]
+
+        # Notifications waiting to be decoded, by characteristic UUID:
+        self.pending = {}  # type: Dict[str, Tuple[Characteristic, List[bytearray]]]
+        self.flush_scheduled = False
+
+        # Sockets of characteristics that use BlueZ's AcquireNotify:
+        self.notify_sockets = []  # type: List[NotifySocket]
+
+        # Duration (in seconds) of each phase of this connection (see ConnectionTiming.py):
+        self.durations = {}  # type: Dict[str, float]
+
+        # Characteristic timeouts are tracked by a (usually shared) scheduler.
+        # When one expires, the characteristic is noted here:
+        self.deadlines = deadlines if deadlines is not None else DeadlineScheduler()
+        self.expired = None  # type: Union[None, Tuple[Characteristic, bool]]
+
+        # Set whenever the connection needs attention (disconnect or timeout):
+        self.wake = Event()
 
         self.log = logging.getLogger('log')
 
     async def run(self, halt: Event) -> None:
         log = logging.getLogger('log')
         try:
-            con = BleakClient(
-                self.adr,
-                timeout=self.config.connection_timeout_scan,
-                disconnected_callback=self._disconnected_callback
-            )
-
-            self.con = con
-
             try:
                 # Ensure there was no disconnect before this connection got a chance to run:
                 if self.did_disconnect:
+                    self._set_failure(FailureType.CONNECT_FAILED)
                     raise ActiveConnectionException()
 
+                # Connect directly to the device found by the scanner, if possible. Otherwise
+                # scan for it first:
+                if self.ble_device is None:
+                    await self._resolve()
+
+                self.con = BleakClient(
+                    self.ble_device,
+                    timeout=self.config.connection_timeout_scan,
+                    disconnected_callback=self._disconnected_callback,
+                    winrt={'use_cached_services': self.config.use_cached_services},
+                    **adapter_kwargs(self.adapter)
+                )
+
                 # Connect:
                 await self._connect(self.con)
                 self.initial_connection_time = time.monotonic_ns()
+                self._schedule_timeouts()
 
                 while not halt.is_set():
                     # Check for disconnection
                     # (Flag set by disconnect callback or when this connection is manually disconnected)
                     if self.did_disconnect:
                         log.warning('Connection to %s lost!' % self.name)
+                        connected_s = (time.monotonic_ns() - self.initial_connection_time) / 1e9
+                        if connected_s < self.config.backoff_early_disconnect_s:
+                            self._set_failure(FailureType.EARLY_DISCONNECT)
                         raise ActiveConnectionException()
 
-                    await self._check_for_timeout()
+                    await self._handle_timeout()
 
-                    await asyncio.sleep(0.05)
+                    # Sleep until something happens:
+                    try:
+                        await asyncio.wait_for(self.wake.wait(), timeout=halt_check_interval_s)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wake.clear()
 
             except ActiveConnectionException:
                 pass
             finally:
+                self._cancel_timeouts()
+                self._close_notify_sockets()
                 await self._do_disconnect()
 
         except Exception as e:
             log.error('Connection %s encountered an exception: %s' % (self.name, str(e)))
             log.exception(e)
+            self._set_failure(FailureType.EXCEPTION)
             self.did_disconnect = True
         finally:
-            self.state = ConnectionState.DISCONNECTED
+            self._set_state(ConnectionState.DISCONNECTED)
             if halt.is_set():
                 print('Connection %s shut down...' % self.name)
 
+    async def _resolve(self) -> None:
+        log = logging.getLogger('log')
+        t_start = time.perf_counter()
+        try:
+            self.ble_device = await BleakScanner.find_device_by_address(
+                self.adr, timeout=self.config.connection_timeout_scan, **adapter_kwargs(self.adapter))
+        except (BleakError, OSError) as e:
+            log.warning('Failed to find %s: %s' % (self.name, e))
+            self._set_failure(FailureType.CONNECT_FAILED)
+            raise ActiveConnectionException()
+        finally:
+            self.durations['resolve'] = time.perf_counter() - t_start
+
+        if self.ble_device is None:
+            log.warning('Failed to connect to %s: Device not found' % self.name)
+            self._set_failure(FailureType.CONNECT_FAILED)
+            raise ActiveConnectionException()
+
     async def _connect(self, con: BleakClient) -> None:
         log = logging.getLogger('log')
+        t_start = time.perf_counter()
 
         # Note: According to the docks, bleak generates exceptions if connecting fails under linux,
         # while only returning false on other platforms.
         # This should handle all cases.
         try:
-            ok = await asyncio.wait_for(con.connect(), self.config.connection_timeout_hard)
+            ok = await asyncio.wait_for(con.connect(**self._connect_kwargs()), self.config.connection_timeout_hard)
             if not ok:
                 log.warning('Failed to connect to %s!' % self.name)
+                self._set_failure(FailureType.CONNECT_FAILED)
                 raise ActiveConnectionException()
         except BleakDBusError as e:
             log.warning('Failed to connect to %s: DBus Error.' % self.name)
             log.exception(e)
+            self._set_failure(FailureType.DBUS_ERROR)
             raise ActiveConnectionException()
         except BleakError as e:
             log.warning('Failed to connect to %s: %s' % (self.name, e))
             log.exception(e)
+            self._set_failure(FailureType.BLEAK_ERROR)
             raise ActiveConnectionException()
         except asyncio.TimeoutError:
             log.warning('Failed to connect to %s: Timeout' % self.name)
+            self._set_failure(FailureType.TIMEOUT)
             raise ActiveConnectionException()
         except OSError as e:
             log.warning('Failed to connect to %s: OSError' % self.name)
             log.exception(e)
+            self._set_failure(FailureType.OS_ERROR)
             raise ActiveConnectionException()
+        finally:
+            # (Includes service discovery, which bleak performs as part of connecting)
+            self.durations['connect'] = time.perf_counter() - t_start
 
         log.info('Established connection to %s!' % self.name)
 
-        # Enable notifications for all characteristics:
-        for char in self.config.characteristics:
-            # Generate a wrapper around the callback function to pass characteristic along.
-            callback_wrapper = functools.partial(self._notif_callback, char=char)
-            await con.start_notify(char.uuid, callback_wrapper)
+        # Enable notifications for all characteristics (all at once):
+        # Generate a wrapper around the callback function to pass characteristic along.
+        t_start = time.perf_counter()
+        try:
+            await asyncio.gather(*[self._enable_notifications(con, char) for char in self.config.characteristics])
+        finally:
+            self.durations['notify'] = time.perf_counter() - t_start
 
-        log.info('Enabled notifications for all characteristic for %s!' % self.name)
-        self.state = ConnectionState.CONNECTED
+        log.info('Enabled notifications for all characteristic for %s! (%s)' %
+                 (self.name, format_durations(self.durations)))
+        self._set_state(ConnectionState.CONNECTED)
 
-    async def _check_for_timeout(self) -> None:
+    async def _enable_notifications(self, con: BleakClient, char: Characteristic) -> None:
         log = logging.getLogger('log')
+        callback = functools.partial(self._notif_callback, char=char)
 
+        if self.config.bluez_acquire_notify and acquire_notify_supported(con):
+            try:
+                fd, mtu = await acquire_notify(con, con.services.get_characteristic(char.uuid))
+                sock = NotifySocket(fd, mtu, functools.partial(callback, None),
+                                    functools.partial(self._notify_socket_closed, char=char))
+                sock.start()
+                self.notify_sockets.append(sock)
+                return
+            except (BleakError, OSError, AttributeError, IndexError) as e:
+                log.info('%s: Could not acquire notification socket for %s (%s), using start_notify.' %
+                         (self.name, char.name, str(e)))
+
+        await con.start_notify(char.uuid, callback)
+
+    def _close_notify_sockets(self) -> None:
+        for sock in self.notify_sockets:
+            sock.close()
+        self.notify_sockets.clear()
+
+    def _connect_kwargs(self) -> Dict[str, bool]:
+        # On windows, cached services are selected when creating the client
+        # (see run). BlueZ takes an argument to connect:
+        if self.config.use_cached_services and sys.platform.startswith('linux'):
+            return {'dangerous_use_bleak_cache': True}
+        return {}
+
+    def _set_state(self, state: ConnectionState) -> None:
+        self.state = state
+        if self.state_callback is not None:
+            self.state_callback(self)
+
+    def _schedule_timeouts(self) -> None:
+        now = time.monotonic()
         for char in self.config.characteristics:
             if char.timeout is not None:
-                last_notif = self.last_notif[char.uuid]
+                callback = functools.partial(self._check_for_timeout, char=char)
+                self.deadlines.schedule((self, char.uuid), now + char.timeout, callback)
 
-                if last_notif is not None:
-                    # Check if normal timeout expired
-                    timeout = char.timeout
-                    has_been = (time.monotonic_ns() - last_notif)/1e9
+    def _cancel_timeouts(self) -> None:
+        for char in self.config.characteristics:
+            self.deadlines.cancel((self, char.uuid))
 
-                    if has_been > timeout:
-                        log.warning('%s: Timeout for characteristic %s expired, disconnecting..' %
-                                    (self.name, char.name))
-                        await self._do_disconnect()
-                        raise ActiveConnectionException()
+    def _check_for_timeout(self, now: float, char: Characteristic) -> Union[None, float]:
+        """
+        Called by the deadline scheduler. Returns the characteristic's current
+        deadline if it has not expired yet.
+        """
+        last_notif = self.last_notif[char.uuid]
+
+        if last_notif is not None:
+            # Normal timeout:
+            deadline = last_notif / 1e9 + char.timeout
+
+        elif self.config.initial_characteristic_timeout is not None:
+            if self.initial_connection_time is None:
+                raise Exception("Implementation error")
+
+            # Initial timeout:
+            deadline = self.initial_connection_time / 1e9 + char.timeout + \
+                self.config.initial_characteristic_timeout
+
+        else:
+            # No initial timeout, check again later:
+            return now + char.timeout
+
+        if now < deadline:
+            return deadline
+
+        if self.expired is None:
+            self.expired = (char, last_notif is None)
+            self.wake.set()
+        return None
+
+    async def _handle_timeout(self) -> None:
+        log = logging.getLogger('log')
+
+        if self.expired is None:
+            return
+        char, never_received = self.expired
 
-                elif self.config.initial_characteristic_timeout is not None:
-                    if self.initial_connection_time is None:
-                        raise Exception("Implementation error")
+        if never_received:
+            log.warning('%s: Never received a notification for %s, disconnecting...' %
+                        (self.name, char.name))
+        else:
+            log.warning('%s: Timeout for characteristic %s expired, disconnecting..' %
+                        (self.name, char.name))
 
-                    # Check if initial timeout expired
-                    timeout = char.timeout + self.config.initial_characteristic_timeout
-                    has_been = (time.monotonic_ns() - self.initial_connection_time) / 1e9
+        self._set_failure(FailureType.CHARACTERISTIC_TIMEOUT)
+        await self._do_disconnect()
+        raise ActiveConnectionException()
 
-                    if has_been > timeout:
-                        log.warning('%s: Never received a notification for %s, disconnecting...' %
-                                    (self.name, char.name))
-                        await self._do_disconnect()
+    def _set_failure(self, failure: FailureType) -> None:
+        # Only keep the first cause:
+        if self.failure is None:
+            self.failure = failure
 
     def _disconnected_callback(self, _) -> None:
         self.did_disconnect = True
+        self.wake.set()
+
+    def _notify_socket_closed(self, char: Characteristic) -> None:
+        # BlueZ closes the socket when the device disconnects. Either way, no
+        # more notifications will arrive for this characteristic:
+        logging.getLogger('log').warning('%s: Notification socket for %s closed.' % (self.name, char.name))
+        self._disconnected_callback(None)
 
     def _notif_callback(self, dev: BleakGATTCharacteristic, data: bytearray, char: Characteristic) -> None:
         _ = dev
 
         self.last_notif[char.uuid] = time.monotonic_ns()
-
-        # Decode and package data:
-        try:
-            decoded_data = char.data_decoder(data)
-            if len(decoded_data) == 0:
-                return
-            result = NotifData(self.adr, self.name, char, decoded_data, data)
+        self.notif_count += 1
+
+        # Collect notifications, and decode all that arrived during this
+        # iteration of the event loop together:
+        if char.uuid not in self.pending:
+            self.pending[char.uuid] = (char, [])
+        self.pending[char.uuid][1].append(data)
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_pending)
+
+    def _flush_pending(self) -> None:
+        self.flush_scheduled = False
+        pending = self.pending
+        self.pending = {}
+
+        for char, payloads in pending.values():
+            result = self._decode(char, payloads)
+            if result is None:
+                continue
             try:
                 self.output.put_nowait(result)
             except QueueFull:
                 self.log.error("%s failed to put data into queue!" % self.name)
-        except Exception as e:
-            self.log.error("Decoder for %s raised an exception: %s" % (char.name, str(e)))
-            self.log.exception(e)
+
+    def _decode(self, char: Characteristic, payloads: List[bytearray]) -> Union[None, NotifData]:
+        """Decode and package data"""
+        data_raw = payloads[0] if len(payloads) == 1 else bytearray().join(payloads)
+
+        if char.batch_decoder is not None:
+            try:
+                columns = char.batch_decoder(payloads)
+                if len(columns) == 0 or len(columns[0]) == 0:
+                    return None
+                if any(len(col) != len(columns[0]) for col in columns):
+                    raise ValueError('Columns have different lengths: %s' % str([len(col) for col in columns]))
+                return NotifData(self.adr, self.name, char, None, data_raw,
+                                 columns=columns, notif_count=len(payloads),
+                                 device_id=self.device_id, char_id=self.char_ids[char.uuid])
+            except Exception as e:
+                self.decoder_errors += 1
+                self.log.error("Batch decoder for %s raised an exception: %s" % (char.name, str(e)))
+                self.log.exception(e)
+                return None
+
+        rows = []
+        for data in payloads:
+            try:
+                decoded = char.data_decoder(data)
+                # All rows must have the same length, so that they can be
+                # turned into columns:
+                width = len(rows[0]) if len(rows) != 0 else len(decoded[0]) if len(decoded) != 0 else 0
+                if any(len(row) != width for row in decoded):
+                    raise ValueError('Decoder returned rows of length %s, expected %i'
+                                     % (str(sorted(set(len(row) for row in decoded))), width))
+                rows.extend(decoded)
+            except Exception as e:
+                self.decoder_errors += 1
+                self.log.error("Decoder for %s raised an exception: %s" % (char.name, str(e)))
+                self.log.exception(e)
+
+        if len(rows) == 0:
+            return None
+        return NotifData(self.adr, self.name, char, rows, data_raw, notif_count=len(payloads),
+                         device_id=self.device_id, char_id=self.char_ids[char.uuid])
 
     async def _do_disconnect(self) -> None:
         log = logging.getLogger('log')
         if self.con is not None:
+            t_start = time.perf_counter()
             try:
                 did_disconnect = await asyncio.wait_for(self.con.disconnect(), timeout=20)
                 if did_disconnect:
@@ -214,6 +457,16 @@ class ActiveConnection:
                 log.warning('Failed to disconnect from %s: OSError' % self.name)
             finally:
                 self.did_disconnect = True
+                # Only time the first (actual) disconnect:
+                if 'disconnect' not in self.durations:
+                    self.durations['disconnect'] = time.perf_counter() - t_start
+
+    def notif_rate(self) -> Union[None, float]:
+        """Average number of notifications per second since connecting"""
+        if self.initial_connection_time is None:
+            return None
+        active_s = (time.monotonic_ns() - self.initial_connection_time) / 1e9
+        return self.notif_count / active_s if active_s > 0 else None
 
     def active_time_str(self) -> str:
         if self.initial_connection_time is None:
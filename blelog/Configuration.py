@@ -9,7 +9,7 @@ This work is licensed under the terms of the MIT license.  For a copy, see the
 included LICENSE file or <https://opensource.org/licenses/MIT>.
 ---------------------------------
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Callable, List, Dict, Union
 from enum import Enum
 import enum
@@ -29,7 +29,25 @@ class Characteristic:
     uuid: str
     timeout: Union[None, float]
     column_headers: List[str]
-    data_decoder: Callable
+    data_decoder: Union[None, Callable]
+    sequence_column: Union[None, str] = None
+    sequence_modulus: int = 2**16
+    batch_decoder: Union[None, Callable] = None
+
+
+@dataclass
+class Subplot:
+    title: str
+    characteristic: str
+    columns: List[str]
+
+
+@dataclass
+class Adapter:
+    name: Union[None, str]
+    max_active_connections: int
+    max_simultaneous_connection_attempts: int
+    scan: bool = False
 
 
 @dataclass
@@ -70,6 +88,69 @@ class Configuration:
     tui_mode: TUI_Mode
     curse_tui_interval: float
 
+    # Plotter settings:
+    plotter_point_budget: int = 300
+    plotter_window_s: float = 10
+    plotter_target_fps: float = 20
+    plotter_cpu_budget: float = 0.5
+    plotter_stats_report_period_s: Union[None, float] = 60
+    plotter_subplots: List[Subplot] = field(default_factory=list)
+
+    # Throughput settings:
+    throughput_log_file: Union[None, str] = None
+
+    # Sequence checking settings:
+    sequence_report_period_s: float = 10
+
+    # Metrics settings:
+    metrics_port: Union[None, int] = None
+    metrics_host: str = '127.0.0.1'
+
+    # Profiler settings:
+    profiler_output_dir: str = '.'
+
+    # Scanner settings:
+    continuous_scanning: bool = False
+    scan_ignore_timeout: float = 300
+    scan_ignore_max_devices: int = 4096
+
+    # Signal strength settings:
+    rssi_smoothing: float = 0.2
+    rssi_stability_weight: float = 1.0
+    rssi_priority_band: float = 6
+    connect_min_rssi: Union[None, float] = None
+
+    # Connection retry settings:
+    backoff_initial_s: float = 2
+    backoff_max_s: float = 300
+    backoff_jitter: float = 0.5
+    backoff_early_disconnect_s: float = 10
+    connection_history_file: Union[None, str] = None
+
+    # Adapter settings:
+    adapters: List[Adapter] = field(default_factory=list)
+
+    # Connection settings:
+    use_cached_services: bool = False
+    bluez_acquire_notify: bool = False
+
+    # Event loop settings:
+    asyncio_debug: bool = False
+    loop_monitor_interval_s: float = 0.05
+    loop_slow_callback_s: float = 0.1
+
+    # Consumer settings:
+    consumer_workers: bool = False
+
+    # TUI settings:
+    tui_page_rows: int = 20
+
+    # Characteristics by (normalised) UUID, see get_characteristic:
+    _characteristics_by_uuid: Dict[str, Characteristic] = field(default_factory=dict, init=False, repr=False)
+    # Characteristics by UUID exactly as it was looked up, so that repeated
+    # lookups skip normalisation:
+    _characteristics_by_raw_uuid: Dict[str, Characteristic] = field(default_factory=dict, init=False, repr=False)
+
     def validate_and_normalise(self):
         """
         Validates the configuration provided by the user.
@@ -86,6 +167,8 @@ class Configuration:
         # normalise characteristic UUIDs:
         for char in self.characteristics:
             char.uuid = normalise_char_uuid(char.uuid)
+        self._characteristics_by_uuid = {}
+        self._characteristics_by_raw_uuid = {}
 
         # Check for duplicate aliases:
         # (Can cause problems, as they are used as a file name)
@@ -113,8 +196,86 @@ class Configuration:
                 exit(-1)
             seen_uuids.append(char.uuid)
 
+        # Check that every characteristic has a decoder:
+        for char in self.characteristics:
+            if char.data_decoder is None and char.batch_decoder is None:
+                print('Characteristic "%s" has neither a data_decoder nor a batch_decoder' % char.name)
+                exit(-1)
+
+        # Check sequence columns:
+        for char in self.characteristics:
+            if char.sequence_column is not None and char.sequence_column not in char.column_headers:
+                print('Sequence column "%s" of characteristic "%s" is not a column' % (char.sequence_column, char.name))
+                exit(-1)
+
+        # Check that all plotted columns exist:
+        for subplot in self.plotter_subplots:
+            chars = [c for c in self.characteristics if c.name == subplot.characteristic]
+            if len(chars) == 0:
+                print('Subplot "%s" references unknown characteristic "%s"' % (subplot.title, subplot.characteristic))
+                exit(-1)
+            for column in subplot.columns:
+                if column not in chars[0].column_headers:
+                    print('Subplot "%s" references unknown column "%s"' % (subplot.title, column))
+                    exit(-1)
+
+        # Check signal strength settings:
+        if not 0 < self.rssi_smoothing <= 1:
+            print('rssi_smoothing must be between 0 and 1')
+            exit(-1)
+        if self.rssi_priority_band <= 0:
+            print('rssi_priority_band must be positive')
+            exit(-1)
+        if self.plotter_window_s <= 0:
+            print('plotter_window_s must be positive')
+            exit(-1)
+        if self.plotter_point_budget <= 0:
+            print('plotter_point_budget must be positive')
+            exit(-1)
+        if self.plotter_target_fps <= 0:
+            print('plotter_target_fps must be positive')
+            exit(-1)
+        if self.plotter_cpu_budget <= 0:
+            print('plotter_cpu_budget must be positive')
+            exit(-1)
+        if self.plotter_stats_report_period_s is not None and self.plotter_stats_report_period_s <= 0:
+            print('plotter_stats_report_period_s must be positive or None')
+            exit(-1)
+
+        # Check for duplicate adapters:
+        seen_adapters = []
+        for adapter in self.adapters:
+            if adapter.name in seen_adapters:
+                print('Duplicate adapter "%s"' % adapter.name)
+                exit(-1)
+            seen_adapters.append(adapter.name)
+
+        # Check retry settings:
+        if not 0 <= self.backoff_jitter <= 1:
+            print('backoff_jitter must be between 0 and 1')
+            exit(-1)
+
+    def get_adapters(self) -> List[Adapter]:
+        """
+        The adapters to use. If none are listed, the system's default
+        adapter (name None) is used with the global connection limits.
+        """
+        if len(self.adapters) != 0:
+            return self.adapters
+        return [Adapter(
+            name=None,
+            max_active_connections=self.max_active_connections,
+            max_simultaneous_connection_attempts=self.max_simultaneous_connection_attempts,
+            scan=True,
+        )]
+
     def get_characteristic(self, uuid: str) -> Characteristic:
-        for c in self.characteristics:
-            if c.uuid == normalise_char_uuid(uuid):
-                return c
-        raise KeyError()
+        if len(self._characteristics_by_uuid) != len(self.characteristics):
+            self._characteristics_by_uuid = {c.uuid: c for c in self.characteristics}
+            self._characteristics_by_raw_uuid = {}
+
+        char = self._characteristics_by_raw_uuid.get(uuid)
+        if char is None:
+            char = self._characteristics_by_uuid[normalise_char_uuid(uuid)]
+            self._characteristics_by_raw_uuid[uuid] = char
+        return char
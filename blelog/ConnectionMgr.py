@@ -13,20 +13,68 @@ from asyncio.queues import Queue
 import logging
 import asyncio
 from asyncio import Event
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
+import json
+import math
+import os
+import random
 import time
-from typing import Union, Dict
+import heapq
+from typing import Union, Dict, List, Set, Tuple
 
-from blelog.ActiveConnection import ActiveConnection, ConnectionState
-from blelog.Configuration import Configuration
+from blelog.ActiveConnection import ActiveConnection, ConnectionState, FailureType
+from blelog.Configuration import Adapter, Configuration
+from blelog.ConnectionTiming import ConnectionTiming, format_durations
+from blelog.DeadlineScheduler import DeadlineScheduler
+from blelog.Registry import Registry
 from blelog.Scanner import Scanner, SeenDevice, SeenDeviceState
 
 
+# Backoff multiplier for each type of failure. Failures that tie up a
+# connection attempt for long, or suggest a bad link, back off faster:
+failure_backoff_weights = {
+    FailureType.CONNECT_FAILED: 1.0,
+    FailureType.TIMEOUT: 2.0,
+    FailureType.DBUS_ERROR: 1.0,
+    FailureType.BLEAK_ERROR: 1.0,
+    FailureType.OS_ERROR: 1.0,
+    FailureType.EARLY_DISCONNECT: 2.0,
+    FailureType.CHARACTERISTIC_TIMEOUT: 0.5,
+    FailureType.EXCEPTION: 1.0,
+}
+
+# Minimum time (in seconds) between two writes of the connection history file:
+history_save_interval_s = 10
+
+
+@dataclass
+class ConnectionHistory:
+    """Connection outcomes of a device. Persisted across restarts."""
+    successes: int = 0
+    failures: Dict[str, int] = field(default_factory=dict)
+    consecutive_failures: int = 0
+    last_failure: Union[None, str] = None
+
+    # Wall-clock time (time.time()) before which no new attempt is made:
+    retry_after: float = 0
+
+    def failure_count(self) -> int:
+        return sum(self.failures.values())
+
+
 @dataclass
 class ManagedConnection:
     last_connection_attempt: Union[int, None]
     scanner_information: SeenDevice
     active_connection: Union[None, ActiveConnection]
+    history: ConnectionHistory = field(default_factory=ConnectionHistory)
+    timing: ConnectionTiming = field(default_factory=ConnectionTiming)
+
+    # Decoder errors of past connections to this device:
+    past_decoder_errors: int = 0
+
+    # Current entry of this connection in the ConnectionMgr's queue:
+    queue_entry: Union[None, tuple] = None
 
     def state(self) -> ConnectionState:
         if self.active_connection is None:
@@ -34,39 +82,127 @@ class ManagedConnection:
         else:
             return self.active_connection.state
 
+    def decoder_errors(self) -> int:
+        if self.active_connection is None:
+            return self.past_decoder_errors
+        return self.past_decoder_errors + self.active_connection.decoder_errors
+
     def ready_to_connect(self) -> bool:
         if self.state() == ConnectionState.DISCONNECTED:
             if self.scanner_information.state == SeenDeviceState.RECENTLY_SEEN:
-                return True
+                return not self.backing_off()
         return False
 
-    # 'Less than' comparison for managed connections.
-    # Used to find connection that has not attempted to connect for
-    # the longest time.
-    def __lt__(self, other):
-        if self.last_connection_attempt is None:
-            return True
-        elif other.last_connection_attempt is None:
+    def backing_off(self) -> bool:
+        return self.history.retry_after > time.time()
+
+    def signal_too_weak(self, config: Configuration) -> bool:
+        if config.connect_min_rssi is None:
             return False
+        rssi_mean = self.scanner_information.rssi_mean
+        return rssi_mean is not None and rssi_mean < config.connect_min_rssi
+
+    def priority(self, config: Configuration) -> Tuple[int, float, float]:
+        """
+        Sort key for connection candidates (lower is tried first):
+        Devices whose last connection attempt succeeded come first. Next,
+        devices with a stronger and more stable signal are preferred. Within
+        the same signal band (see 'rssi_priority_band'), devices that have
+        never been connected, or whose last connection attempt lies further
+        back, come first.
+        """
+        failing = 1 if self.history.consecutive_failures > 0 else 0
+
+        score = self.scanner_information.signal_score(config.rssi_stability_weight)
+        if score is None:
+            band = -math.inf
         else:
-            return self.last_connection_attempt < other.last_connection_attempt
+            band = -math.floor(score / config.rssi_priority_band)
+
+        if self.last_connection_attempt is None:
+            last_attempt = -math.inf
+        else:
+            last_attempt = self.last_connection_attempt
+
+        return (failing, band, last_attempt)
 
 
 class ConnectionMgr:
-    def __init__(self, config: Configuration, scnr: Scanner, output_queue: Queue):
+    """
+    Connection attempts are scheduled from events instead of by repeatedly
+    checking every known device:
+
+        - The scanner reports every sighting of a matching device. Devices
+          that could be connected to are placed into a priority queue.
+
+        - Connections report state changes. Finished connections are cleaned
+          up, and their device is queued again.
+
+    Whenever something happened, as many free connection slots as possible
+    are filled from the queue. Every connection attempt is placed on the
+    least loaded adapter that has room for it. Every 'mgr_interval' seconds, all devices are
+    additionally re-checked, as a safety net.
+    """
+
+    def __init__(self, config: Configuration, scnr: Scanner, output_queue: Queue,
+                 registry: Union[None, Registry] = None):
         self.config = config
         self.scnr = scnr
+        self.registry = registry
         self.connections = {}  # type: Dict[str, ManagedConnection]
         self.tasks = []
         self.output_queue = output_queue
 
+        # Connection candidates, as (priority, sequence number, address).
+        # Entries are not removed when they become outdated, instead they are
+        # skipped if they don't match the connection's 'queue_entry':
+        self.queue = []  # type: List[Tuple[Tuple[float, float], int, str]]
+        self.queue_seq = 0
+
+        # Connections that are currently connecting or connected, and those
+        # that have just finished:
+        self.active = set()  # type: Set[str]
+        self.finished = []  # type: List[str]
+
+        # Connection outcomes of every device ever seen, by address:
+        self.history = self._load_history()  # type: Dict[str, ConnectionHistory]
+        self.history_dirty = False
+        self.history_saved = time.monotonic()
+
+        self.adapters = config.get_adapters()
+
+        # Characteristic timeouts of all connections:
+        self.deadlines = DeadlineScheduler()
+
+        self.wakeup = Event()
+        self.scnr.sighting_callbacks.append(self._on_sighting)
+
     async def run(self, halt: Event):
         log = logging.getLogger('log')
         try:
+            self._update_connection_information()
+            last_full_update = time.monotonic()
             while not halt.is_set():
-                self._update_connection_information()
+                try:
+                    timeout = max(0.0, last_full_update + self.config.mgr_interval - time.monotonic())
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+                # Safety net, even if something keeps waking the manager up:
+                if time.monotonic() - last_full_update >= self.config.mgr_interval:
+                    self._update_connection_information()
+                    last_full_update = time.monotonic()
+
+                if halt.is_set():
+                    break
+
+                self._cleanup_finished()
                 self._manage_connections(halt)
-                await asyncio.sleep(self.config.mgr_interval)
+
+                if self.history_dirty and time.monotonic() - self.history_saved > history_save_interval_s:
+                    self._save_history()
 
         except Exception as e:
             log.error('ConnectionMgr encountered an exception: %s' % str(e))
@@ -74,8 +210,33 @@ class ConnectionMgr:
             halt.set()
         finally:
             await asyncio.gather(*self.tasks)
+            if self.history_dirty:
+                self._save_history()
             print('ConnectionMgr shut down...')
 
+    def _on_sighting(self, seen_device: SeenDevice):
+        con = self.connections.get(seen_device.adr, None)
+        if con is None:
+            con = ManagedConnection(
+                last_connection_attempt=None,
+                scanner_information=seen_device,
+                active_connection=None,
+                history=self._get_history(seen_device.adr),
+            )
+            self.connections[seen_device.adr] = con
+        else:
+            con.scanner_information = seen_device
+
+        if self._enqueue(con):
+            self.wakeup.set()
+
+    def _on_state_change(self, active_connection: ActiveConnection):
+        # Both a finished connection and one that is no longer connecting
+        # can free up a slot:
+        if active_connection.state == ConnectionState.DISCONNECTED:
+            self.finished.append(active_connection.adr)
+        self.wakeup.set()
+
     def _update_connection_information(self):
         # Pickup new devices/updates from scanner:
         for seen_device in self.scnr.seen_devices.values():
@@ -87,45 +248,209 @@ class ConnectionMgr:
                     last_connection_attempt=None,
                     scanner_information=seen_device,
                     active_connection=None,
+                    history=self._get_history(seen_device.adr),
                 )
                 self.connections[seen_device.adr] = con
 
+            self._enqueue(con)
+
+    def _cleanup_finished(self):
         # Cleanup dropped connections:
-        for d in self.connections.values():
-            if d.state() == ConnectionState.DISCONNECTED:
+        for adr in self.finished:
+            d = self.connections[adr]
+            if d.state() == ConnectionState.DISCONNECTED and d.active_connection is not None:
+                d.past_decoder_errors += d.active_connection.decoder_errors
+                self._record_outcome(d, d.active_connection)
                 d.active_connection = None
+            self.active.discard(adr)
+            self._enqueue(d)
+        self.finished.clear()
+
+    def _record_outcome(self, con: ManagedConnection, active_connection: ActiveConnection):
+        log = logging.getLogger('log')
+        history = con.history
+        self.history_dirty = True
+
+        name = con.scanner_information.get_name_repr()
+        durations = format_durations(active_connection.durations)
+
+        if active_connection.failure is None and active_connection.initial_connection_time is not None:
+            con.timing.record(active_connection.durations, None)
+            log.info('Connection to %s ended normally (%s).' % (name, durations))
+            history.successes += 1
+            history.consecutive_failures = 0
+            history.retry_after = 0
+            return
+
+        failure = active_connection.failure
+        if failure is None:
+            failure = FailureType.CONNECT_FAILED
+
+        con.timing.record(active_connection.durations, str(failure))
+        log.info('Connection to %s failed: %s (%s).' % (name, failure, durations))
+
+        history.failures[str(failure)] = history.failures.get(str(failure), 0) + 1
+        history.consecutive_failures += 1
+        history.last_failure = str(failure)
+
+        # Exponential backoff with jitter:
+        delay = self.config.backoff_initial_s * failure_backoff_weights[failure]
+        delay *= 2 ** min(history.consecutive_failures - 1, 32)
+        delay = min(delay, self.config.backoff_max_s)
+        delay *= 1 - self.config.backoff_jitter * random.random()
+        history.retry_after = time.time() + delay
+
+        log.info('Retrying %s in %.0fs (%s, %i failures in a row).' %
+                 (name, delay, failure, history.consecutive_failures))
+
+        asyncio.get_running_loop().call_later(delay + 0.01, self._on_backoff_expired, con.scanner_information.adr)
+
+    def _on_backoff_expired(self, adr: str):
+        if self._enqueue(self.connections[adr]):
+            self.wakeup.set()
+
+    def _get_history(self, adr: str) -> ConnectionHistory:
+        if adr not in self.history:
+            self.history[adr] = ConnectionHistory()
+        return self.history[adr]
+
+    def _load_history(self) -> Dict[str, ConnectionHistory]:
+        log = logging.getLogger('log')
+        path = self.config.connection_history_file
+        if path is None or not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, 'r') as f:
+                raw = json.load(f)
+            return {adr: ConnectionHistory(**h) for adr, h in raw.items()}
+        except (OSError, ValueError, TypeError) as e:
+            log.warning('Failed to load connection history from %s: %s' % (path, str(e)))
+            return {}
+
+    def _save_history(self):
+        log = logging.getLogger('log')
+        self.history_dirty = False
+        self.history_saved = time.monotonic()
+
+        path = self.config.connection_history_file
+        if path is None:
+            return
+
+        # Write to a temporary file first, so a crash can't leave a corrupt file:
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({adr: asdict(h) for adr, h in self.history.items()}, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning('Failed to save connection history to %s: %s' % (path, str(e)))
+
+    def _enqueue(self, con: ManagedConnection) -> bool:
+        """Queue a connection as a candidate, if possible. Returns True if it was (re-)queued."""
+        if not con.ready_to_connect() or con.signal_too_weak(self.config):
+            return False
+
+        priority = con.priority(self.config)
+        if con.queue_entry is not None and con.queue_entry[0] == priority:
+            return False
+
+        self.queue_seq += 1
+        con.queue_entry = (priority, self.queue_seq, con.scanner_information.adr)
+        heapq.heappush(self.queue, con.queue_entry)
+
+        # Drop outdated entries if they start to pile up:
+        if len(self.queue) > 2 * len(self.connections) + 16:
+            self.queue = [c.queue_entry for c in self.connections.values() if c.queue_entry is not None]
+            heapq.heapify(self.queue)
+
+        return True
+
+    def _next_candidate(self) -> Union[None, ManagedConnection]:
+        while len(self.queue) != 0:
+            entry = heapq.heappop(self.queue)
+            con = self.connections[entry[2]]
+            if con.queue_entry is not entry:
+                continue  # Outdated
+            con.queue_entry = None
+
+            # Things may have changed since the device was queued:
+            if con.ready_to_connect() and not con.signal_too_weak(self.config):
+                return con
+        return None
+
+    def adapter_load(self) -> Dict[Union[None, str], Tuple[int, int]]:
+        """Count active (including connecting) and connecting connections per adapter"""
+        load = {a.name: (0, 0) for a in self.adapters}
+        for adr in self.active:
+            con = self.connections[adr]
+            if con.active_connection is None:
+                continue
+            active, connecting = load[con.active_connection.adapter]
+            state = con.state()
+            if state == ConnectionState.CONNECTED:
+                active += 1
+            if state == ConnectionState.CONNECTING:
+                active += 1
+                connecting += 1
+            load[con.active_connection.adapter] = (active, connecting)
+        return load
+
+    def _pick_adapter(self, load: Dict[Union[None, str], Tuple[int, int]]) -> Union[None, Adapter]:
+        """Find the least loaded adapter that has room for another connection attempt"""
+        best = None
+        best_load = None
+        for adapter in self.adapters:
+            active, connecting = load[adapter.name]
+            if active >= adapter.max_active_connections:
+                continue
+            if connecting >= adapter.max_simultaneous_connection_attempts:
+                continue
+            adapter_load = active / adapter.max_active_connections
+            if best is None or adapter_load < best_load:
+                best = adapter
+                best_load = adapter_load
+        return best
 
     def _manage_connections(self, halt: Event):
         log = logging.getLogger('log')
 
-        # Count active and connecting connections
-        active_connection_count = 0
-        connecting_connection_count = 0
-        for d in self.connections.values():
-            if d.state() == ConnectionState.CONNECTED:
-                active_connection_count += 1
-            if d.state() == ConnectionState.CONNECTING:
-                active_connection_count += 1
-                connecting_connection_count += 1
-
-        # If there is space for more connections, spawn one:
-        if active_connection_count < self.config.max_active_connections:
-            if connecting_connection_count < self.config.max_simultaneous_connection_attempts:
-                # First, find all possible connections:
-                possible_connections = [c for c in self.connections.values() if c.ready_to_connect()]
-
-                if len(possible_connections) != 0:
-
-                    # Prioritise Connections that have never been connected, or whose
-                    # last connection attempt lies further back:
-                    possible_connections.sort()
-                    next_con = possible_connections[0]
-
-                    log.info('Attempting to connect to %s' % next_con.scanner_information.get_name_repr())
-                    next_con.last_connection_attempt = time.monotonic_ns()
-                    adr = next_con.scanner_information.adr
-                    name = next_con.scanner_information.get_name_repr()
-
-                    next_con.active_connection = ActiveConnection(adr, name, self.config, self.output_queue)
-                    task = asyncio.create_task(next_con.active_connection.run(halt))
-                    self.tasks.append(task)
+        load = self.adapter_load()
+
+        # Fill all free slots, strongest/most stable signals and those that
+        # have waited the longest first:
+        while True:
+            adapter = self._pick_adapter(load)
+            if adapter is None:
+                break
+
+            next_con = self._next_candidate()
+            if next_con is None:
+                break
+
+            if adapter.name is None:
+                log.info('Attempting to connect to %s' % next_con.scanner_information.get_name_repr())
+            else:
+                log.info('Attempting to connect to %s via %s' %
+                         (next_con.scanner_information.get_name_repr(), adapter.name))
+            next_con.last_connection_attempt = time.monotonic_ns()
+            adr = next_con.scanner_information.adr
+            name = next_con.scanner_information.get_name_repr()
+
+            # The scanner's BLEDevice can only be used with the adapter that saw it:
+            ble_device = None
+            if next_con.scanner_information.seen_by == adapter.name:
+                ble_device = next_con.scanner_information.ble_device
+
+            next_con.active_connection = ActiveConnection(adr, name, self.config, self.output_queue,
+                                                          state_callback=self._on_state_change,
+                                                          adapter=adapter.name,
+                                                          deadlines=self.deadlines,
+                                                          ble_device=ble_device,
+                                                          registry=self.registry)
+            task = asyncio.create_task(next_con.active_connection.run(halt))
+            self.tasks.append(task)
+            self.active.add(adr)
+
+            active, connecting = load[adapter.name]
+            load[adapter.name] = (active + 1, connecting + 1)
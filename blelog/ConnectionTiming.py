@@ -0,0 +1,93 @@
+"""
+blelog/ConnectionTiming.py
+Durations of the phases of connection attempts, and their outcomes.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Phases of a connection:
+    - resolve: Scanning for the device, if the scanner's BLEDevice could not
+      be used.
+    - connect: Establishing the link *and* discovering services. bleak does
+      both in a single call, so they can't be timed separately.
+    - notify: Enabling notifications for all characteristics.
+    - disconnect: Disconnecting, once the connection ends.
+
+For every device, the most recent attempts are kept to calculate quantiles
+and success rates. Bucket counts over all attempts are kept for metrics.
+"""
+import bisect
+from collections import deque
+from typing import Deque, Dict, List, Union
+
+phases = ['resolve', 'connect', 'notify', 'disconnect']
+
+# Upper bounds of the histogram buckets (in seconds):
+phase_buckets_s = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0]
+
+# Number of recent attempts kept per device:
+timing_history_len = 50
+
+
+class PhaseHistogram:
+    def __init__(self) -> None:
+        self.bounds = phase_buckets_s
+        # One count per bucket, plus one for anything above the last bound:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum_s = 0.0
+        self.recent = deque(maxlen=timing_history_len)  # type: Deque[float]
+
+    def record(self, duration_s: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, duration_s)] += 1
+        self.count += 1
+        self.sum_s += duration_s
+        self.recent.append(duration_s)
+
+    def quantile(self, q: float) -> Union[None, float]:
+        """Quantile 'q' of the recent durations"""
+        if len(self.recent) == 0:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ConnectionTiming:
+    def __init__(self) -> None:
+        self.phases = {p: PhaseHistogram() for p in phases}  # type: Dict[str, PhaseHistogram]
+
+        # Outcomes of recent attempts (None for success, otherwise the
+        # failure type):
+        self.outcomes = deque(maxlen=timing_history_len)  # type: Deque[Union[None, str]]
+        self.attempts = 0
+
+    def record(self, durations: Dict[str, float], failure: Union[None, str]) -> None:
+        for phase, duration_s in durations.items():
+            self.phases[phase].record(duration_s)
+        self.outcomes.append(failure)
+        self.attempts += 1
+
+    def success_rate(self) -> Union[None, float]:
+        """Fraction of recent attempts that succeeded"""
+        if len(self.outcomes) == 0:
+            return None
+        return sum(1 for o in self.outcomes if o is None) / len(self.outcomes)
+
+    def recent_failures(self) -> Dict[str, int]:
+        counts = {}  # type: Dict[str, int]
+        for o in self.outcomes:
+            if o is not None:
+                counts[o] = counts.get(o, 0) + 1
+        return counts
+
+
+def format_durations(durations: Dict[str, float]) -> str:
+    parts = []  # type: List[str]
+    for phase in phases:
+        if phase in durations:
+            parts.append('%s %.2fs' % (phase, durations[phase]))
+    return ', '.join(parts)
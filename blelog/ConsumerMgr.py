@@ -17,7 +17,7 @@ from abc import ABC, abstractmethod
 from asyncio import Event, Queue
 from asyncio.queues import QueueFull
 from dataclasses import dataclass
-from typing import Any, List, Union
+from typing import Any, List, Sequence, Union
 
 from blelog.Configuration import Characteristic, Configuration
 
@@ -25,6 +25,23 @@ warn_thsh = 300
 warn_timeout_ns = 60e9
 
 
+class LatencyStats:
+    """
+    Running count, sum and maximum of durations (in seconds).
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, duration_s: float) -> None:
+        self.count += 1
+        self.total_s += duration_s
+        if duration_s > self.max_s:
+            self.max_s = duration_s
+
+
 class Consumer(ABC):
     """
     Basic interface for a data consumer.
@@ -34,10 +51,16 @@ class Consumer(ABC):
         self.input_q = Queue()
         self.last_full_queue_warning = None  # type: Union[int, None]
 
+        # Time spent writing/processing data, for consumers that measure it:
+        self.write_latency = LatencyStats()
+
     @abstractmethod
     async def run(self, halt: Event) -> None:
         pass
 
+    def name(self) -> str:
+        return self.__class__.__name__
+
     def should_queue_warn(self) -> bool:
         if self.last_full_queue_warning is None:
             return True
@@ -47,11 +70,48 @@ class Consumer(ABC):
 
 @dataclass
 class NotifData:
+    """
+    Decoded data of one or more notifications from the same device and
+    characteristic.
+
+    Data is stored either as rows ('data', from a characteristic's
+    data_decoder) or as columns ('columns', from its batch_decoder). Use
+    rows() and cols() to access it in either form, the conversion is only
+    done when needed. All rows (and all columns) must have the same length.
+
+    'device_id' and 'char_id' are the ids assigned by the Registry, or -1 if
+    the data was not tagged with them.
+    """
     device_adr: str
     device_name_repr: str
     characteristic: Characteristic
-    data: List[List[Any]]
+    data: Union[None, List[List[Any]]]
     data_raw: bytearray
+    columns: Union[None, List[Sequence[Any]]] = None
+    notif_count: int = 1
+    device_id: int = -1
+    char_id: int = -1
+
+    def rows(self) -> List[List[Any]]:
+        if self.data is None:
+            # Convert numpy arrays to lists of python values:
+            cols = [c.tolist() if hasattr(c, 'tolist') else c for c in self.columns]
+            self.data = [list(row) for row in zip(*cols)]
+        return self.data
+
+    def cols(self) -> List[Sequence[Any]]:
+        if self.columns is None:
+            # zip(...) would silently drop values of longer rows:
+            width = len(self.data[0]) if len(self.data) != 0 else 0
+            if any(len(row) != width for row in self.data):
+                raise ValueError('Rows of characteristic %s have different lengths' % self.characteristic.name)
+            self.columns = [list(col) for col in zip(*self.data)]
+        return self.columns
+
+    def row_count(self) -> int:
+        if self.data is not None:
+            return len(self.data)
+        return len(self.columns[0]) if len(self.columns) != 0 else 0
 
 
 class ConsumerMgr:
@@ -90,7 +150,7 @@ class ConsumerMgr:
         for consumer in self.consumers:
             tsk = asyncio.create_task(consumer.run(halt))
             self.consumer_tasks.append(tsk)
-            log.info('Consumer %s enabled!' % consumer.__class__.__name__)
+            log.info('Consumer %s enabled!' % consumer.name())
 
     async def _distribute_data(self):
         log = logging.getLogger('log')
@@ -101,7 +161,7 @@ class ConsumerMgr:
                 try:
                     consumer.input_q.put_nowait(next_data)
                 except QueueFull:
-                    log.warning('Consumer %s did not accept data!' % type(consumer).__name__)
+                    log.warning('Consumer %s did not accept data!' % consumer.name())
             self.input_q.task_done()
 
         except asyncio.TimeoutError:
@@ -113,5 +173,5 @@ class ConsumerMgr:
         for consumer in self.consumers:
             if consumer.input_q.qsize() > warn_thsh:
                 log.warning('The input queue of consumer %s has more than %i items, is the consumer keeping up?'
-                            % (type(consumer).__name__, consumer.input_q.qsize()))
+                            % (consumer.name(), consumer.input_q.qsize()))
                 consumer.last_full_queue_warning = time.monotonic_ns()
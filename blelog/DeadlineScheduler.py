@@ -0,0 +1,113 @@
+"""
+blelog/DeadlineScheduler.py
+A single timer, shared by all connections, that fires callbacks at their
+deadlines.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Deadlines are kept in a heap, and only one event loop timer (for the
+earliest deadline) is armed at any time.
+
+Deadlines are meant to be extended lazily: Instead of rescheduling on every
+notification, a callback is called once its deadline is reached, checks
+whether it actually expired, and returns a new deadline if not. While data
+is flowing, each characteristic timeout therefore costs one callback per
+timeout period, independent of the notification rate.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, List, Union
+
+# Callbacks are called with the current time (time.monotonic()), and return
+# a new deadline, or None if they should not be called again:
+DeadlineCallback = Callable[[float], Union[None, float]]
+
+
+class DeadlineScheduler:
+    def __init__(self) -> None:
+        # Heap of [deadline, sequence number, key, callback, active]:
+        self.heap = []  # type: List[List[Any]]
+        self.entries = {}  # type: Dict[Hashable, List[Any]]
+        self.seq = 0
+
+        self.timer = None  # type: Union[None, asyncio.TimerHandle]
+        self.timer_deadline = None  # type: Union[None, float]
+
+    def schedule(self, key: Hashable, deadline: float, callback: DeadlineCallback) -> None:
+        """Call 'callback' at 'deadline' (in time.monotonic() seconds). Replaces any deadline with the same key."""
+        self.cancel(key)
+
+        self.seq += 1
+        entry = [deadline, self.seq, key, callback, True]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        self._rearm()
+
+    def cancel(self, key: Hashable) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            # Removed from the heap once it reaches the top:
+            entry[4] = False
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _rearm(self) -> None:
+        # Drop cancelled entries:
+        while len(self.heap) != 0 and not self.heap[0][4]:
+            heapq.heappop(self.heap)
+
+        if len(self.heap) == 0:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+                self.timer_deadline = None
+            return
+
+        earliest = self.heap[0][0]
+        if self.timer is not None:
+            if self.timer_deadline == earliest:
+                return
+            self.timer.cancel()
+
+        loop = asyncio.get_running_loop()
+        self.timer_deadline = earliest
+        self.timer = loop.call_at(loop.time() + (earliest - time.monotonic()), self._fire)
+
+    def _fire(self) -> None:
+        log = logging.getLogger('log')
+        self.timer = None
+        self.timer_deadline = None
+
+        now = time.monotonic()
+        while len(self.heap) != 0 and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not entry[4]:
+                continue
+
+            try:
+                new_deadline = entry[3](now)
+            except Exception as e:
+                log.error('Deadline callback raised an exception: %s' % str(e))
+                log.exception(e)
+                new_deadline = None
+
+            # The callback may have cancelled or replaced its own entry:
+            if not entry[4]:
+                continue
+
+            if new_deadline is None:
+                entry[4] = False
+                del self.entries[entry[2]]
+            else:
+                entry[0] = new_deadline
+                heapq.heappush(self.heap, entry)
+
+        self._rearm()
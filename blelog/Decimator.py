@@ -0,0 +1,103 @@
+"""
+blelog/Decimator.py
+Streaming min/max decimation of plot data.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Incoming samples are split into buckets, and each bucket is replaced by its
+minimum and maximum (in the order they occurred). This keeps spikes visible
+while limiting the number of points that are passed on.
+
+The bucket size is adjusted to the measured input sample rate, so that the
+output rate stays at roughly 'point_budget' points per 'window_s' seconds,
+no matter how fast data arrives.
+
+All columns of a characteristic are decimated together with the same bucket
+boundaries, so they stay aligned.
+"""
+import math
+import time
+
+import numpy as np
+
+# How often (in seconds) the input rate is re-estimated:
+rate_update_period_s = 1.0
+
+# Smoothing factor for the input rate estimate:
+rate_alpha = 0.5
+
+
+class MinMaxDecimator:
+    def __init__(self, column_count: int, point_budget: int, window_s: float):
+        self.column_count = column_count
+        self.target_rate = point_budget / window_s
+        self.bucket_size = 1
+
+        self._pending = np.empty((column_count, 0), dtype=np.float64)
+
+        self._rate = None
+        self._rate_t0 = None
+        self._rate_n = 0
+
+    def process(self, columns: np.ndarray) -> np.ndarray:
+        """
+        Decimate new samples. 'columns' has shape (column_count, n).
+        Returns an array of shape (column_count, m), where m may be zero.
+        """
+        self._update_rate(columns.shape[1])
+
+        if self._pending.shape[1] != 0:
+            columns = np.concatenate((self._pending, columns), axis=1)
+
+        b = self.bucket_size
+        if b <= 1:
+            self._pending = columns[:, :0]
+            return columns
+
+        n_full = columns.shape[1] // b
+        self._pending = columns[:, n_full*b:]
+        if n_full == 0:
+            return columns[:, :0]
+
+        buckets = columns[:, :n_full*b].reshape(self.column_count, n_full, b)
+        arg_min = buckets.argmin(axis=2)
+        arg_max = buckets.argmax(axis=2)
+        mins = np.take_along_axis(buckets, arg_min[..., None], axis=2)[..., 0]
+        maxs = np.take_along_axis(buckets, arg_max[..., None], axis=2)[..., 0]
+
+        # Keep the order in which min and max occurred:
+        min_first = arg_min <= arg_max
+        first = np.where(min_first, mins, maxs)
+        second = np.where(min_first, maxs, mins)
+
+        return np.stack((first, second), axis=2).reshape(self.column_count, 2*n_full)
+
+    def _update_rate(self, n: int) -> None:
+        t = time.monotonic()
+        if self._rate_t0 is None:
+            self._rate_t0 = t
+            return
+
+        self._rate_n += n
+        delta = t - self._rate_t0
+        if delta < rate_update_period_s:
+            return
+
+        rate = self._rate_n / delta
+        if self._rate is None:
+            self._rate = rate
+        else:
+            self._rate = rate_alpha * rate + (1 - rate_alpha) * self._rate
+
+        self._rate_t0 = t
+        self._rate_n = 0
+
+        # Each bucket produces two points. Buckets of two or fewer samples
+        # don't reduce anything:
+        b = math.ceil(2 * self._rate / self.target_rate)
+        self.bucket_size = b if b > 2 else 1
@@ -0,0 +1,216 @@
+"""
+blelog/LoopMonitor.py
+Measures event loop scheduling delay ('lag'), and identifies callbacks that
+block the loop for too long.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+A lightweight replacement for asyncio's debug mode:
+
+    - A periodic timer measures how late it is woken up, and records the
+      delay in a histogram.
+
+    - A watchdog thread checks that the timer keeps running. If it stalls
+      for longer than 'loop_slow_callback_s', the watchdog grabs the stack
+      of the event loop thread to find out what is blocking it. Once the
+      loop recovers, the stall is logged together with that source.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from asyncio import Event
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Union
+
+from blelog.Configuration import Configuration
+
+# Upper bounds of the lag histogram buckets (in seconds):
+lag_buckets_s = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+# Number of slow callbacks remembered for display:
+slow_history_len = 10
+
+# Minimum time (in seconds) between two log warnings about the same source:
+slow_warn_timeout_s = 60
+
+# Code from these folders is considered BLELog's/the user's, and preferred
+# when determining the source of a stall:
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LagHistogram:
+    def __init__(self) -> None:
+        self.bounds = lag_buckets_s
+        # One count per bucket, plus one for anything above the last bound:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, lag_s: float) -> None:
+        self.count += 1
+        self.sum_s += lag_s
+        self.max_s = max(self.max_s, lag_s)
+
+        for i, bound in enumerate(self.bounds):
+            if lag_s <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing quantile 'q' (at most the maximum seen)."""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(self.bounds[i], self.max_s) if i < len(self.bounds) else self.max_s
+        return self.max_s
+
+
+@dataclass
+class SlowCallback:
+    source: str
+    task_name: str
+    duration_s: float
+    wall_time: float
+
+
+class LoopLagMonitor:
+    def __init__(self, config: Configuration) -> None:
+        self.config = config
+        self.histogram = LagHistogram()
+        self.recent_slow = deque(maxlen=slow_history_len)  # type: Deque[SlowCallback]
+        self.slow_counts = {}  # type: Dict[str, int]
+
+        self.loop = None  # type: Union[asyncio.AbstractEventLoop, None]
+        self.heartbeat = time.monotonic()
+
+        # Written by the watchdog thread: The source that was running during
+        # the current stall, keyed by the heartbeat it was detected at.
+        self._stall_source = None  # type: Union[None, tuple]
+
+        self._last_warning = {}  # type: Dict[str, float]
+        self._watchdog_stop = threading.Event()
+
+    async def run(self, halt: Event) -> None:
+        log = logging.getLogger('log')
+        self.loop = asyncio.get_running_loop()
+        watchdog = threading.Thread(target=self._watchdog, name='LoopWatchdog', daemon=True)
+        interval = self.config.loop_monitor_interval_s
+
+        try:
+            watchdog.start()
+            while not halt.is_set():
+                t_start = time.monotonic()
+                self.heartbeat = t_start
+                await asyncio.sleep(interval)
+
+                t_end = time.monotonic()
+                self.heartbeat = t_end
+                lag = max(0.0, t_end - t_start - interval)
+                self.histogram.record(lag)
+
+                if lag >= self.config.loop_slow_callback_s:
+                    self._report_stall(t_start, lag)
+
+        except Exception as e:
+            log.error('Loop monitor encountered an exception: %s' % str(e))
+            log.exception(e)
+            halt.set()
+        finally:
+            self._watchdog_stop.set()
+            print('Loop monitor shut down...')
+
+    def _report_stall(self, heartbeat: float, lag: float) -> None:
+        log = logging.getLogger('log')
+
+        stall = self._stall_source
+        self._stall_source = None
+        if stall is not None and stall[0] == heartbeat:
+            _, source, task_name = stall
+        else:
+            # The watchdog did not catch it (for example because the loop was
+            # blocked in C code that held on to the GIL):
+            source, task_name = 'unknown', 'unknown'
+
+        slow = SlowCallback(source, task_name, lag, time.time())
+        self.recent_slow.append(slow)
+        self.slow_counts[source] = self.slow_counts.get(source, 0) + 1
+
+        t = time.monotonic()
+        if t - self._last_warning.get(source, -slow_warn_timeout_s) >= slow_warn_timeout_s:
+            self._last_warning[source] = t
+            log.warning('Event loop blocked for %ims by %s (task %s).' % (round(lag * 1e3), source, task_name))
+
+    def _watchdog(self) -> None:
+        loop_thread_id = threading.main_thread().ident
+        threshold = self.config.loop_slow_callback_s
+        check_interval = min(threshold / 4, self.config.loop_monitor_interval_s)
+
+        while not self._watchdog_stop.wait(check_interval):
+            heartbeat = self.heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.config.loop_monitor_interval_s
+            if stalled_for < threshold:
+                continue
+
+            # Only capture the first sighting of each stall:
+            if self._stall_source is not None and self._stall_source[0] == heartbeat:
+                continue
+
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+
+            task_name = '<no task>'
+            if self.loop is not None:
+                task = asyncio.current_task(self.loop)
+                if task is not None:
+                    task_name = task.get_name()
+
+            self._stall_source = (heartbeat, _find_source(frame), task_name)
+
+    def summary_lines(self) -> List[str]:
+        h = self.histogram
+        lines = ['Lag (ms): p50 %.0f   p90 %.0f   p99 %.0f   max %.0f   (%i samples)' % (
+            h.quantile(0.5) * 1e3, h.quantile(0.9) * 1e3, h.quantile(0.99) * 1e3, h.max_s * 1e3, h.count)]
+
+        for slow in reversed(self.recent_slow):
+            t = time.strftime('%H:%M:%S', time.localtime(slow.wall_time))
+            lines.append('%s  %5ims  %s (task %s)' % (t, round(slow.duration_s * 1e3), slow.source, slow.task_name))
+        return lines
+
+
+def _is_project_file(filename: str) -> bool:
+    filename = os.path.abspath(filename)
+    return (filename.startswith(project_dir)
+            and 'site-packages' not in filename
+            and filename != os.path.abspath(__file__))
+
+
+def _find_source(frame) -> str:
+    """Describe the innermost frame that belongs to BLELog, or the innermost frame."""
+    innermost = frame
+    while frame is not None and not _is_project_file(frame.f_code.co_filename):
+        frame = frame.f_back
+
+    if frame is None:
+        frame = innermost
+
+    filename = frame.f_code.co_filename
+    if _is_project_file(filename):
+        filename = os.path.relpath(filename, project_dir)
+
+    return '%s:%i(%s)' % (filename, frame.f_lineno, frame.f_code.co_name)
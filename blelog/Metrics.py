@@ -0,0 +1,295 @@
+"""
+blelog/Metrics.py
+Serves performance metrics over HTTP in the Prometheus text exposition
+format, for scraping headless BLELog instances.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Metrics are collected on request directly from the running components, so
+serving them costs nothing unless the endpoint is being scraped.
+"""
+import asyncio
+import logging
+import time
+from asyncio import Event, StreamReader, StreamWriter
+from typing import Dict, List, Union
+
+from blelog.ActiveConnection import ConnectionState
+from blelog.Configuration import Configuration
+from blelog.ConnectionMgr import ConnectionMgr
+from blelog.ConsumerMgr import ConsumerMgr
+from blelog.consumers.log2csv import Consumer_log2csv
+from blelog.consumers.plotter import Consumer_plotter
+from blelog.consumers.sequence import Consumer_sequence
+from blelog.consumers.throughput import Consumer_throughput
+from blelog.consumers.worker import Consumer_worker
+from blelog.LoopMonitor import LoopLagMonitor
+from blelog.Scanner import Scanner, SeenDeviceState
+
+# Timeout (in seconds) for receiving a request:
+request_timeout_s = 5
+
+
+class MetricsWriter:
+    """
+    Collects metrics and renders them in the Prometheus text format.
+    Samples can be added in any order, and are grouped by metric on output.
+    """
+
+    def __init__(self) -> None:
+        self.families = {}  # type: Dict[str, List[str]]
+
+    def add(self, name: str, mtype: str, doc: str, value: float,
+            labels: Union[None, Dict[str, str]] = None) -> None:
+        family = self._family(name, mtype, doc)
+        family.append(self._sample(name, value, labels))
+
+    def add_histogram(self, name: str, doc: str, bounds: List[float], counts: List[int], total: float,
+                      labels: Union[None, Dict[str, str]] = None) -> None:
+        """'counts' holds one count per bound, plus one for values above the last bound."""
+        family = self._family(name, 'histogram', doc)
+        labels = labels or {}
+        cumulative = 0
+        for bound, c in zip(bounds, counts):
+            cumulative += c
+            family.append(self._sample(name + '_bucket', cumulative, {**labels, 'le': repr(float(bound))}))
+        cumulative += counts[-1]
+        family.append(self._sample(name + '_bucket', cumulative, {**labels, 'le': '+Inf'}))
+        family.append(self._sample(name + '_sum', total, labels))
+        family.append(self._sample(name + '_count', cumulative, labels))
+
+    def add_summary(self, name: str, doc: str, total: float, count: int,
+                    labels: Union[None, Dict[str, str]] = None) -> None:
+        family = self._family(name, 'summary', doc)
+        family.append(self._sample(name + '_sum', total, labels))
+        family.append(self._sample(name + '_count', count, labels))
+
+    def _family(self, name: str, mtype: str, doc: str) -> List[str]:
+        if name not in self.families:
+            self.families[name] = ['# HELP %s %s' % (name, doc), '# TYPE %s %s' % (name, mtype)]
+        return self.families[name]
+
+    def _sample(self, name: str, value: float, labels: Union[None, Dict[str, str]]) -> str:
+        if labels:
+            label_str = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+            return '%s{%s} %s' % (name, label_str, _fmt(value))
+        return '%s %s' % (name, _fmt(value))
+
+    def render(self) -> str:
+        return ''.join('\n'.join(lines) + '\n' for lines in self.families.values())
+
+
+def _escape(v: str) -> str:
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt(v: float) -> str:
+    if isinstance(v, int):
+        return str(v)
+    return repr(float(v))
+
+
+class MetricsServer:
+    def __init__(self, config: Configuration, scnr: Scanner, con_mgr: ConnectionMgr,
+                 consume_mgr: ConsumerMgr, loop_monitor: LoopLagMonitor) -> None:
+        self.config = config
+        self.scnr = scnr
+        self.con_mgr = con_mgr
+        self.consume_mgr = consume_mgr
+        self.loop_monitor = loop_monitor
+
+    async def run(self, halt: Event) -> None:
+        log = logging.getLogger('log')
+        server = None
+        try:
+            server = await asyncio.start_server(self._handle, self.config.metrics_host, self.config.metrics_port)
+            log.info('Serving metrics on %s:%i' % (self.config.metrics_host, self.config.metrics_port))
+            await halt.wait()
+        except OSError as e:
+            # Metrics are optional, don't take BLELog down with them:
+            log.error('Failed to start metrics server: %s' % str(e))
+        except Exception as e:
+            log.error('Metrics server encountered an exception: %s' % str(e))
+            log.exception(e)
+            halt.set()
+        finally:
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            print('Metrics server shut down...')
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter) -> None:
+        log = logging.getLogger('log')
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=request_timeout_s)
+            request_line = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+
+            if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1] in ('/', '/metrics'):
+                body = self.collect().encode('utf-8')
+                status = '200 OK'
+            else:
+                body = b'Not Found\n'
+                status = '404 Not Found'
+
+            writer.write(('HTTP/1.0 %s\r\n'
+                          'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                          'Content-Length: %i\r\n'
+                          'Connection: close\r\n\r\n' % (status, len(body))).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            log.warning('Metrics server failed to handle request: %s' % str(e))
+        finally:
+            writer.close()
+
+    def collect(self) -> str:
+        m = MetricsWriter()
+        self._collect_queues(m)
+        self._collect_scanner(m)
+        self._collect_connections(m)
+        self._collect_consumers(m)
+        self._collect_loop(m)
+        return m.render()
+
+    def _collect_queues(self, m: MetricsWriter) -> None:
+        doc = 'Number of items waiting in a queue.'
+        m.add('blelog_queue_depth', 'gauge', doc, self.con_mgr.output_queue.qsize(), {'queue': 'Connection Output'})
+
+        for consumer in self.consume_mgr.consumers:
+            m.add('blelog_queue_depth', 'gauge', doc, consumer.input_q.qsize(),
+                  {'queue': consumer.name()})
+
+            if isinstance(consumer, Consumer_log2csv):
+                for output in consumer.file_outputs.values():
+                    m.add('blelog_queue_depth', 'gauge', doc, output.input_q.qsize(), {'queue': output.file_path})
+
+    def _collect_scanner(self, m: MetricsWriter) -> None:
+        scnr = self.scnr
+        m.add('blelog_scanner_scans_total', 'counter', 'Completed scans.', scnr.scan_count)
+        m.add('blelog_scanner_advertisements_total', 'counter', 'Advertisements received.',
+              scnr.advertisement_count)
+        m.add('blelog_scanner_name_checks_total', 'counter', 'Device names checked against the name regexes.',
+              scnr.name_checks)
+        m.add('blelog_scanner_ignored_devices', 'gauge', 'Non-matching devices currently ignored by the scanner.',
+              len(scnr.ignored_devices))
+        m.add('blelog_scanner_known_devices', 'gauge', 'Devices known to the scanner.', len(scnr.seen_devices))
+        recently_seen = sum(1 for d in scnr.seen_devices.values() if d.state == SeenDeviceState.RECENTLY_SEEN)
+        m.add('blelog_scanner_recently_seen_devices', 'gauge', 'Devices recently seen by the scanner.', recently_seen)
+
+    def _collect_connections(self, m: MetricsWriter) -> None:
+        for adapter, (active, connecting) in self.con_mgr.adapter_load().items():
+            lbl = {'adapter': adapter if adapter is not None else 'default'}
+            m.add('blelog_adapter_connections', 'gauge', 'Connected and connecting devices per adapter.', active, lbl)
+            m.add('blelog_adapter_connection_attempts', 'gauge', 'Ongoing connection attempts per adapter.',
+                  connecting, lbl)
+
+        t = time.monotonic_ns()
+        for con in self.con_mgr.connections.values():
+            dev = {'device': con.scanner_information.get_name_repr(), 'address': con.scanner_information.adr}
+            state = con.state()
+
+            for s in ConnectionState:
+                m.add('blelog_connection_state', 'gauge', 'Current connection state (1 if in this state).',
+                      1 if state == s else 0, {**dev, 'state': str(s)})
+
+            duration = 0.0
+            if state == ConnectionState.CONNECTED and con.active_connection is not None:
+                if con.active_connection.initial_connection_time is not None:
+                    duration = (t - con.active_connection.initial_connection_time) / 1e9
+            m.add('blelog_connection_duration_seconds', 'gauge', 'Time since the current connection was established.',
+                  duration, dev)
+
+            if con.scanner_information.rssi is not None:
+                m.add('blelog_device_rssi_dbm', 'gauge', 'Last RSSI seen by the scanner.',
+                      con.scanner_information.rssi, dev)
+            if con.scanner_information.rssi_mean is not None:
+                m.add('blelog_device_rssi_mean_dbm', 'gauge', 'Smoothed RSSI.',
+                      con.scanner_information.rssi_mean, dev)
+                m.add('blelog_device_rssi_stddev_dbm', 'gauge', 'Standard deviation of the RSSI.',
+                      con.scanner_information.rssi_std(), dev)
+
+            m.add('blelog_decoder_errors_total', 'counter', 'Exceptions raised by characteristic decoders.',
+                  con.decoder_errors(), dev)
+
+            history = con.history
+            m.add('blelog_connection_successes_total', 'counter', 'Successful connections (including previous runs).',
+                  history.successes, dev)
+            for failure, n in history.failures.items():
+                m.add('blelog_connection_failures_total', 'counter', 'Failed connections (including previous runs).',
+                      n, {**dev, 'type': failure})
+            m.add('blelog_connection_backoff_seconds', 'gauge', 'Time until the next connection attempt is allowed.',
+                  max(0.0, history.retry_after - time.time()), dev)
+
+            for phase, hist in con.timing.phases.items():
+                if hist.count != 0:
+                    m.add_histogram('blelog_connection_phase_seconds', 'Duration of connection phases.',
+                                    hist.bounds, hist.counts, hist.sum_s, {**dev, 'phase': phase})
+            rate = con.timing.success_rate()
+            if rate is not None:
+                m.add('blelog_connection_recent_success_ratio', 'gauge', 'Success rate of recent connection attempts.',
+                      rate, dev)
+
+    def _collect_consumers(self, m: MetricsWriter) -> None:
+        for consumer in self.consume_mgr.consumers:
+            lbl = {'consumer': consumer.name()}
+            lat = consumer.write_latency
+            m.add_summary('blelog_consumer_write_seconds', 'Time spent writing data.', lat.total_s, lat.count, lbl)
+            m.add('blelog_consumer_write_seconds_max', 'gauge', 'Longest write.', lat.max_s, lbl)
+
+            if isinstance(consumer, Consumer_worker):
+                m.add('blelog_consumer_worker_restarts_total', 'counter', 'Restarts of the consumer\'s worker process.',
+                      consumer.restarts, lbl)
+            elif isinstance(consumer, Consumer_throughput):
+                self._collect_throughput(m, consumer)
+            elif isinstance(consumer, Consumer_sequence):
+                self._collect_sequence(m, consumer)
+            elif isinstance(consumer, Consumer_plotter):
+                self._collect_plotter(m, consumer)
+
+    def _collect_loop(self, m: MetricsWriter) -> None:
+        h = self.loop_monitor.histogram
+        m.add_histogram('blelog_loop_lag_seconds', 'Event loop scheduling delay.', h.bounds, h.counts, h.sum_s)
+        for source, n in self.loop_monitor.slow_counts.items():
+            m.add('blelog_loop_slow_callbacks_total', 'counter', 'Callbacks that blocked the event loop.', n,
+                  {'source': source})
+
+    def _collect_throughput(self, m: MetricsWriter, c: Consumer_throughput) -> None:
+        for (adr, char_name), ch in c.channels.items():
+            lbl = {'device': c.devices[adr].name, 'address': adr, 'characteristic': char_name}
+            m.add('blelog_notifications_per_second', 'gauge', 'Smoothed notification rate.', ch.notif_rate, lbl)
+            m.add('blelog_rows_per_second', 'gauge', 'Smoothed decoded row rate.', ch.row_rate, lbl)
+            m.add('blelog_bytes_per_second', 'gauge', 'Smoothed raw data rate.', ch.byte_rate, lbl)
+            m.add('blelog_notifications_total', 'counter', 'Notifications received.', ch.notifs_total, lbl)
+            m.add('blelog_rows_total', 'counter', 'Decoded rows received.', ch.rows_total, lbl)
+            m.add('blelog_bytes_total', 'counter', 'Raw bytes received.', ch.bytes_total, lbl)
+
+    def _collect_sequence(self, m: MetricsWriter, c: Consumer_sequence) -> None:
+        for (adr, char_name), s in c.stats.items():
+            lbl = {'device': s.device_name, 'address': adr, 'characteristic': char_name}
+            m.add('blelog_sequence_received_total', 'counter', 'Rows checked for sequence gaps.', s.received, lbl)
+            # Rows that arrive late are no longer counted as lost, so this can go down:
+            m.add('blelog_sequence_lost', 'gauge', 'Rows missing from the sequence.', s.lost, lbl)
+            m.add('blelog_sequence_gaps_total', 'counter', 'Gaps in the sequence.', s.gaps, lbl)
+            m.add('blelog_sequence_duplicates_total', 'counter', 'Duplicate rows.', s.duplicates, lbl)
+            m.add('blelog_sequence_reordered_total', 'counter', 'Rows received out of order.', s.reordered, lbl)
+            m.add('blelog_sequence_recent_loss_ratio', 'gauge', 'Loss rate in the last report period.',
+                  s.recent_loss_rate(), lbl)
+
+    def _collect_plotter(self, m: MetricsWriter, c: Consumer_plotter) -> None:
+        stats = c.frame_stats
+        if stats is None or c.plotting_process is None:
+            return
+        m.add('blelog_plot_fps', 'gauge', 'Plot frame rate.', stats.fps)
+        m.add('blelog_plot_frame_time_seconds', 'gauge', 'Average plot frame render time.',
+              stats.frame_time_avg_ms / 1e3)
+        m.add('blelog_plot_cpu_ratio', 'gauge', 'CPU usage of the plotting process (fraction of a core).',
+              stats.cpu_fraction)
+        m.add('blelog_plot_dropped_frames_total', 'counter', 'Frames skipped to stay within the CPU budget.',
+              stats.dropped_frames)
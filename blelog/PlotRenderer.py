@@ -0,0 +1,318 @@
+"""
+blelog/PlotRenderer.py
+A fast live-plot renderer for plot.py.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+All matplotlib artists are created once. Every frame, only the line data is
+updated (using set_data on preallocated numpy ring buffers) and redrawn on
+top of a cached background (blitting). A full redraw only happens when an
+axis needs to be rescaled or a trace is added.
+
+The frame rate is governed by FrameGovernor: It measures the CPU time used
+by the plotting process, and lengthens the frame interval (dropping frames)
+if the process exceeds its CPU budget. Frame statistics are reported back
+to BLELog through the log.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Union
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.animation import FuncAnimation
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+from blelog.Configuration import Subplot
+
+# Headroom added above and below the data when an axis is rescaled:
+y_margin = 0.1
+
+# Longest frame interval the governor will slow down to (in seconds):
+max_frame_interval_s = 1.0
+
+# How often the governor re-evaluates CPU usage (in seconds):
+governor_period_s = 1.0
+
+# How often frame statistics are reported to BLELog (in seconds):
+stats_report_period_s = 5.0
+
+
+@dataclass
+class PlotSettings:
+    """Settings passed from BLELog to the plotting process."""
+    point_budget: int
+    target_fps: float
+    cpu_budget: float
+    subplots: List[Subplot]
+
+
+@dataclass
+class FrameStats:
+    """Frame statistics, reported to BLELog as the 'plot_frame_stats' attribute of a log record."""
+    fps: float
+    frame_time_avg_ms: float
+    frame_time_max_ms: float
+    cpu_fraction: float
+    interval_ms: float
+    dropped_frames: int
+
+
+class FrameGovernor:
+    """
+    Adapts the frame interval to keep the CPU usage of the plotting process
+    (as a fraction of one core) below 'cpu_budget'.
+    """
+
+    def __init__(self, target_fps: float, cpu_budget: float) -> None:
+        self.min_interval = 1 / target_fps
+        self.cpu_budget = cpu_budget
+        self.interval = self.min_interval
+
+        self.frames = 0
+        self.dropped_frames = 0
+        self.cpu_fraction = 0.0
+
+        self._period_start = time.monotonic()
+        self._period_cpu_start = time.process_time()
+        self._period_frames = 0
+
+        self._report_start = self._period_start
+        self._report_frames = 0
+        self._report_frame_time_sum = 0.0
+        self._report_frame_time_max = 0.0
+
+    def frame_done(self, frame_time_s: float) -> bool:
+        """
+        Record a rendered frame. Returns True if the frame interval changed.
+        """
+        self.frames += 1
+        self._period_frames += 1
+        self._report_frames += 1
+        self._report_frame_time_sum += frame_time_s
+        self._report_frame_time_max = max(self._report_frame_time_max, frame_time_s)
+
+        now = time.monotonic()
+        wall = now - self._period_start
+        if wall < governor_period_s:
+            return False
+
+        cpu = time.process_time() - self._period_cpu_start
+        self.cpu_fraction = cpu / wall
+
+        # Frames that would have been rendered at the target rate, but weren't:
+        expected_frames = int(wall / self.min_interval)
+        self.dropped_frames += max(0, expected_frames - self._period_frames)
+
+        self._period_start = now
+        self._period_cpu_start = time.process_time()
+        self._period_frames = 0
+
+        # Scale interval by how far off budget we are. Limit how quickly it
+        # changes to avoid oscillation:
+        factor = self.cpu_fraction / self.cpu_budget
+        factor = min(2.0, max(0.5, factor))
+        new_interval = min(max_frame_interval_s, max(self.min_interval, self.interval * factor))
+
+        # Ignore small changes:
+        if abs(new_interval - self.interval) < 0.1 * self.interval:
+            return False
+
+        self.interval = new_interval
+        return True
+
+    def stats_due(self) -> bool:
+        return time.monotonic() - self._report_start >= stats_report_period_s
+
+    def take_stats(self) -> FrameStats:
+        now = time.monotonic()
+        elapsed = now - self._report_start
+        frames = max(1, self._report_frames)
+        stats = FrameStats(
+            fps=self._report_frames / elapsed,
+            frame_time_avg_ms=1e3 * self._report_frame_time_sum / frames,
+            frame_time_max_ms=1e3 * self._report_frame_time_max,
+            cpu_fraction=self.cpu_fraction,
+            interval_ms=1e3 * self.interval,
+            dropped_frames=self.dropped_frames,
+        )
+
+        self._report_start = now
+        self._report_frames = 0
+        self._report_frame_time_sum = 0.0
+        self._report_frame_time_max = 0.0
+        return stats
+
+
+class NumpyRing:
+    """
+    Fixed-size ring buffer of float64 samples.
+
+    Every sample is stored twice (at 'i' and 'i + size'), so the buffer
+    contents, oldest sample first, are always available as one contiguous
+    slice without copying.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.count = 0
+        self._buf = np.zeros(2*size, dtype=np.float64)
+        self._pos = 0
+
+    def extend(self, samples: np.ndarray) -> None:
+        size = self.size
+        n = len(samples)
+        if n == 0:
+            return
+        if n > size:
+            samples = samples[-size:]
+            n = size
+
+        p = self._pos
+        first = min(n, size - p)
+        self._buf[p:p+first] = samples[:first]
+        self._buf[p+size:p+size+first] = samples[:first]
+
+        rest = n - first
+        if rest > 0:
+            self._buf[:rest] = samples[first:]
+            self._buf[size:size+rest] = samples[first:]
+
+        self._pos = (p + n) % size
+        self.count = min(size, self.count + n)
+
+    def view(self) -> np.ndarray:
+        if self.count < self.size:
+            return self._buf[:self.count]
+        return self._buf[self._pos:self._pos+self.size]
+
+
+class Trace:
+    def __init__(self, ax: Axes, line: Line2D, size: int) -> None:
+        self.ax = ax
+        self.line = line
+        self.ring = NumpyRing(size)
+        self.changed = False
+
+    def extend(self, samples: np.ndarray) -> None:
+        if len(samples) != 0:
+            self.ring.extend(samples)
+            self.changed = True
+
+
+class LiveRenderer:
+    def __init__(self, fig: Figure, settings: PlotSettings, update: Callable[[], None]) -> None:
+        """
+        'update' is called at the start of every frame, and should push
+        new data into the traces using Trace.extend(...).
+        """
+        self.fig = fig
+        self.settings = settings
+        self.update = update
+
+        self.traces = []  # type: List[Trace]
+        self.x = np.arange(settings.point_budget, dtype=np.float64)
+        self.anim = None  # type: Union[FuncAnimation, None]
+        self.needs_redraw = False
+
+        self.governor = FrameGovernor(settings.target_fps, settings.cpu_budget)
+        self.throttled = False
+
+    def add_trace(self, ax: Axes, **line_kwargs) -> Trace:
+        """
+        Add a new line to an axis. Can be called at any time, including
+        from within the 'update' callback.
+        """
+        line, = ax.plot([], [], animated=True, **line_kwargs)
+        ax.set_xlim(0, self.settings.point_budget - 1)
+        trace = Trace(ax, line, self.settings.point_budget)
+        self.traces.append(trace)
+
+        # Legends etc. are part of the background, which needs to be redrawn:
+        self.needs_redraw = True
+        return trace
+
+    def show(self) -> None:
+        self.fig.tight_layout()
+        interval_ms = 1e3 * self.governor.interval
+        self.anim = FuncAnimation(self.fig, self._animate, interval=interval_ms,
+                                  blit=True, cache_frame_data=False)
+        plt.show()
+
+    def _animate(self, _) -> List[Line2D]:
+        frame_start = time.perf_counter()
+
+        self.update()
+
+        for trace in self.traces:
+            if trace.changed:
+                y = trace.ring.view()
+                trace.line.set_data(self.x[:len(y)], y)
+
+        if self._rescale() or self.needs_redraw:
+            # Limits changed, so the cached background is stale. Redraw
+            # everything but the (animated) lines, which get blitted on top:
+            self.needs_redraw = False
+            self.fig.canvas.draw()
+
+        for trace in self.traces:
+            trace.changed = False
+
+        self._govern(time.perf_counter() - frame_start)
+
+        return [t.line for t in self.traces]
+
+    def _govern(self, frame_time_s: float) -> None:
+        log = logging.getLogger('log')
+        gov = self.governor
+
+        if gov.frame_done(frame_time_s) and self.anim is not None:
+            self.anim.event_source.interval = 1e3 * gov.interval
+
+            throttled = gov.interval > gov.min_interval
+            if throttled and not self.throttled:
+                log.warning('Plotter exceeds its CPU budget (%i%% of a core), reducing frame rate.'
+                            % round(100 * gov.cpu_fraction))
+            elif not throttled and self.throttled:
+                log.info('Plotter back at full frame rate.')
+            self.throttled = throttled
+
+        if gov.stats_due():
+            stats = gov.take_stats()
+            log.debug('Plot frame stats: %s' % stats, extra={'plot_frame_stats': stats})
+
+    def _rescale(self) -> bool:
+        """Grow/shrink y-limits to fit the data. Returns True if any changed."""
+        ranges = {}
+        for trace in self.traces:
+            if trace.ring.count == 0:
+                continue
+            y = trace.ring.view()
+            lo, hi = float(y.min()), float(y.max())
+            if trace.ax in ranges:
+                lo = min(lo, ranges[trace.ax][0])
+                hi = max(hi, ranges[trace.ax][1])
+            ranges[trace.ax] = (lo, hi)
+
+        rescaled = False
+        for ax, (lo, hi) in ranges.items():
+            span = hi - lo if hi > lo else max(abs(hi), 1.0)
+            cur_lo, cur_hi = ax.get_ylim()
+
+            # Rescale if the data doesn't fit, or only fills a small part
+            # of the axis:
+            too_small = lo < cur_lo or hi > cur_hi
+            too_large = (cur_hi - cur_lo) > span * (1 + 2*y_margin) * 2
+            if too_small or too_large:
+                ax.set_ylim(lo - span*y_margin, hi + span*y_margin)
+                rescaled = True
+
+        return rescaled
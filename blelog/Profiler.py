@@ -0,0 +1,187 @@
+"""
+blelog/Profiler.py
+A sampling profiler that can be started and stopped at runtime.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+A background thread periodically grabs the stack of the profiled thread
+(by default the main thread, which runs the asyncio loop or matplotlib).
+If an event loop is given, every sample is attributed to the asyncio task
+that was running at the time.
+
+When stopped, the sampling thread writes a report with the most expensive
+call sites (overall and per task) to a text file. The report counts samples: A call site's
+'self' samples are those where it was executing, its 'total' samples those
+where it was anywhere on the stack.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Union
+
+# Time between samples (in seconds):
+sample_interval_s = 0.005
+
+# GIL switch interval used while profiling (in seconds). The sampling thread
+# can only take a sample once the profiled thread hands over the GIL. With
+# Python's default (5ms), short bursts of work would never be sampled:
+profiling_switch_interval_s = 0.0002
+
+# Number of call sites listed per section of the report:
+report_top_n = 25
+
+# Pseudo-task name for samples taken while no task was running:
+no_task = '<no task>'
+
+
+class SamplingProfiler:
+    def __init__(self, name: str, output_dir: str, loop: Union[None, asyncio.AbstractEventLoop] = None) -> None:
+        self.name = name
+        self.output_dir = output_dir
+        self.loop = loop
+        self.target_thread_id = threading.main_thread().ident
+
+        self._thread = None  # type: Union[threading.Thread, None]
+        self._stop = threading.Event()
+        self._prev_switch_interval = sys.getswitchinterval()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def toggle(self) -> None:
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self) -> None:
+        log = logging.getLogger('log')
+        if self.running:
+            return
+
+        # Every run has its own stop event and samples, so that it can still
+        # write its report while the next run has already started:
+        self._stop = threading.Event()
+        self._prev_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(profiling_switch_interval_s)
+        self._thread = threading.Thread(target=self._sample_loop, args=(self._stop, _Profile(self.name)),
+                                        name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        log.info('Profiler (%s) started.' % self.name)
+
+    def stop(self, wait: bool = False) -> None:
+        """
+        Stop profiling. The sampling thread writes the report before it exits,
+        so that the profiled thread is not blocked. With wait=True, return only
+        once the report is written.
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        sys.setswitchinterval(self._prev_switch_interval)
+        if wait:
+            self._thread.join()
+        self._thread = None
+
+    def _sample_loop(self, stop: threading.Event, profile: '_Profile') -> None:
+        while not stop.wait(sample_interval_s):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+
+            task_name = no_task
+            if self.loop is not None:
+                task = asyncio.current_task(self.loop)
+                if task is not None:
+                    task_name = task.get_name()
+
+            profile.record(task_name, frame)
+
+        log = logging.getLogger('log')
+        try:
+            path = profile.write_report(self.output_dir)
+            log.info('Profiler (%s) stopped. Report written to %s' % (self.name, path))
+        except OSError as e:
+            log.error('Profiler (%s) failed to write report: %s' % (self.name, str(e)))
+
+
+class _Profile:
+    """Samples of one profiler run"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.samples = 0
+        self.started = time.time()
+        self.self_counts = {}  # type: Dict[str, Counter]
+        self.total_counts = {}  # type: Dict[str, Counter]
+
+    def record(self, task_name: str, frame) -> None:
+        if task_name not in self.self_counts:
+            self.self_counts[task_name] = Counter()
+            self.total_counts[task_name] = Counter()
+
+        self.samples += 1
+        self.self_counts[task_name][_call_site(frame)] += 1
+
+        seen = set()
+        while frame is not None:
+            site = _call_site(frame)
+            if site not in seen:
+                seen.add(site)
+                self.total_counts[task_name][site] += 1
+            frame = frame.f_back
+
+    def write_report(self, output_dir: str) -> str:
+        t = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started))
+        path = os.path.join(output_dir, 'profile_%s_%s.txt' % (self.name, t))
+        duration = time.time() - self.started
+
+        lines = ['Profile of %s: %i samples over %.1fs (every %.1fms)' %
+                 (self.name, self.samples, duration, sample_interval_s*1e3), '']
+
+        all_self = sum(self.self_counts.values(), Counter())
+        all_total = sum(self.total_counts.values(), Counter())
+        lines.extend(_section('All tasks', self.samples, all_self, all_total))
+
+        tasks = sorted(self.self_counts, key=lambda n: -sum(self.self_counts[n].values()))
+        for task_name in tasks:
+            task_samples = sum(self.self_counts[task_name].values())
+            lines.extend(_section('Task %s' % task_name, task_samples,
+                                  self.self_counts[task_name], self.total_counts[task_name]))
+
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+
+def _call_site(frame) -> str:
+    code = frame.f_code
+    return '%s:%i(%s)' % (code.co_filename, frame.f_lineno, code.co_name)
+
+
+def _section(title: str, samples: int, self_counts: Counter, total_counts: Counter):
+    lines = ['==== %s: %i samples ====' % (title, samples), '']
+    if samples == 0:
+        return lines
+
+    lines.append('Self:')
+    for site, n in self_counts.most_common(report_top_n):
+        lines.append('  %6.2f%%  %6i  %s' % (100 * n / samples, n, site))
+    lines.append('')
+
+    lines.append('Total:')
+    for site, n in total_counts.most_common(report_top_n):
+        lines.append('  %6.2f%%  %6i  %s' % (100 * n / samples, n, site))
+    lines.append('')
+    return lines
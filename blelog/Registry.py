@@ -0,0 +1,138 @@
+"""
+blelog/Registry.py
+Integer ids and precomputed per-device/per-characteristic values.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Every characteristic (in configuration order) and every device (in the order
+it is first connected to) is given a small integer id. Everything derived
+from a device's alias or a characteristic's name (CSV file names, SQL table
+names and statements) is computed once, when the id is assigned, instead of
+for every notification.
+
+Connections tag each NotifData with these ids, so that consumers can find
+this information with a list lookup.
+"""
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from blelog.Configuration import Characteristic, Configuration
+from blelog.ConsumerMgr import NotifData
+from blelog.Util import normalise_adr, normalise_char_uuid, sanitize_sql_identifier
+
+
+@dataclass
+class CharacteristicInfo:
+    id: int
+    characteristic: Characteristic
+
+    # SQL table of this characteristic (see log2sqlite):
+    table_name: str
+    sql_headers: List[str]
+    create_sql: str
+    insert_sql: str
+
+
+@dataclass
+class DeviceInfo:
+    id: int
+    adr: str
+    # Alias, or address if the device has none:
+    name: str
+    # Prefix of the device's CSV files (see log2csv):
+    file_name: str
+
+
+class Registry:
+    def __init__(self, config: Configuration) -> None:
+        self.config = config
+
+        self.characteristics = []  # type: List[CharacteristicInfo]
+        self.by_uuid = {}  # type: Dict[str, CharacteristicInfo]
+        for char in config.characteristics:
+            info = self._characteristic_info(len(self.characteristics), char)
+            self.characteristics.append(info)
+            self.by_uuid[char.uuid] = info
+
+        self.devices = []  # type: List[DeviceInfo]
+        self.by_adr = {}  # type: Dict[str, DeviceInfo]
+
+        # CSV file path by (device id, characteristic id):
+        self.csv_paths = {}  # type: Dict[Tuple[int, int], str]
+
+    def device(self, adr: str) -> DeviceInfo:
+        """Get a device's information, assigning it an id if it has none yet"""
+        info = self.by_adr.get(adr)
+        if info is None:
+            adr = normalise_adr(adr)
+            info = self.by_adr.get(adr)
+        if info is None:
+            if adr in self.config.device_aliases:
+                name = self.config.device_aliases[adr]
+                file_name = name
+            else:
+                name = adr
+                file_name = adr.replace(':', '_')
+            info = DeviceInfo(len(self.devices), adr, name, file_name)
+            self.devices.append(info)
+            self.by_adr[adr] = info
+        return info
+
+    def device_id(self, adr: str) -> int:
+        return self.device(adr).id
+
+    def characteristic(self, uuid: str) -> CharacteristicInfo:
+        info = self.by_uuid.get(uuid)
+        if info is None:
+            # Remember the UUID as given, so that it is only normalised once:
+            info = self.by_uuid[normalise_char_uuid(uuid)]
+            self.by_uuid[uuid] = info
+        return info
+
+    def lookup(self, data: NotifData) -> Tuple[DeviceInfo, CharacteristicInfo]:
+        """Get the device and characteristic of some data, by id if it is tagged with them"""
+        if data.device_id >= 0:
+            dev = self.devices[data.device_id]
+        else:
+            dev = self.device(data.device_adr)
+
+        if data.char_id >= 0:
+            char = self.characteristics[data.char_id]
+        else:
+            char = self.characteristic(data.characteristic.uuid)
+
+        return dev, char
+
+    def csv_path(self, dev: DeviceInfo, char: CharacteristicInfo) -> str:
+        key = (dev.id, char.id)
+        path = self.csv_paths.get(key)
+        if path is None:
+            n = "%s_%s.csv" % (dev.file_name, char.characteristic.name)
+            n = n.replace(' ', '_')
+            path = os.path.join(self.config.log2csv_folder_name, n)
+            self.csv_paths[key] = path
+        return path
+
+    @staticmethod
+    def _characteristic_info(char_id: int, char: Characteristic) -> CharacteristicInfo:
+        table_name = sanitize_sql_identifier(char.name)
+        sql_headers = [sanitize_sql_identifier(h) for h in char.column_headers]
+
+        column_definitions = [
+            "id INTEGER PRIMARY KEY AUTOINCREMENT",  # Auto-incrementing primary key
+            "device_name TEXT NOT NULL",             # Device alias or address
+        ]
+        column_definitions.extend(["%s TEXT" % header for header in sql_headers])
+        create_sql = "CREATE TABLE IF NOT EXISTS %s (%s)" % (table_name, ', '.join(column_definitions))
+
+        all_columns = ["device_name"] + sql_headers
+        placeholders = ", ".join(["?"] * len(all_columns))
+        insert_sql = "INSERT INTO %s (%s) VALUES (%s)" % (table_name, ", ".join(all_columns), placeholders)
+
+        return CharacteristicInfo(char_id, char, table_name, sql_headers, create_sql, insert_sql)
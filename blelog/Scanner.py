@@ -1,6 +1,6 @@
 """
 blelog/Scanner.py
-Repeatedly scans for new devices.
+Scans for new devices, either continuously or in repeated scan cycles.
 
 BLELog
 Copyright (C) 2024 Philipp Schilk
@@ -12,20 +12,24 @@ included LICENSE file or <https://opensource.org/licenses/MIT>.
 
 import asyncio
 import enum
+import functools
 import logging
+import math
 import re
 import time
 from asyncio import Event
+from collections import OrderedDict
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Tuple, Union
+from typing import Callable, Dict, List, Tuple, Union
 
 from bleak import BleakScanner
 from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import AdvertisementData
+from bleak.exc import BleakError
 
 from blelog.Configuration import Configuration
-from blelog.Util import normalise_adr
+from blelog.Util import adapter_kwargs, normalise_adr
 
 
 @enum.unique
@@ -47,6 +51,37 @@ class SeenDevice:
     last_seen: Union[int, None]
     rssi: Union[int, None]
 
+    # Smoothed RSSI history (exponentially weighted mean and variance):
+    rssi_mean: Union[float, None] = None
+    rssi_var: float = 0.0
+
+    # The device as last reported by the scanner, and the adapter that saw
+    # it. Connecting through it saves bleak from having to scan again:
+    ble_device: Union[BLEDevice, None] = None
+    seen_by: Union[str, None] = None
+
+    def record_rssi(self, rssi: Union[int, None], alpha: float):
+        self.rssi = rssi
+        if rssi is None:
+            return
+
+        if self.rssi_mean is None:
+            self.rssi_mean = float(rssi)
+            self.rssi_var = 0.0
+        else:
+            diff = rssi - self.rssi_mean
+            self.rssi_mean += alpha * diff
+            self.rssi_var = (1 - alpha) * (self.rssi_var + alpha * diff * diff)
+
+    def rssi_std(self) -> float:
+        return math.sqrt(self.rssi_var)
+
+    def signal_score(self, stability_weight: float) -> Union[float, None]:
+        """Smoothed RSSI, penalised by how much it fluctuates. Higher is better."""
+        if self.rssi_mean is None:
+            return None
+        return self.rssi_mean - stability_weight * self.rssi_std()
+
     def get_name_repr(self) -> str:
         if self.alias is not None:
             return self.alias
@@ -59,10 +94,35 @@ class Scanner:
     def __init__(self, config: Configuration):
         self.config = config
 
-        self.name_regexes = [re.compile(r) for r in config.connect_device_name_regexes]
+        # All name regexes, combined into a single pattern if possible. Patterns
+        # with global flags (such as '(?i)...') can't be combined, in which case
+        # they are checked one by one:
+        self.name_regexes = []  # type: List[re.Pattern]
+        if len(config.connect_device_name_regexes) != 0:
+            try:
+                self.name_regexes = [re.compile('|'.join('(?:%s)' % r for r in config.connect_device_name_regexes))]
+            except re.error:
+                self.name_regexes = [re.compile(r) for r in config.connect_device_name_regexes]
 
         self.seen_devices = {}  # type: Dict[str, SeenDevice]
 
+        # Adapters to scan with (None being the system's default adapter):
+        self.scan_adapters = [a.name for a in config.get_adapters() if a.scan]
+        if len(self.scan_adapters) == 0:
+            self.scan_adapters = [None]
+
+        # Called with every matching device whenever it is seen:
+        self.sighting_callbacks = []  # type: List[Callable[[SeenDevice], None]]
+
+        # Addresses of devices whose name did not match, with the name that
+        # was checked and when the entry expires. Oldest entries first:
+        self.ignored_devices = OrderedDict()  # type: OrderedDict[str, Tuple[Union[str, None], int]]
+
+        # Statistics:
+        self.scan_count = 0
+        self.advertisement_count = 0
+        self.name_checks = 0
+
         # Pre-populate with all devices with fixed/pre-specified address:
         for adr in config.connect_device_adrs:
             self.seen_devices[adr] = SeenDevice(
@@ -76,19 +136,77 @@ class Scanner:
             )
 
     async def run(self, halt: Event):
+        if self.config.continuous_scanning:
+            await self._run_continuous(halt)
+        else:
+            await self._run_cycles(halt)
+
+    async def _run_continuous(self, halt: Event):
+        """
+        Scan without interruption, and process every advertisement as soon
+        as it arrives.
+        """
+        log = logging.getLogger('log')
+        try:
+            while not halt.is_set():
+                scanners = []
+                try:
+                    for adapter in self.scan_adapters:
+                        callback = functools.partial(self._detection_callback, adapter=adapter)
+                        scanner = BleakScanner(detection_callback=callback, **adapter_kwargs(adapter))
+                        await scanner.start()
+                        scanners.append(scanner)
+                    self.scan_count += 1
+                except (BleakError, OSError) as e:
+                    log.warning('Failed to start scanner: %s' % str(e))
+                    await self._stop_scanners(scanners)
+                    await asyncio.sleep(self.config.scan_duration)
+                    continue
+
+                try:
+                    while not halt.is_set():
+                        self._check_seen_timeouts()
+                        await asyncio.sleep(self.config.scan_cooldown)
+                finally:
+                    await self._stop_scanners(scanners)
+        except Exception as e:
+            log.error('Scanner encountered an exception: %s' % str(e))
+            log.exception(e)
+            halt.set()
+        finally:
+            print('Scanner shut down...')
+
+    async def _stop_scanners(self, scanners: List[BleakScanner]):
+        log = logging.getLogger('log')
+        for scanner in scanners:
+            try:
+                await scanner.stop()
+            except (BleakError, OSError) as e:
+                log.warning('Failed to stop scanner: %s' % str(e))
+
+    def _detection_callback(self, scanned_dev: BLEDevice, adv_data: AdvertisementData, adapter: Union[None, str]):
+        self.advertisement_count += 1
+        self._update_device(scanned_dev, adv_data, time.monotonic_ns(), adapter)
+
+    async def _run_cycles(self, halt: Event):
         log = logging.getLogger('log')
         try:
             while not halt.is_set():
                 # Scan
                 try:
-                    devices = await asyncio.wait_for(
-                        BleakScanner.discover(timeout=self.config.scan_duration, return_adv=True),
-                        timeout=15)
+                    # (All scanning adapters at once)
+                    results = await asyncio.wait_for(asyncio.gather(*[
+                        BleakScanner.discover(timeout=self.config.scan_duration, return_adv=True,
+                                              **adapter_kwargs(adapter))
+                        for adapter in self.scan_adapters]), timeout=15)
 
                     t = time.monotonic_ns()
+                    self.scan_count += 1
 
                     # Update list of seen devices:
-                    self._update_seen_devices(devices, t)
+                    for adapter, devices in zip(self.scan_adapters, results):
+                        self.advertisement_count += len(devices)
+                        self._update_seen_devices(devices, t, adapter)
 
                     # Cooldown
                     await asyncio.sleep(self.config.scan_cooldown)
@@ -101,34 +219,81 @@ class Scanner:
         finally:
             print('Scanner shut down...')
 
-    def _update_seen_devices(self, devices: Dict[str, Tuple[BLEDevice, AdvertisementData]], t: int):
+    def _update_seen_devices(self, devices: Dict[str, Tuple[BLEDevice, AdvertisementData]], t: int,
+                             adapter: Union[None, str]):
         for scanned_dev, adv_data in devices.values():
-            adr = normalise_adr(scanned_dev.address)
-
-            if adr in self.seen_devices:
-                # Known device, update information:
-                dev = self.seen_devices[adr]
-                dev.last_seen = t
-                dev.name = scanned_dev.name
-                dev.rssi = adv_data.rssi
-                dev.state = SeenDeviceState.RECENTLY_SEEN
+            self._update_device(scanned_dev, adv_data, t, adapter)
+
+        self._check_seen_timeouts()
+
+    def _update_device(self, scanned_dev: BLEDevice, adv_data: AdvertisementData, t: int,
+                       adapter: Union[None, str] = None):
+        adr = normalise_adr(scanned_dev.address)
+
+        if adr in self.seen_devices:
+            # Known device, update information:
+            dev = self.seen_devices[adr]
+            dev.last_seen = t
+            dev.name = scanned_dev.name
+            dev.record_rssi(adv_data.rssi, self.config.rssi_smoothing)
+            dev.ble_device = scanned_dev
+            dev.seen_by = adapter
+            dev.state = SeenDeviceState.RECENTLY_SEEN
+            self._notify_sighting(dev)
+        elif not self._is_ignored(adr, scanned_dev.name, t):
+            # Unknown device, check if name matches:
+            self.name_checks += 1
+            if self._name_matches(scanned_dev.name):
+                # It does, add the new device:
+                self.ignored_devices.pop(adr, None)
+                new_dev = SeenDevice(
+                    adr=adr,
+                    alias=self.config.device_aliases.get(adr, None),
+                    state=SeenDeviceState.RECENTLY_SEEN,
+                    name=scanned_dev.name,
+                    last_seen=t,
+                    rssi=None,
+                    ble_device=scanned_dev,
+                    seen_by=adapter,
+                )
+                new_dev.record_rssi(adv_data.rssi, self.config.rssi_smoothing)
+                self.seen_devices[adr] = new_dev
+                self._notify_sighting(new_dev)
             else:
-                # Unknown device, check if name matches:
-                for r in self.name_regexes:
-                    if (scanned_dev.name is None):
-                        continue
-                    if r.match(scanned_dev.name):
-                        # It does, add the new device:
-                        new_dev = SeenDevice(
-                            adr=adr,
-                            alias=self.config.device_aliases.get(adr, None),
-                            state=SeenDeviceState.RECENTLY_SEEN,
-                            name=scanned_dev.name,
-                            last_seen=t,
-                            rssi=adv_data.rssi,
-                        )
-                        self.seen_devices[adr] = new_dev
+                self._ignore(adr, scanned_dev.name, t)
+
+    def _notify_sighting(self, dev: SeenDevice):
+        for callback in self.sighting_callbacks:
+            callback(dev)
+
+    def _name_matches(self, name: Union[str, None]) -> bool:
+        if name is None:
+            return False
+        return any(p.match(name) is not None for p in self.name_regexes)
+
+    def _is_ignored(self, adr: str, name: Union[str, None], t: int) -> bool:
+        """Check if a device's name was recently checked and did not match"""
+        entry = self.ignored_devices.get(adr, None)
+        if entry is None:
+            return False
+
+        checked_name, expires = entry
+        if t > expires or checked_name != name:
+            # Stale, or the device changed its name (or only now sent one):
+            del self.ignored_devices[adr]
+            return False
+
+        return True
+
+    def _ignore(self, adr: str, name: Union[str, None], t: int):
+        self.ignored_devices[adr] = (name, t + int(self.config.scan_ignore_timeout * 1e9))
+        self.ignored_devices.move_to_end(adr)
+
+        # Evict the oldest entries:
+        while len(self.ignored_devices) > self.config.scan_ignore_max_devices:
+            self.ignored_devices.popitem(last=False)
 
+    def _check_seen_timeouts(self):
         # Check for seen-recently timeouts:
         for dev in self.seen_devices.values():
             if dev.state == SeenDeviceState.RECENTLY_SEEN:
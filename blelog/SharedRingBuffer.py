@@ -0,0 +1,120 @@
+"""
+blelog/SharedRingBuffer.py
+A single-producer, single-consumer ring buffer of numeric samples in shared
+memory. Used to pass plot data to the plotting process without pickling.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Memory layout of the shared block:
+
+    [ uint64: total number of samples ever written ][ float64 * capacity ]
+
+The writer first stores the new samples and only then advances the
+counter, so a reader never sees a counter that covers samples that have not
+been written yet. Readers keep their own cursor (the value of the counter at
+their last read) and pick up everything written since.
+
+If a reader falls more than 'capacity' samples behind, the oldest samples
+are lost and the reader skips ahead.
+"""
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+
+default_capacity = 2**16
+
+_header_bytes = 8
+
+
+@dataclass
+class RingBufferInfo:
+    """Everything another process needs to attach to a ring buffer."""
+    device_adr: str
+    device_name_repr: str
+    characteristic: str
+    column: str
+    shm_name: str
+    capacity: int
+
+
+class SharedRingBuffer:
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int, owner: bool) -> None:
+        self.shm = shm
+        self.capacity = capacity
+        self.owner = owner
+
+        self._count = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf, offset=0)
+        self._data = np.ndarray((capacity,), dtype=np.float64, buffer=shm.buf, offset=_header_bytes)
+
+    @classmethod
+    def create(cls, capacity: int = default_capacity) -> 'SharedRingBuffer':
+        shm = shared_memory.SharedMemory(create=True, size=_header_bytes + 8*capacity)
+        buf = cls(shm, capacity, owner=True)
+        buf._count[0] = 0
+        return buf
+
+    @classmethod
+    def attach(cls, info: RingBufferInfo) -> 'SharedRingBuffer':
+        shm = shared_memory.SharedMemory(name=info.shm_name)
+        return cls(shm, info.capacity, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, samples: Sequence[float]) -> None:
+        """Append samples. Raises ValueError/TypeError if they are not numeric."""
+        vals = np.asarray(samples, dtype=np.float64).ravel()
+        n = len(vals)
+        if n == 0:
+            return
+
+        cap = self.capacity
+        count = int(self._count[0])
+
+        if n > cap:
+            # Only the newest 'cap' samples can be kept:
+            count += n - cap
+            vals = vals[-cap:]
+            n = cap
+
+        pos = count % cap
+        first = min(n, cap - pos)
+        self._data[pos:pos+first] = vals[:first]
+        if first < n:
+            self._data[:n-first] = vals[first:]
+
+        # Publish:
+        self._count[0] = count + n
+
+    def read(self, cursor: Union[int, None]) -> Tuple[np.ndarray, int]:
+        """
+        Returns all samples written since 'cursor', and the new cursor.
+        A cursor of 'None' returns everything still held in the buffer.
+        """
+        count = int(self._count[0])
+        oldest = max(0, count - self.capacity)
+
+        if cursor is None or cursor < oldest:
+            cursor = oldest
+
+        if cursor >= count:
+            return np.empty(0, dtype=np.float64), count
+
+        idx = np.arange(cursor, count) % self.capacity
+        return self._data[idx], count
+
+    def close(self) -> None:
+        # Drop numpy views before closing the mapping:
+        del self._count
+        del self._data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -17,7 +17,7 @@ from abc import ABC, abstractmethod
 from asyncio import Event
 from asyncio.queues import Queue
 from collections import deque
-from typing import Callable, List
+from typing import Callable, Dict, List, Tuple, Union
 
 from blelog.Configuration import Configuration, TUI_Mode
 
@@ -26,9 +26,12 @@ class LogHandler(logging.Handler):
     def __init__(self, output: deque):
         super().__init__()
         self.out = output
+        # Number of records ever handled:
+        self.count = 0
 
     def handle(self, record: logging.LogRecord) -> bool:
         self.out.append(record)
+        self.count += 1
         return True
 
 
@@ -51,6 +54,25 @@ class CursesTUI_Component(ABC):
     def title(self) -> str:
         pass
 
+    def changed(self) -> bool:
+        """
+        Whether get_lines could return something different than the last
+        time it was called. If not, the previous lines are shown again.
+        """
+        return True
+
+    def selectable(self) -> bool:
+        """Whether this component can be selected (with TAB) to receive key presses"""
+        return False
+
+    def handle_key(self, key: int) -> bool:
+        """Handle a key press while selected. Returns True if the key was used."""
+        return False
+
+    def key_help(self) -> str:
+        """Keys this component uses while selected"""
+        return ''
+
 
 class TUI:
     def __init__(self, config: Configuration) -> None:
@@ -63,6 +85,16 @@ class TUI:
         self.cures_is_initialised = False
         self.curse_is_shutoff = False
         self.plot_toggle = None
+        self.profile_toggle = None
+
+        # Lines of each component, as of the last time they changed:
+        self.component_lines = {}  # type: Dict[CursesTUI_Component, List[str]]
+        # Lines currently on screen, and the screen size they were drawn for:
+        self.screen_lines = []  # type: List[str]
+        self.screen_size = None  # type: Union[None, Tuple[int, int]]
+
+        # Component that receives key presses:
+        self.selected = None  # type: Union[None, CursesTUI_Component]
 
         # Setup log handler for CONSOLE mode:
         self.console_q = Queue()
@@ -126,52 +158,9 @@ class TUI:
             stdscr.keypad(True)
 
             while not halt.is_set():
-                # Header:
-                lines = []
-                lines.append('========== BLELOG =========')
-                lines.append('')
-                lines.append('\'g\': Toggle GUI Plot')
-                lines.append('\'CTRL-C\': Close BLELog')
-                lines.append('')
-
-                # Get lines from each TUI component:
-                for c in self.components:
-                    lines.append('========== %s =========' % c.title())
-                    lines.append('')
-                    lines.extend(c.get_lines())
-                    lines.append('')
-
-                # Draw to screen
-                stdscr.clear()
-                max_rows, max_cols = stdscr.getmaxyx()
-
-                for i, line in enumerate(lines):
-                    if i >= max_rows:
-                        break
-
-                    # strip newlines:
-                    line = line.replace('\n', '').replace('\r', '')
-
-                    # truncate line:
-                    line = (line[:max_cols-5] + '...') if len(line) > max_cols-5 else line
-                    stdscr.addstr(i, 0, line)
-
-                stdscr.refresh()
-
-                # Handle input
-                stdscr.nodelay(True)
-                c = stdscr.getch()
-
-                # Under windows, the SIGINT handler is not called automatically.
-                # Manually call it:
-                if c == 3:
-                    if self.halt_hndlr is not None:
-                        self.halt_hndlr()
-
-                # Toggle plotter gui
-                if c == ord('G') or c == ord('g'):
-                    if self.plot_toggle is not None:
-                        self.plot_toggle()
+                self._draw_curses(stdscr)
+
+                self._handle_input(stdscr)
 
                 await asyncio.sleep(self.config.curse_tui_interval)
         except Exception as e:
@@ -182,6 +171,95 @@ class TUI:
             self.off()
             print('TUI Shutdown...')
 
+    def _handle_input(self, stdscr) -> None:
+        stdscr.nodelay(True)
+        while True:
+            c = stdscr.getch()
+            if c == -1:
+                return
+
+            # Under windows, the SIGINT handler is not called automatically.
+            # Manually call it:
+            if c == 3:
+                if self.halt_hndlr is not None:
+                    self.halt_hndlr()
+
+            # Toggle plotter gui
+            elif c == ord('G') or c == ord('g'):
+                if self.plot_toggle is not None:
+                    self.plot_toggle()
+
+            # Start/stop profiler
+            elif c == ord('P') or c == ord('p'):
+                if self.profile_toggle is not None:
+                    self.profile_toggle()
+
+            # Select the next component that takes key presses
+            elif c == ord('\t'):
+                selectable = [comp for comp in self.components if comp.selectable()]
+                if self.selected in selectable:
+                    idx = selectable.index(self.selected) + 1
+                    self.selected = selectable[idx] if idx < len(selectable) else None
+                else:
+                    self.selected = selectable[0] if len(selectable) != 0 else None
+
+            elif self.selected is not None:
+                if self.selected.handle_key(c):
+                    # Redraw it, even if its data did not change:
+                    self.component_lines.pop(self.selected, None)
+
+    def _draw_curses(self, stdscr) -> None:
+        # Header:
+        lines = []
+        lines.append('========== BLELOG =========')
+        lines.append('')
+        lines.append('\'g\': Toggle GUI Plot')
+        lines.append('\'p\': Start/Stop Profiler')
+        lines.append('\'TAB\': Select Table' + ('' if self.selected is None else '   ' + self.selected.key_help()))
+        lines.append('\'CTRL-C\': Close BLELog')
+        lines.append('')
+
+        # Get lines from each TUI component, if they changed:
+        for c in self.components:
+            if c not in self.component_lines or c.changed():
+                self.component_lines[c] = c.get_lines()
+            if c is self.selected:
+                lines.append('========== >> %s << =========' % c.title())
+            else:
+                lines.append('========== %s =========' % c.title())
+            lines.append('')
+            lines.extend(self.component_lines[c])
+            lines.append('')
+
+        # Start from a blank screen if the terminal was resized:
+        max_rows, max_cols = stdscr.getmaxyx()
+        if self.screen_size != (max_rows, max_cols):
+            stdscr.clear()
+            self.screen_lines = []
+            self.screen_size = (max_rows, max_cols)
+
+        new_screen_lines = []
+        for line in lines[:max_rows]:
+            # strip newlines:
+            line = line.replace('\n', '').replace('\r', '')
+
+            # truncate line:
+            line = (line[:max_cols-5] + '...') if len(line) > max_cols-5 else line
+            new_screen_lines.append(line)
+
+        # Only redraw lines that changed:
+        for i in range(max(len(new_screen_lines), len(self.screen_lines))):
+            line = new_screen_lines[i] if i < len(new_screen_lines) else ''
+            if i < len(self.screen_lines) and self.screen_lines[i] == line:
+                continue
+            stdscr.move(i, 0)
+            stdscr.clrtoeol()
+            stdscr.addstr(i, 0, line)
+
+        self.screen_lines = new_screen_lines
+        stdscr.noutrefresh()
+        curses.doupdate()
+
     def off(self) -> None:
         if self.cures_is_initialised and not self.curse_is_shutoff:
             curses.nocbreak()
@@ -193,3 +271,6 @@ class TUI:
 
     def set_plot_toggle(self, plot_toggle: Callable):
         self.plot_toggle = plot_toggle
+
+    def set_profile_toggle(self, profile_toggle: Callable):
+        self.profile_toggle = profile_toggle
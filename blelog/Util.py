@@ -9,6 +9,8 @@ This work is licensed under the terms of the MIT license.  For a copy, see the
 included LICENSE file or <https://opensource.org/licenses/MIT>.
 ---------------------------------
 """
+import re
+from typing import Dict, Union
 
 
 def normalise_adr(adr: str):
@@ -19,3 +21,21 @@ def normalise_adr(adr: str):
 def normalise_char_uuid(uuid: str):
     """Produce consistent uuid formatting to make comparisons easier"""
     return uuid.lower().strip()
+
+
+def adapter_kwargs(adapter: Union[None, str]) -> Dict[str, str]:
+    """Keyword arguments that select an adapter for BleakScanner/BleakClient"""
+    if adapter is None:
+        return {}
+    return {'adapter': adapter}
+
+
+def sanitize_sql_identifier(name: str) -> str:
+    """Sanitizes a string to be a valid SQL identifier (table/column name)."""
+    # Remove invalid characters (keep alphanumeric and underscore)
+    name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+    # Ensure it doesn't start with a digit (prepend underscore if it does)
+    if name[0].isdigit():
+        name = '_' + name
+
+    return name.lower()
@@ -14,21 +14,24 @@ import csv
 import io
 import logging
 import os
+import time
 from asyncio.locks import Event
 from asyncio.queues import Queue
-from typing import List
+from typing import List, Union
 
 import aiofiles
 
 from blelog.Configuration import Configuration
-from blelog.ConsumerMgr import Consumer, NotifData
+from blelog.ConsumerMgr import Consumer, LatencyStats, NotifData
+from blelog.Registry import Registry
 
 
 class CSVLogger:
-    def __init__(self, file_path: str, column_headers: List[str]):
+    def __init__(self, file_path: str, column_headers: List[str], write_latency: LatencyStats):
         self.file_path = file_path
         self.input_q = Queue()
         self.column_headers = column_headers
+        self.write_latency = write_latency
         self.active = True
 
     async def run(self, halt: Event):
@@ -47,8 +50,10 @@ class CSVLogger:
             while not (halt.is_set() and self.input_q.empty()):
                 try:
                     next_data = await asyncio.wait_for(self.input_q.get(), timeout=0.5)  # type: NotifData
-                    await self.write_rows(f, next_data.data)
+                    t_start = time.perf_counter()
+                    await self.write_rows(f, next_data.rows())
                     await f.flush()
+                    self.write_latency.record(time.perf_counter() - t_start)
                     self.input_q.task_done()
                 except asyncio.TimeoutError:
                     pass
@@ -83,9 +88,10 @@ class CSVLogger:
 
 
 class Consumer_log2csv(Consumer):
-    def __init__(self, config: Configuration):
+    def __init__(self, config: Configuration, registry: Union[None, Registry] = None):
         super().__init__()
         self.config = config
+        self.registry = registry if registry is not None else Registry(config)
         self.file_outputs = {}
         self.tasks = []
 
@@ -113,26 +119,17 @@ class Consumer_log2csv(Consumer):
 
     async def _log_to_file(self, next_data: NotifData, halt: Event):
         # determine file path:
-        file_path = self.file_path(next_data.device_adr, next_data.characteristic)
+        dev, char = self.registry.lookup(next_data)
+        file_path = self.registry.csv_path(dev, char)
 
-        if file_path not in self.file_outputs:
+        file_output = self.file_outputs.get(file_path)
+        if file_output is None:
             # File not yet opened, open:
-            file_output = CSVLogger(file_path, next_data.characteristic.column_headers)
+            file_output = CSVLogger(file_path, next_data.characteristic.column_headers, self.write_latency)
             self.file_outputs[file_path] = file_output
-            file_task = asyncio.create_task(self.file_outputs[file_path].run(halt))
+            file_task = asyncio.create_task(file_output.run(halt))
             self.tasks.append(file_task)
 
-        if self.file_outputs[file_path].active:
+        if file_output.active:
             # Open, write:
-            await self.file_outputs[file_path].input_q.put(next_data)
-
-    def file_path(self, device_adr, char):
-        if device_adr in self.config.device_aliases:
-            name = self.config.device_aliases[device_adr]
-        else:
-            name = device_adr
-            name = device_adr.replace(':', '_')
-
-        n = "%s_%s.csv" % (name, char.name)
-        n = n.replace(' ', '_')
-        return os.path.join(self.config.log2csv_folder_name, n)
+            await file_output.input_q.put(next_data)
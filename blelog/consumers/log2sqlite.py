@@ -13,33 +13,25 @@ included LICENSE file or <https://opensource.org/licenses/MIT>.
 import asyncio
 import logging
 import os
-import re  # For sanitizing names
+import time
 from datetime import datetime
 from asyncio.locks import Event
 from asyncio.queues import Queue
-from typing import List, Set, Tuple, Any, Dict
+from typing import List, Set, Tuple, Any, Dict, Union
 
 import aiosqlite
 
 from blelog.Configuration import Configuration
 from blelog.ConsumerMgr import Consumer, NotifData
+from blelog.Registry import CharacteristicInfo, Registry
 
 log = logging.getLogger('log')
 
-def sanitize_sql_identifier(name: str) -> str:
-    """Sanitizes a string to be a valid SQL identifier (table/column name)."""
-    # Remove invalid characters (keep alphanumeric and underscore)
-    name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
-    # Ensure it doesn't start with a digit (prepend underscore if it does)
-    if name[0].isdigit():
-        name = '_' + name
-
-    return name.lower()
-
 class Consumer_log2sqlite(Consumer):
-    def __init__(self, config: Configuration):
+    def __init__(self, config: Configuration, registry: Union[None, Registry] = None):
         super().__init__()
         self.config = config
+        self.registry = registry if registry is not None else Registry(config) # Table names and SQL statements
         self._db_conn = None # Holds the aiosqlite connection
         self._known_tables: Set[str] = set() # Cache for created tables
         self._halt_event: Event = None # To signal shutdown internally if needed
@@ -76,8 +68,9 @@ class Consumer_log2sqlite(Consumer):
                 log.error(f"Error closing database connection {self.config.log2sqlite_db_path}: {e}")
                 log.exception(e)
 
-    async def _create_table_if_not_exists(self, table_name: str, column_headers: List[str]):
+    async def _create_table_if_not_exists(self, char: CharacteristicInfo):
         """Creates a table for a characteristic if it doesn't exist."""
+        table_name = char.table_name
         if table_name in self._known_tables:
             return
 
@@ -85,23 +78,12 @@ class Consumer_log2sqlite(Consumer):
             log.error("Database connection is not available for table creation.")
             return
 
-        sanitized_headers = [sanitize_sql_identifier(h) for h in column_headers]
-
-        # Define columns - characteristic data.
-        column_definitions = [
-            "id INTEGER PRIMARY KEY AUTOINCREMENT",  # Auto-incrementing primary key
-            "device_name TEXT NOT NULL",          # Device alias or address
-        ]
-        column_definitions.extend([f"{header} TEXT" for header in sanitized_headers])
-
-        create_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)})"
-
         try:
-            log.debug(f"Executing: {create_sql}")
-            await self._db_conn.execute(create_sql)
+            log.debug(f"Executing: {char.create_sql}")
+            await self._db_conn.execute(char.create_sql)
             await self._db_conn.commit()
             self._known_tables.add(table_name)
-            log.info(f"Ensured table '{table_name}' exists with columns: id, device_name, {', '.join(sanitized_headers)}")
+            log.info(f"Ensured table '{table_name}' exists with columns: id, device_name, {', '.join(char.sql_headers)}")
         except Exception as e:
             log.error(f"Failed to create table {table_name}: {e}")
             log.exception(e)
@@ -109,8 +91,9 @@ class Consumer_log2sqlite(Consumer):
             if self._halt_event:
                  self._halt_event.set()
 
-    async def _insert_batch(self, table_name: str, column_headers: List[str], data_batch: List[Tuple[str, Tuple[Any, ...]]]):
-        """Inserts a batch of data rows into the specified table."""
+    async def _insert_batch(self, char: CharacteristicInfo, data_batch: List[Tuple[Any, ...]]):
+        """Inserts a batch of data rows into the table of a characteristic."""
+        table_name = char.table_name
         if not self._db_conn:
              log.error(f"Database connection is not available for batch insertion into {table_name}.")
              return
@@ -119,24 +102,14 @@ class Consumer_log2sqlite(Consumer):
             log.debug(f"No data provided for batch insert into {table_name}.")
             return
 
-        sanitized_headers = [sanitize_sql_identifier(h) for h in column_headers]
-        all_columns = ["device_name"] + sanitized_headers
-
-        # Prepare column names and placeholders for the INSERT statement
-        placeholders = ", ".join(["?"] * len(all_columns))
-        column_names_sql = ", ".join(all_columns)
-
-        insert_sql = f"INSERT INTO {table_name} ({column_names_sql}) VALUES ({placeholders})"
-
-        # Prepare the list of value tuples for executemany
-        # Expected input format for data_batch: List[Tuple[device_name, tuple_of_data_values]]
+        # Expected input format for data_batch: List[(device_name, value, value, ...)]
         values_list = []
-        expected_data_len = len(sanitized_headers)
-        for device_name, data_tuple in data_batch:
-            if len(data_tuple) != expected_data_len:
-                log.warning(f"Data length mismatch in batch for table {table_name}. Expected {expected_data_len} columns (headers: {sanitized_headers}), got {len(data_tuple)} (data: {data_tuple}) for device {device_name}. Skipping row.")
+        expected_row_len = len(char.sql_headers) + 1
+        for row in data_batch:
+            if len(row) != expected_row_len:
+                log.warning(f"Data length mismatch in batch for table {table_name}. Expected {expected_row_len - 1} columns (headers: {char.sql_headers}), got {len(row) - 1} (data: {row[1:]}) for device {row[0]}. Skipping row.")
                 continue
-            values_list.append((device_name,) + data_tuple)
+            values_list.append(row)
 
         if not values_list:
             log.warning(f"Batch for table {table_name} resulted in no valid rows after validation.")
@@ -144,13 +117,43 @@ class Consumer_log2sqlite(Consumer):
 
         try:
             log.debug(f"Executing batch insert into {table_name} with {len(values_list)} rows.")
-            await self._db_conn.executemany(insert_sql, values_list)
+            t_start = time.perf_counter()
+            await self._db_conn.executemany(char.insert_sql, values_list)
             await self._db_conn.commit() # Commit after the batch operation
+            self.write_latency.record(time.perf_counter() - t_start)
             log.debug(f"Successfully inserted batch of {len(values_list)} rows into {table_name}.")
         except Exception as e:
             log.error(f"Failed to insert batch data into {table_name}: {e}")
             log.exception(e)
 
+    def _group_batch(self, batch: List[NotifData]) -> Dict[int, Tuple[CharacteristicInfo, List[Tuple[Any, ...]]]]:
+        """Groups the rows of a batch by characteristic (table)."""
+        # Structure: { char_id: (char_info, [(device_name, value, value, ...), ...]) }
+        grouped_batch: Dict[int, Tuple[CharacteristicInfo, List[Tuple[Any, ...]]]] = {}
+
+        for item in batch:
+            dev, char = self.registry.lookup(item)
+
+            group = grouped_batch.get(char.id)
+            if group is None:
+                group = (char, [])
+                grouped_batch[char.id] = group
+
+            device_col = (dev.name,)
+            group[1].extend([device_col + tuple(data_item) for data_item in item.rows()])
+
+        return grouped_batch
+
+    async def _process_batch(self, batch: List[NotifData]):
+        for char, rows in self._group_batch(batch).values():
+            if not rows: continue
+
+            # Ensure the table exists
+            await self._create_table_if_not_exists(char)
+
+            # Insert the batch of data for this table
+            await self._insert_batch(char, rows)
+
     async def run(self, halt: Event):
         """Main execution loop for the SQLite consumer."""
         self._halt_event = halt # Store halt event for internal use if needed
@@ -177,43 +180,8 @@ class Consumer_log2sqlite(Consumer):
                             # No more items readily available, process what we have
                             break
 
-                    # 3. Group data by table name (characteristic)
-                    grouped_batch: Dict[str, Dict[str, Any]] = {}
-                    # Structure: { table_name: {'headers': List[str], 'rows': List[Tuple[device_name, Tuple[Any,...]]]} }
-
-                    for item in batch_to_process:
-                        # Determine device name
-                        device_name = self.config.device_aliases.get(item.device_adr, item.device_adr)
-                        # Sanitize characteristic name for use as table name
-                        table_name = sanitize_sql_identifier(item.characteristic.name)
-
-                        if table_name not in grouped_batch:
-                            grouped_batch[table_name] = {
-                                'headers': item.characteristic.column_headers, # Store headers once per table per batch
-                                'rows': []
-                            }
-                        # Basic check: Ensure headers are consistent within the batch for the same table
-                        elif grouped_batch[table_name]['headers'] != item.characteristic.column_headers:
-                             log.warning(f"Inconsistent headers for characteristic '{item.characteristic.name}' (table '{table_name}') within the same batch. Sticking with first encountered headers. Device: {device_name}")
-                             # We'll use the headers already stored and might skip this row in _insert_batch if length mismatches
-
-                        # Append (device_name, data_tuple) for each data item
-                        for data_item in item.data:
-                            grouped_batch[table_name]['rows'].append((device_name, tuple(data_item)))
-
-                    # 4. Process each group (table)
-                    for table_name, data_info in grouped_batch.items():
-                        headers = data_info['headers']
-                        rows = data_info['rows'] # List[Tuple[device_name, Tuple[Any,...]]]
-
-                        if not rows: continue # Skip if no rows ended up in this group (e.g., due to header inconsistency warnings)
-
-                        # Ensure the table exists
-                        await self._create_table_if_not_exists(table_name, headers)
-
-                        # Insert the batch of data for this table
-                        await self._insert_batch(table_name, headers, rows)
-
+                    # 3. Group data by table (characteristic), and insert it
+                    await self._process_batch(batch_to_process)
 
                 except asyncio.TimeoutError:
                     # No data received in the initial wait, check halt condition and loop again
@@ -248,22 +216,7 @@ class Consumer_log2sqlite(Consumer):
                  if not batch_to_process: break # Should not happen if !input_q.empty(), but safe check
 
                  # Group and process this final batch
-                 grouped_batch: Dict[str, Dict[str, Any]] = {}
-                 for item in batch_to_process:
-                     device_name = self.config.device_aliases.get(item.device_adr, item.device_adr)
-                     table_name = sanitize_sql_identifier(item.characteristic.name)
-                     if table_name not in grouped_batch:
-                         grouped_batch[table_name] = {'headers': item.characteristic.column_headers, 'rows': []}
-                     elif grouped_batch[table_name]['headers'] != item.characteristic.column_headers:
-                         log.warning(f"[Shutdown] Inconsistent headers for {table_name}. Skipping item.")
-                         continue
-                     for data_item in item.data:
-                         grouped_batch[table_name]['rows'].append((device_name, tuple(data_item)))
-
-                 for table_name, data_info in grouped_batch.items():
-                     if data_info['rows']:
-                        await self._create_table_if_not_exists(table_name, data_info['headers'])
-                        await self._insert_batch(table_name, data_info['headers'], data_info['rows'])
+                 await self._process_batch(batch_to_process)
 
             log.info("Finished processing remaining queue items.")
 
@@ -11,6 +11,16 @@ included LICENSE file or <https://opensource.org/licenses/MIT>.
 
 Matplotlib plot is defined in plot.py.
 plot.py runs in its own process - see plot.py for details.
+
+Data is not sent to the plotting process as NotifData objects. Instead, every
+column that is shown in a subplot (see 'plotter_subplots' in config.py) gets
+one SharedRingBuffer per device that this consumer writes samples into.
+The plotting process is only told (once, through its input queue) about each
+new buffer, and reads new samples from the shared memory itself.
+
+Before being written to the buffers, data is min/max decimated (see
+Decimator.py) so that only about as many points as the plot can show are
+passed on, regardless of how fast devices stream.
 """
 
 import asyncio
@@ -18,20 +28,33 @@ import logging
 import multiprocessing as mp
 import queue
 import signal
+import threading
+import time
 from asyncio.locks import Event
 from logging import LogRecord
 from logging.handlers import QueueHandler
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
 
 from blelog.Configuration import Configuration
 from blelog.ConsumerMgr import Consumer, NotifData
+from blelog.Decimator import MinMaxDecimator
+from blelog.PlotRenderer import FrameStats, PlotSettings
+from blelog.Profiler import SamplingProfiler
+from blelog.SharedRingBuffer import RingBufferInfo, SharedRingBuffer
 from plot import plot
 
 
 class PlottingProcess(mp.Process):
-    def __init__(self) -> None:
+    def __init__(self, settings: PlotSettings, profiler_output_dir: str) -> None:
         super().__init__()
+        self.settings = settings
+        self.profiler_output_dir = profiler_output_dir
         self.input_q = mp.Queue()
         self.log_q = mp.Queue()
+        # Profiler commands ('start'/'stop'):
+        self.control_q = mp.Queue()
 
     def run(self) -> None:
         # Ignore interrupt signals in the plotting process,
@@ -49,11 +72,27 @@ class PlottingProcess(mp.Process):
         log_warn.setLevel(logging.WARNING)
         log_warn.addHandler(QueueHandler(self.log_q))
 
+        # Handle profiler commands in the background, so that plot(...)
+        # does not have to:
+        profiler = SamplingProfiler('plotter', self.profiler_output_dir)
+        control_thread = threading.Thread(target=self._control_loop, args=(profiler,), daemon=True)
+        control_thread.start()
+
         try:
-            plot(self.input_q)
+            plot(self.input_q, self.settings)
         except Exception as e:
             log.error("Plotting process encountered an exception: %s" % str(e))
             log.exception(e)
+        finally:
+            profiler.stop(wait=True)
+
+    def _control_loop(self, profiler: SamplingProfiler) -> None:
+        while True:
+            cmd = self.control_q.get()
+            if cmd == 'start':
+                profiler.start()
+            elif cmd == 'stop':
+                profiler.stop()
 
 
 class Consumer_plotter(Consumer):
@@ -61,16 +100,39 @@ class Consumer_plotter(Consumer):
         super().__init__()
         self.config = config
         self.do_toggle_on_off = False
-        self.plotting_process = None
+        self.plotting_process = None  # type: Union[PlottingProcess, None]
+
+        # Indices of the columns of each characteristic that are shown in
+        # any subplot. Nothing else is sent to the plotting process:
+        self.plotted_columns = {}  # type: Dict[str, List[int]]
+        for char in config.characteristics:
+            col_idxs = [i for i, column in enumerate(char.column_headers)
+                        if any(sp.characteristic == char.name and column in sp.columns
+                               for sp in config.plotter_subplots)]
+            if len(col_idxs) != 0:
+                self.plotted_columns[char.name] = col_idxs
+
+        # One shared ring buffer per plotted (device, characteristic, column):
+        self.buffers = {}  # type: Dict[Tuple[str, str, str], Tuple[RingBufferInfo, SharedRingBuffer]]
+
+        # Plottable columns of each characteristic, and decimation state of
+        # each (device, characteristic):
+        self.numeric_columns = {}  # type: Dict[str, List[int]]
+        self.decimators = {}  # type: Dict[Tuple[str, str], MinMaxDecimator]
+
+        # Most recent frame statistics reported by the plotting process:
+        self.frame_stats = None  # type: Union[FrameStats, None]
+        self.last_stats_report = None  # type: Union[float, None]
+
+        # Whether the plotting process should be profiled:
+        self.profiling = False
 
     async def run(self, halt: Event):
         log = logging.getLogger('log')
         mp.set_start_method('spawn')
 
         if self.config.plotter_open_by_default:
-            self.plotting_process = PlottingProcess()
-            self.plotting_process.start()
-            log.info('Opened plotter GUI.')
+            self._open_plotter()
 
         try:
             while not halt.is_set():
@@ -86,6 +148,8 @@ class Consumer_plotter(Consumer):
         finally:
             if self.plotting_process is not None:
                 self.plotting_process.kill()
+            for _, buf in self.buffers.values():
+                buf.close()
             print('Consumer Plotter shut down...')
 
     def _monitor_plotter_process(self, halt: Event):
@@ -111,48 +175,151 @@ class Consumer_plotter(Consumer):
             self.do_toggle_on_off = False
 
             if self.plotting_process is None:
-                self.plotting_process = PlottingProcess()
-                self.plotting_process.start()
-                log.info('Opened plotter GUI.')
+                self._open_plotter()
             else:
                 self._grab_logs()
                 self.plotting_process.kill()
                 self.plotting_process = None
                 log.info('Closed plotter GUI.')
 
-    async def _stream_data(self):
+    def _open_plotter(self):
         log = logging.getLogger('log')
+        self.plotting_process = PlottingProcess(PlotSettings(
+            point_budget=self.config.plotter_point_budget,
+            target_fps=self.config.plotter_target_fps,
+            cpu_budget=self.config.plotter_cpu_budget,
+            subplots=self.config.plotter_subplots,
+        ), self.config.profiler_output_dir)
+        self.plotting_process.start()
+
+        # Tell the new process about all existing buffers:
+        for info, _ in self.buffers.values():
+            self.plotting_process.input_q.put(info)
+
+        if self.profiling:
+            self.plotting_process.control_q.put('start')
+
+        log.info('Opened plotter GUI.')
+
+    async def _stream_data(self):
         try:
             # Wait for new data:
             next_data = await asyncio.wait_for(self.input_q.get(), timeout=0.5)  # type: NotifData
             self.input_q.task_done()
 
-            # Try to pass the data to the plotting process if there is one
+            # Only bother copying data if there is a plot to show it:
             if self.plotting_process is not None:
-                attempts = 0
-                while attempts < 10:
-                    try:
-                        self.plotting_process.input_q.put_nowait(next_data)
-                        break
-                    except queue.Full:
-                        attempts += 1
-                        await asyncio.sleep(0.05)
-                else:
-                    # Failed to put into queue 10 times, log and move on:
-                    log.warning('Consumer Plotter: Failed to pass data to logging process!')
+                t_start = time.perf_counter()
+                self._write_to_buffers(next_data)
+                self.write_latency.record(time.perf_counter() - t_start)
 
         except asyncio.TimeoutError:
             pass
 
+    def _write_to_buffers(self, notif_data: NotifData):
+        log = logging.getLogger('log')
+
+        char = notif_data.characteristic
+        if char.name not in self.plotted_columns:
+            return
+
+        col_idxs = self._numeric_columns(notif_data)
+        if len(col_idxs) == 0:
+            return
+
+        try:
+            cols = notif_data.cols()
+            samples = np.asarray([cols[i] for i in col_idxs], dtype=np.float64)
+        except (ValueError, TypeError):
+            log.warning("Plotter: Received non-numeric data for '%s', not plotting it." % char.name)
+            return
+
+        dec_key = (notif_data.device_adr, char.name)
+        if dec_key not in self.decimators:
+            self.decimators[dec_key] = MinMaxDecimator(
+                len(col_idxs), self.config.plotter_point_budget, self.config.plotter_window_s)
+
+        decimated = self.decimators[dec_key].process(samples)
+        if decimated.shape[1] == 0:
+            return
+
+        for row_idx, col_idx in enumerate(col_idxs):
+            buf = self._get_buffer(notif_data, char.column_headers[col_idx])
+            buf.write(decimated[row_idx])
+
+    def _numeric_columns(self, notif_data: NotifData) -> List[int]:
+        """Indices of the plotted columns of a characteristic that can be plotted"""
+        log = logging.getLogger('log')
+        char = notif_data.characteristic
+
+        if char.name not in self.numeric_columns:
+            col_idxs = []
+            for col_idx in self.plotted_columns[char.name]:
+                try:
+                    float(notif_data.cols()[col_idx][0])
+                    col_idxs.append(col_idx)
+                except (ValueError, TypeError):
+                    log.warning("Plotter: Column '%s' of '%s' is not numeric, not plotting it." %
+                                (char.column_headers[col_idx], char.name))
+            self.numeric_columns[char.name] = col_idxs
+
+        return self.numeric_columns[char.name]
+
+    def _get_buffer(self, notif_data: NotifData, column: str) -> SharedRingBuffer:
+        key = (notif_data.device_adr, notif_data.characteristic.name, column)
+        if key not in self.buffers:
+            buf = SharedRingBuffer.create()
+            info = RingBufferInfo(
+                device_adr=notif_data.device_adr,
+                device_name_repr=notif_data.device_name_repr,
+                characteristic=notif_data.characteristic.name,
+                column=column,
+                shm_name=buf.name,
+                capacity=buf.capacity,
+            )
+            self.buffers[key] = (info, buf)
+            if self.plotting_process is not None:
+                self.plotting_process.input_q.put(info)
+        return self.buffers[key][1]
+
     def _grab_logs(self):
         log = logging.getLogger('log')
         if self.plotting_process is not None:
             while True:
                 try:
                     record = self.plotting_process.log_q.get_nowait()  # type: LogRecord
+
+                    # Frame statistics are kept, and only logged every
+                    # 'plotter_stats_report_period_s':
+                    if hasattr(record, 'plot_frame_stats'):
+                        self.frame_stats = record.plot_frame_stats
+                        self._report_frame_stats()
+                        continue
+
                     log.log(record.levelno, record.getMessage())
                 except queue.Empty:
                     break
 
+    def _report_frame_stats(self):
+        log = logging.getLogger('log')
+        period = self.config.plotter_stats_report_period_s
+        if period is None or self.frame_stats is None:
+            return
+
+        t = time.monotonic()
+        if self.last_stats_report is not None and t - self.last_stats_report < period:
+            return
+        self.last_stats_report = t
+
+        s = self.frame_stats
+        log.info('Plot: %.1f fps, frame time avg %.1fms max %.1fms, %.0f%% CPU, frame interval %.0fms, '
+                 '%i frames dropped.' % (s.fps, s.frame_time_avg_ms, s.frame_time_max_ms, 100 * s.cpu_fraction,
+                                         s.interval_ms, s.dropped_frames))
+
     def toggle_on_off(self):
         self.do_toggle_on_off = True
+
+    def set_profiling(self, on: bool):
+        self.profiling = on
+        if self.plotting_process is not None:
+            self.plotting_process.control_q.put('start' if on else 'stop')
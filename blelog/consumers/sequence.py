@@ -0,0 +1,208 @@
+"""
+blelog/consumers/sequence.py
+Consumer that detects lost, duplicate and reordered data by checking a
+rolling sequence counter embedded in the data.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Only characteristics that set a 'sequence_column' are checked. That column
+is expected to increment by one for every data row, wrapping around to zero
+at 'sequence_modulus'.
+
+For every new counter value, the distance to the last value (modulo the
+modulus) is classified as:
+
+    - 1: In order.
+    - 0: Duplicate.
+    - Small and negative (within 'reorder_window'): A late, reordered row
+      if the value was skipped by an earlier gap. It is no longer counted as
+      lost. Otherwise (the value was already received), a duplicate.
+    - Large and negative: The counter jumped back (for example, because the
+      device restarted). The tracker re-synchronises.
+    - Otherwise: A gap. All skipped values are counted as lost.
+"""
+import asyncio
+import logging
+import time
+from asyncio.locks import Event
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Set, Tuple, Union
+
+from blelog.Configuration import Configuration
+from blelog.ConsumerMgr import Consumer, NotifData
+
+# Largest backwards step that is treated as reordering instead of a restart:
+reorder_window = 1024
+
+# Number of report periods of loss-rate history kept:
+history_len = 60
+
+
+@dataclass
+class SequenceStats:
+    device_name: str
+    char_name: str
+    modulus: int
+
+    last: Union[int, None] = None
+
+    # Lifetime counts:
+    received: int = 0
+    lost: int = 0
+    gaps: int = 0
+    duplicates: int = 0
+    reordered: int = 0
+    resyncs: int = 0
+
+    # Counts at the start of the current report period:
+    period_received: int = 0
+    period_lost: int = 0
+
+    # Loss rate (0..1) of each past report period, newest last:
+    loss_history: Deque[float] = field(default_factory=lambda: deque(maxlen=history_len))
+
+    # Values skipped by gaps that may still arrive late (within
+    # 'reorder_window' of 'last'). The deque holds them oldest first, and may
+    # still contain values that have since been removed from the set:
+    missing: Set[int] = field(default_factory=set)
+    missing_order: Deque[int] = field(default_factory=deque)
+
+    def check(self, value: int) -> None:
+        self.received += 1
+
+        if self.last is None:
+            self.last = value
+            return
+
+        window = min(reorder_window, self.modulus // 2)
+        diff = (value - self.last) % self.modulus
+        if diff == 1:
+            self.last = value
+            self._forget_missing(window)
+        elif diff == 0:
+            self.duplicates += 1
+        elif diff >= self.modulus - window:
+            if value in self.missing:
+                # Late arrival, fills part of an earlier gap:
+                self.missing.discard(value)
+                self.reordered += 1
+                self.lost = max(0, self.lost - 1)
+            else:
+                self.duplicates += 1
+        elif diff > self.modulus // 2:
+            # Large jump backwards, start over:
+            self.resyncs += 1
+            self.last = value
+            self.missing.clear()
+            self.missing_order.clear()
+        else:
+            self.gaps += 1
+            self.lost += diff - 1
+
+            # Only the skipped values within the window can still arrive:
+            for skipped in range(max(1, diff - window), diff):
+                v = (self.last + skipped) % self.modulus
+                self.missing.add(v)
+                self.missing_order.append(v)
+
+            self.last = value
+            self._forget_missing(window)
+
+    def _forget_missing(self, window: int) -> None:
+        """Drop missing values that are too far behind to still arrive"""
+        while len(self.missing_order) != 0 and (self.last - self.missing_order[0]) % self.modulus > window:
+            self.missing.discard(self.missing_order.popleft())
+
+    def loss_rate(self) -> float:
+        total = self.received + self.lost
+        return self.lost / total if total > 0 else 0.0
+
+    def recent_loss_rate(self) -> float:
+        return self.loss_history[-1] if len(self.loss_history) > 0 else 0.0
+
+    def end_period(self) -> Tuple[int, int]:
+        """Finish a report period. Returns the number of rows received and lost during it."""
+        received = self.received - self.period_received
+        lost = max(0, self.lost - self.period_lost)
+        self.period_received = self.received
+        self.period_lost = self.lost
+
+        total = received + lost
+        self.loss_history.append(lost / total if total > 0 else 0.0)
+        return received, lost
+
+
+class Consumer_sequence(Consumer):
+    def __init__(self, config: Configuration):
+        super().__init__()
+        self.config = config
+
+        # Index of the sequence column of each checked characteristic:
+        self.seq_columns = {c.name: c.column_headers.index(c.sequence_column)
+                            for c in config.characteristics if c.sequence_column is not None}
+
+        # Per (device address, characteristic name):
+        self.stats = {}  # type: Dict[Tuple[str, str], SequenceStats]
+        # Number of times any stats changed:
+        self.update_count = 0
+
+        self.last_report = time.monotonic()
+
+    async def run(self, halt: Event):
+        log = logging.getLogger('log')
+
+        try:
+            while not halt.is_set():
+                await self._check_sequences()
+                self._report()
+        except Exception as e:
+            log.error('Consumer Sequence encountered an exception: %s' % str(e))
+            log.exception(e)
+            halt.set()
+        finally:
+            print('Consumer Sequence shut down...')
+
+    async def _check_sequences(self):
+        try:
+            next_data = await asyncio.wait_for(self.input_q.get(), timeout=0.5)  # type: NotifData
+            self.input_q.task_done()
+
+            char = next_data.characteristic
+            if char.name not in self.seq_columns:
+                return
+
+            key = (next_data.device_adr, char.name)
+            if key not in self.stats:
+                self.stats[key] = SequenceStats(next_data.device_name_repr, char.name, char.sequence_modulus)
+
+            stats = self.stats[key]
+            col_idx = self.seq_columns[char.name]
+            for value in next_data.cols()[col_idx]:
+                stats.check(int(value))
+            self.update_count += 1
+
+        except asyncio.TimeoutError:
+            pass
+
+    def _report(self):
+        log = logging.getLogger('log')
+
+        t = time.monotonic()
+        period = t - self.last_report
+        if period < self.config.sequence_report_period_s:
+            return
+        self.last_report = t
+        self.update_count += 1
+
+        for stats in self.stats.values():
+            received, lost = stats.end_period()
+            if lost > 0:
+                log.warning('%s: Lost %i of %i %s rows in the last %is (%.2f%% loss).' %
+                            (stats.device_name, lost, received + lost, stats.char_name, round(period),
+                             100 * stats.recent_loss_rate()))
@@ -8,66 +8,208 @@ Copyright (C) 2024 Philipp Schilk
 This work is licensed under the terms of the MIT license.  For a copy, see the
 included LICENSE file or <https://opensource.org/licenses/MIT>.
 ---------------------------------
+
+Notifications/s, rows/s and bytes/s are tracked per device and
+characteristic as exponentially weighted moving averages (with a time
+constant of 'throughput_period_s'), alongside lifetime totals. The current
+figures are available in 'Consumer_throughput.channels' and
+'Consumer_throughput.devices', and can optionally be written to a CSV
+time series ('throughput_log_file').
 """
 
 import asyncio
+import csv
+import io
 import logging
+import math
+import os
 import time
 from asyncio.locks import Event
+from dataclasses import dataclass
+from typing import Dict, Tuple, Union
+
+import aiofiles
 
 from blelog.Configuration import Configuration
 from blelog.ConsumerMgr import Consumer, NotifData
 
+# How often (in seconds) rates are updated:
+tick_period_s = 0.5
+
+series_headers = ['time', 'device', 'characteristic',
+                  'notifs_per_s', 'rows_per_s', 'bytes_per_s',
+                  'notifs_total', 'rows_total', 'bytes_total']
+
+
+@dataclass
+class ThroughputStats:
+    name: str
+
+    # Lifetime totals:
+    notifs_total: int = 0
+    rows_total: int = 0
+    bytes_total: int = 0
+
+    # Smoothed rates (per second):
+    notif_rate: float = 0.0
+    row_rate: float = 0.0
+    byte_rate: float = 0.0
+
+    # Counts since the last rate update:
+    notifs_pending: int = 0
+    rows_pending: int = 0
+    bytes_pending: int = 0
+
+    def add(self, notifs: int, rows: int, n_bytes: int) -> None:
+        self.notifs_pending += notifs
+        self.rows_pending += rows
+        self.bytes_pending += n_bytes
+
+    def update_rates(self, delta_s: float, alpha: float) -> None:
+        self.notif_rate += alpha * (self.notifs_pending/delta_s - self.notif_rate)
+        self.row_rate += alpha * (self.rows_pending/delta_s - self.row_rate)
+        self.byte_rate += alpha * (self.bytes_pending/delta_s - self.byte_rate)
+
+        self.notifs_total += self.notifs_pending
+        self.rows_total += self.rows_pending
+        self.bytes_total += self.bytes_pending
+
+        self.notifs_pending = 0
+        self.rows_pending = 0
+        self.bytes_pending = 0
+
 
 class Consumer_throughput(Consumer):
     def __init__(self, config: Configuration):
         super().__init__()
         self.config = config
-        self.meas_period_start = None
-        self.meas_period_total_bits = 0
+
+        # Per (device address, characteristic name):
+        self.channels = {}  # type: Dict[Tuple[str, str], ThroughputStats]
+        # Per device address:
+        self.devices = {}  # type: Dict[str, ThroughputStats]
+        # All devices:
+        self.total = ThroughputStats('Total')
+
+        self.last_tick = None  # type: Union[float, None]
+        # Number of times the rates were updated:
+        self.tick_count = 0
+        self.last_report = None  # type: Union[float, None]
 
     async def run(self, halt: Event):
         log = logging.getLogger('log')
+        series_file = None
 
         try:
+            if self.config.throughput_log_file is not None:
+                series_file = await self._open_series_file()
+
             while not halt.is_set():
-                await self._measure_throughput()
+                await self._receive()
+                self._tick()
+                await self._report(series_file)
         except Exception as e:
             log.error('Consumer Throughput encountered an exception: %s' % str(e))
             log.exception(e)
             halt.set()
         finally:
+            if series_file is not None:
+                await series_file.close()
             print('Consumer Throughput shut down...')
 
-    async def _measure_throughput(self):
-        log = logging.getLogger('log')
-
+    async def _receive(self):
         # Receive more data:
         try:
-            next_data = await asyncio.wait_for(self.input_q.get(), timeout=0.5)  # type: NotifData
+            next_data = await asyncio.wait_for(self.input_q.get(), timeout=tick_period_s)  # type: NotifData
             self.input_q.task_done()
+            self._count(next_data)
 
-            if self.meas_period_start is None:
-                self.meas_period_start = time.monotonic()
-
-            self.meas_period_total_bits += len(next_data.data_raw)*8
+            # Grab everything else that is already waiting:
+            while True:
+                next_data = self.input_q.get_nowait()
+                self.input_q.task_done()
+                self._count(next_data)
 
-        except asyncio.TimeoutError:
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
             pass
 
-        # Calculate throughput:
-        if self.config.throughput_period_s is None:
-            return
+    def _count(self, notif_data: NotifData):
+        key = (notif_data.device_adr, notif_data.characteristic.name)
+        if key not in self.channels:
+            self.channels[key] = ThroughputStats(notif_data.characteristic.name)
+            if notif_data.device_adr not in self.devices:
+                self.devices[notif_data.device_adr] = ThroughputStats(notif_data.device_name_repr)
+
+        self.channels[key].add(notif_data.notif_count, notif_data.row_count(), len(notif_data.data_raw))
 
-        if self.meas_period_start is None:
+    def _tick(self):
+        t = time.monotonic()
+        if self.last_tick is None:
+            self.last_tick = t
+            self.last_report = t
             return
 
-        delta_s = time.monotonic() - self.meas_period_start
-        if delta_s > self.config.throughput_period_s:
-            bits_per_second = self.meas_period_total_bits/delta_s
+        delta_s = t - self.last_tick
+        if delta_s < tick_period_s:
+            return
+        self.last_tick = t
+        self.tick_count += 1
+
+        # EWMA factor for irregular update intervals:
+        tau = self.config.throughput_period_s
+        alpha = 1 - math.exp(-delta_s / tau)
+
+        # Roll channel counts up into devices and total:
+        for (adr, _), ch in self.channels.items():
+            self.devices[adr].add(ch.notifs_pending, ch.rows_pending, ch.bytes_pending)
+        for dev in self.devices.values():
+            self.total.add(dev.notifs_pending, dev.rows_pending, dev.bytes_pending)
+
+        for ch in self.channels.values():
+            ch.update_rates(delta_s, alpha)
+        for dev in self.devices.values():
+            dev.update_rates(delta_s, alpha)
+        self.total.update_rates(delta_s, alpha)
+
+    async def _report(self, series_file):
+        log = logging.getLogger('log')
 
-            if self.meas_period_total_bits > 0:
-                log.info(f"RX Throughput: {bits_per_second:.4} bit/second.")
+        if self.last_report is None:
+            return
 
-            self.meas_period_start = time.monotonic()
-            self.meas_period_total_bits = 0
+        t = time.monotonic()
+        if t - self.last_report < self.config.throughput_period_s:
+            return
+        self.last_report = t
+
+        if self.total.byte_rate > 0:
+            log.info(f"RX Throughput: {self.total.byte_rate*8:.4} bit/second.")
+
+        if series_file is not None:
+            await self._write_series(series_file)
+
+    async def _open_series_file(self):
+        path = self.config.throughput_log_file
+        if os.path.exists(path):
+            return await aiofiles.open(path, 'a', newline='')
+
+        f = await aiofiles.open(path, 'w', newline='')
+        row_str_io = io.StringIO()
+        csv.writer(row_str_io).writerow(series_headers)
+        await f.write(row_str_io.getvalue())
+        return f
+
+    async def _write_series(self, f):
+        row_str_io = io.StringIO()
+        csv_writer = csv.writer(row_str_io)
+        t = round(time.time(), 3)
+
+        for (adr, char_name), ch in self.channels.items():
+            csv_writer.writerow([
+                t, self.devices[adr].name, char_name,
+                round(ch.notif_rate, 3), round(ch.row_rate, 3), round(ch.byte_rate, 3),
+                ch.notifs_total, ch.rows_total, ch.bytes_total
+            ])
+
+        await f.write(row_str_io.getvalue())
+        await f.flush()
@@ -0,0 +1,420 @@
+"""
+blelog/consumers/worker.py
+Runs a data consumer in its own process.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Consumer_worker stands in for a consumer (such as log2csv or log2sqlite) in
+BLELog's process, and runs the actual consumer in a worker process. This way,
+formatting and writing data happens on another core, and does not hold the
+GIL while notifications are being received.
+
+Data is sent through a pipe, in batches of everything that arrived since the
+last batch. Items are packed as plain tuples (device id, characteristic id,
+notification count, rows, columns) - the raw data is not sent. The ids are
+those of BLELog's Registry. The worker keeps its own Registry, and is told
+about every new device (in order) so that it assigns the same ids.
+
+Pickling and writing to the pipe is done by a separate thread, so that a
+slow worker can never block the event loop. That thread owns its end of the
+pipe, and closes it when it exits. If the worker falls behind, data
+backs up in this consumer's input queue, where ConsumerMgr reports it.
+
+The worker sends a heartbeat (with its write latency) every
+'heartbeat_interval_s'. If it exits unexpectedly, or stops sending
+heartbeats, it is killed and restarted. Batches that were in flight when the
+worker died are lost. Once BLELog is shutting down, workers are not restarted
+anymore, and data that no worker is left to write (or that is not written
+within 'shutdown_timeout_s') is dropped.
+
+Any consumer whose constructor takes (config, registry) can be run this way.
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import pickle
+import queue
+import signal
+import threading
+import time
+from asyncio.locks import Event
+from logging import LogRecord
+from logging.handlers import QueueHandler
+from multiprocessing.connection import Connection
+from typing import Any, List, Tuple, Type, Union
+
+from blelog.Configuration import Configuration
+from blelog.ConsumerMgr import Consumer, LatencyStats, NotifData
+from blelog.Registry import Registry
+
+# Maximum number of items per batch:
+max_batch_items = 1000
+
+# Maximum number of batches waiting to be sent to the worker:
+max_pending_batches = 16
+
+heartbeat_interval_s = 1
+heartbeat_timeout_s = 10
+
+# Delay before restarting a worker, doubled after every failed restart:
+restart_delay_s = 1
+restart_delay_max_s = 60
+
+# Time given to a worker to write any remaining data when shutting down:
+shutdown_timeout_s = 30
+
+# Time given to the sender thread to finish once the worker has exited:
+sender_join_timeout_s = 5
+
+# (device id, characteristic id, notification count, rows, columns):
+PackedItem = Tuple[int, int, int, Union[None, List[List[Any]]], Union[None, List[Any]]]
+
+# (addresses of new devices, items):
+PackedBatch = Tuple[List[str], List[PackedItem]]
+
+
+class ConsumerProcess(mp.get_context('spawn').Process):
+    def __init__(self, consumer_class: Type[Consumer], config: Configuration, data_conn: Connection) -> None:
+        super().__init__(daemon=True)
+        self.consumer_class = consumer_class
+        self.config = config
+        self.data_conn = data_conn
+        ctx = mp.get_context('spawn')
+        self.log_q = ctx.Queue()
+        # Heartbeats, as (items received, write count, total write time, max write time):
+        self.status_q = ctx.Queue()
+
+    def run(self) -> None:
+        # Ignore interrupt signals in the worker process,
+        # BLELog will take care of stopping it:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        # Reroute 'log' and warnings to the log queue:
+        log = logging.getLogger('log')
+        log.setLevel(logging.DEBUG)
+        log.addHandler(QueueHandler(self.log_q))
+
+        logging.captureWarnings(True)
+        log_warn = logging.getLogger('py.warnings')
+        log_warn.setLevel(logging.WARNING)
+        log_warn.addHandler(QueueHandler(self.log_q))
+
+        asyncio.run(self._main())
+
+    async def _main(self) -> None:
+        log = logging.getLogger('log')
+        loop = asyncio.get_running_loop()
+
+        registry = Registry(self.config)
+        consumer = self.consumer_class(self.config, registry)
+        halt = Event()
+        consumer_task = asyncio.create_task(consumer.run(halt))
+
+        # Receive batches in a separate thread. None signals the end of data:
+        batches = asyncio.Queue()
+        receiver = threading.Thread(target=self._receive, args=(loop, batches), daemon=True)
+        receiver.start()
+
+        items = 0
+        last_heartbeat = 0.0
+        try:
+            while not consumer_task.done():
+                now = time.monotonic()
+                if now - last_heartbeat >= heartbeat_interval_s:
+                    lat = consumer.write_latency
+                    self.status_q.put((items, lat.count, lat.total_s, lat.max_s))
+                    last_heartbeat = now
+
+                try:
+                    batch = await asyncio.wait_for(batches.get(),
+                                                   timeout=heartbeat_interval_s)  # type: Union[None, PackedBatch]
+                except asyncio.TimeoutError:
+                    continue
+
+                if batch is None:
+                    break
+
+                new_devices, packed_items = batch
+                for adr in new_devices:
+                    registry.device(adr)
+
+                for device_id, char_id, notif_count, rows, columns in packed_items:
+                    dev = registry.devices[device_id]
+                    char = registry.characteristics[char_id].characteristic
+                    consumer.input_q.put_nowait(NotifData(dev.adr, dev.name, char, rows, bytearray(),
+                                                          columns=columns, notif_count=notif_count,
+                                                          device_id=device_id, char_id=char_id))
+                items += len(packed_items)
+
+        except Exception as e:
+            log.error('Worker %s encountered an exception: %s' % (self.consumer_class.__name__, str(e)))
+            log.exception(e)
+        finally:
+            halt.set()
+            await consumer_task
+
+    def _receive(self, loop: asyncio.AbstractEventLoop, batches: asyncio.Queue) -> None:
+        while True:
+            try:
+                batch = pickle.loads(self.data_conn.recv_bytes())
+            except (EOFError, OSError):
+                # BLELog went away:
+                batch = None
+            loop.call_soon_threadsafe(batches.put_nowait, batch)
+            if batch is None:
+                return
+
+
+class Consumer_worker(Consumer):
+    def __init__(self, config: Configuration, registry: Registry, consumer_class: Type[Consumer]):
+        super().__init__()
+        self.config = config
+        self.registry = registry
+        self.consumer_class = consumer_class
+
+        self.process = None  # type: Union[None, ConsumerProcess]
+        self.sender = None  # type: Union[None, threading.Thread]
+        # Batches waiting to be sent by the sender thread:
+        self.send_q = queue.Queue(maxsize=max_pending_batches)
+
+        # Number of devices the current worker has been told about:
+        self.sent_devices = 0
+
+        self.started = 0.0
+        self.last_heartbeat = 0.0
+        self.restarts = 0
+        self.restart_delay_s = restart_delay_s
+        self.restart_at = None  # type: Union[None, float]
+        self.items_sent = 0
+        self.items_received = 0
+
+        # Write latency of previous workers, and of the current one:
+        self.latency_base = LatencyStats()
+        self.latency_current = (0, 0.0, 0.0)
+
+    def name(self) -> str:
+        return self.consumer_class.__name__
+
+    async def run(self, halt: Event):
+        log = logging.getLogger('log')
+
+        try:
+            self._start_worker()
+
+            halted_at = None  # type: Union[None, float]
+            while not (halt.is_set() and self.input_q.empty()):
+                self._grab_logs()
+                self._grab_status()
+                # Workers are not restarted once BLELog is shutting down:
+                self._monitor_worker(restart=not halt.is_set())
+
+                if halt.is_set():
+                    if halted_at is None:
+                        halted_at = time.monotonic()
+                    if self.process is None or time.monotonic() - halted_at > shutdown_timeout_s:
+                        self._drop_remaining()
+                        break
+
+                await self._forward_data()
+
+        except Exception as e:
+            log.error('Consumer worker %s encountered an exception: %s' % (self.name(), str(e)))
+            log.exception(e)
+            halt.set()
+        finally:
+            await self._stop_worker()
+            print('Consumer worker %s shut down...' % self.name())
+
+    def _start_worker(self) -> None:
+        log = logging.getLogger('log')
+
+        recv_conn, send_conn = mp.get_context('spawn').Pipe(duplex=False)
+        self.process = ConsumerProcess(self.consumer_class, self.config, recv_conn)
+        self.process.start()
+        # The worker has its own copy:
+        recv_conn.close()
+
+        # The sender thread owns (and closes) the sending end:
+        self.send_q = queue.Queue(maxsize=max_pending_batches)
+        self.sender = threading.Thread(target=self._send, args=(send_conn, self.send_q), daemon=True)
+        self.sender.start()
+
+        self.sent_devices = 0
+        self.items_sent = 0
+        self.items_received = 0
+        self.started = time.monotonic()
+        self.last_heartbeat = self.started
+        self.latency_current = (0, 0.0, 0.0)
+        log.info('Started worker process for %s (pid %i).' % (self.name(), self.process.pid))
+
+    async def _stop_worker(self) -> None:
+        log = logging.getLogger('log')
+        if self.process is None:
+            return
+
+        # Tell the worker that there is no more data, and give it time to
+        # write what it has:
+        deadline = time.monotonic() + shutdown_timeout_s
+        while self.sender is not None and self.sender.is_alive() and time.monotonic() < deadline:
+            try:
+                self.send_q.put_nowait(None)
+                break
+            except queue.Full:
+                self._grab_logs()
+                await asyncio.sleep(0.1)
+        while self.process.is_alive() and time.monotonic() < deadline:
+            self._grab_logs()
+            await asyncio.sleep(0.1)
+
+        if self.process.is_alive():
+            log.warning('Worker process for %s did not shut down in time, killing it.' % self.name())
+            self.process.kill()
+        self._grab_logs()
+        self._grab_status()
+
+        # Once the worker is gone, the sender thread finishes (and closes
+        # the pipe) as soon as it notices:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.sender.join, sender_join_timeout_s)
+        if self.sender.is_alive():
+            log.warning('Sender thread for %s did not finish.' % self.name())
+        self.process = None
+
+    def _kill_worker(self) -> None:
+        self._grab_logs()
+        self.process.kill()
+        self.process = None
+
+        # Stop the sender thread. If it is busy writing, it fails once the
+        # worker is gone (the pipe breaks). Otherwise, it picks up None.
+        # Either way, it closes its end of the pipe itself:
+        try:
+            self.send_q.put_nowait(None)
+        except queue.Full:
+            pass
+
+        # Keep the latency measured by the dead worker:
+        count, total_s, max_s = self.latency_current
+        self.latency_base.count += count
+        self.latency_base.total_s += total_s
+        self.latency_base.max_s = max(self.latency_base.max_s, max_s)
+        self.latency_current = (0, 0.0, 0.0)
+
+    def _monitor_worker(self, restart: bool = True) -> None:
+        log = logging.getLogger('log')
+        now = time.monotonic()
+
+        if self.process is None:
+            if restart and self.restart_at is not None and now >= self.restart_at:
+                self.restart_at = None
+                self.restarts += 1
+                self._start_worker()
+            return
+
+        if not self.process.is_alive():
+            log.error('Worker process for %s exited unexpectedly (exit code %s). Restarting in %.0fs...'
+                      % (self.name(), str(self.process.exitcode), self.restart_delay_s))
+        elif now - self.last_heartbeat > heartbeat_timeout_s:
+            log.error('Worker process for %s stopped responding. Restarting in %.0fs...'
+                      % (self.name(), self.restart_delay_s))
+        else:
+            # Healthy for a while: reset the restart delay.
+            if now - self.started > restart_delay_max_s:
+                self.restart_delay_s = restart_delay_s
+            return
+
+        lost = self.items_sent - self.items_received
+        if lost > 0:
+            log.error('Up to %i items sent to the worker process for %s were lost.' % (lost, self.name()))
+
+        self._kill_worker()
+        self.restart_at = now + self.restart_delay_s
+        self.restart_delay_s = min(2 * self.restart_delay_s, restart_delay_max_s)
+
+    def _drop_remaining(self) -> None:
+        """Discard the input queue, if no worker is left to write it while shutting down"""
+        log = logging.getLogger('log')
+        dropped = 0
+        while not self.input_q.empty():
+            self.input_q.get_nowait()
+            self.input_q.task_done()
+            dropped += 1
+        if dropped > 0:
+            log.error('No worker process for %s to write the remaining data. %i items were dropped.'
+                      % (self.name(), dropped))
+
+    async def _forward_data(self) -> None:
+        if self.process is None or self.send_q.full():
+            # Wait for the worker (re)start, or for it to catch up:
+            await asyncio.sleep(0.05)
+            return
+
+        try:
+            # Wait for new data, and grab everything else that is available:
+            batch = [await asyncio.wait_for(self.input_q.get(), timeout=0.5)]  # type: List[NotifData]
+            while len(batch) < max_batch_items and not self.input_q.empty():
+                batch.append(self.input_q.get_nowait())
+        except asyncio.TimeoutError:
+            return
+
+        packed_items = []  # type: List[PackedItem]
+        for data in batch:
+            dev, char = self.registry.lookup(data)
+            packed_items.append((dev.id, char.id, data.notif_count, data.data, data.columns))
+            self.input_q.task_done()
+
+        new_devices = [dev.adr for dev in self.registry.devices[self.sent_devices:]]
+        self.sent_devices = len(self.registry.devices)
+
+        self.send_q.put_nowait((new_devices, packed_items))
+        self.items_sent += len(packed_items)
+
+    @staticmethod
+    def _send(conn: Connection, send_q: queue.Queue) -> None:
+        log = logging.getLogger('log')
+        try:
+            while True:
+                batch = send_q.get()
+                try:
+                    if batch is None:
+                        conn.send_bytes(pickle.dumps(None))
+                        return
+                    conn.send_bytes(pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL))
+                except OSError:
+                    # Worker died or was killed, the pipe is broken:
+                    return
+                except Exception as e:
+                    log.error('Failed to send data to worker process: %s' % str(e))
+        finally:
+            conn.close()
+
+    def _grab_logs(self) -> None:
+        log = logging.getLogger('log')
+        if self.process is not None:
+            while True:
+                try:
+                    record = self.process.log_q.get_nowait()  # type: LogRecord
+                    log.log(record.levelno, record.getMessage())
+                except queue.Empty:
+                    break
+
+    def _grab_status(self) -> None:
+        if self.process is not None:
+            while True:
+                try:
+                    items, count, total_s, max_s = self.process.status_q.get_nowait()
+                except queue.Empty:
+                    break
+                self.last_heartbeat = time.monotonic()
+                self.items_received = items
+                self.latency_current = (count, total_s, max_s)
+
+        count, total_s, max_s = self.latency_current
+        self.write_latency.count = self.latency_base.count + count
+        self.write_latency.total_s = self.latency_base.total_s + total_s
+        self.write_latency.max_s = max(self.latency_base.max_s, max_s)
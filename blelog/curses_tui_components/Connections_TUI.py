@@ -9,14 +9,27 @@ This work is licensed under the terms of the MIT license.  For a copy, see the
 included LICENSE file or <https://opensource.org/licenses/MIT>.
 ---------------------------------
 """
-from typing import List
+import math
+from typing import List, Union
 import tabulate
 import time
 
 from blelog.Configuration import Configuration
 from blelog.TUI import CursesTUI_Component
-from blelog.ConnectionMgr import ConnectionMgr
+from blelog.ConnectionMgr import ConnectionMgr, ManagedConnection
 from blelog.ActiveConnection import ConnectionState
+from blelog.ConnectionTiming import PhaseHistogram
+from blelog.curses_tui_components.TableView import TableView, help_line
+
+# Connected devices without a notification (of any characteristic) for
+# this long (in seconds) are shown by the 'stale' filter:
+stale_s = 5
+
+state_order = {
+    ConnectionState.CONNECTED: 0,
+    ConnectionState.CONNECTING: 1,
+    ConnectionState.DISCONNECTED: 2,
+}
 
 
 class Connections_TUI(CursesTUI_Component):
@@ -37,34 +50,91 @@ class Connections_TUI(CursesTUI_Component):
                 ConnectionState.CONNECTED: '✅ ',
             }
 
+        self.view = TableView(
+            sort_keys=[
+                ('name', lambda con: con.scanner_information.get_name_repr()),
+                ('state', lambda con: state_order[con.state()]),
+                ('staleness', self._staleness),
+                ('rate', self._notif_rate),
+                ('success rate', lambda con: con.timing.success_rate()),
+            ],
+            filters=[
+                ('active', lambda con: con.state() != ConnectionState.DISCONNECTED),
+                ('connected', lambda con: con.state() == ConnectionState.CONNECTED),
+                ('connecting', lambda con: con.state() == ConnectionState.CONNECTING),
+                ('backing off', lambda con: con.state() == ConnectionState.DISCONNECTED and con.backing_off()),
+                ('stale', lambda con: (self._staleness(con) or 0) > stale_s),
+                ('all', lambda con: True),
+            ],
+            page_rows=config.tui_page_rows)
+
     def get_lines(self) -> List[str]:
-        mgr = self.mgr
-        header = ['']
-        conn_state_row = ['']
-        conn_time_row = ['']
-        char_rows = {c.uuid: [c.name] for c in mgr.config.characteristics}
-        for con in mgr.connections.values():
+        header = ['Device', 'State', 'Connected', 'Success rate', 'Connect p50/p90 (s)', 'Notify p50/p90 (s)',
+                  'Notifs/s']
+        header.extend(['%s (s)' % c.name for c in self.config.characteristics])
+        rows = []
 
-            if con.active_connection is None or con.active_connection.state == ConnectionState.DISCONNECTED:
-                continue
+        t_now = time.monotonic_ns()
+        for con in self.view.select(self.mgr.connections.values()):
+            state = con.state()
+            row = [con.scanner_information.get_name_repr(), self.state_icon[state]+str(state)]
 
-            header.append(con.scanner_information.get_name_repr())
+            active = con.active_connection if state != ConnectionState.DISCONNECTED else None
+            row.append(active.active_time_str() if active is not None else '')
 
-            state = con.state()
-            conn_state_row.append(self.state_icon[state]+str(state))
+            rate = con.timing.success_rate()
+            row.append('%i%% of %i' % (round(rate * 100), len(con.timing.outcomes)) if rate is not None else '')
+            row.append(self._quantiles(con.timing.phases['connect']))
+            row.append(self._quantiles(con.timing.phases['notify']))
 
-            conn_time_row.append(con.active_connection.active_time_str())
+            notif_rate = self._notif_rate(con)
+            row.append('%.1f' % notif_rate if notif_rate is not None else '')
 
             for char in self.config.characteristics:
-                t_ns = con.active_connection.last_notif[char.uuid]
+                t_ns = active.last_notif[char.uuid] if active is not None else None
                 if t_ns is not None:
-                    t = str(round((time.monotonic_ns() - t_ns)/1e9, 2))
+                    t = str(round((t_now - t_ns)/1e9, 2))
                 else:
-                    t = 'x'
-                char_rows[char.uuid].append(t)
+                    t = 'x' if active is not None else ''
+                row.append(t)
+
+            rows.append(row)
+
+        lines = [self.view.status(), '']
+        lines.extend(tabulate.tabulate(rows, header, tablefmt='plain').splitlines())
+        return lines
+
+    @staticmethod
+    def _notif_rate(con: ManagedConnection) -> Union[None, float]:
+        if con.state() != ConnectionState.CONNECTED:
+            return None
+        return con.active_connection.notif_rate()
+
+    @staticmethod
+    def _staleness(con: ManagedConnection) -> Union[None, float]:
+        """Seconds since the least recent notification of any characteristic, if connected"""
+        if con.state() != ConnectionState.CONNECTED:
+            return None
+        last_notifs = con.active_connection.last_notif.values()
+        if any(t_ns is None for t_ns in last_notifs):
+            return math.inf
+        if len(last_notifs) == 0:
+            return None
+        return (time.monotonic_ns() - min(last_notifs)) / 1e9
+
+    def _quantiles(self, hist: PhaseHistogram) -> str:
+        if hist.quantile(0.5) is None:
+            return ''
+        return '%.2f/%.2f' % (hist.quantile(0.5), hist.quantile(0.9))
+
+    def selectable(self) -> bool:
+        return True
+
+    def handle_key(self, key: int) -> bool:
+        return self.view.handle_key(key)
 
-        rows = [conn_state_row, conn_time_row, *char_rows.values()]
-        return tabulate.tabulate(rows, header, tablefmt='plain').splitlines()
+    def key_help(self) -> str:
+        return help_line
 
     def title(self) -> str:
-        return 'ACTIVE CONNECTIONS'
+        return 'CONNECTIONS'
@@ -25,10 +25,11 @@ class Log_TUI(CursesTUI_Component):
         self.q = deque(maxlen=self.max_height)
 
         self.log = logging.getLogger('log')
-        lh = LogHandler(self.q)
+        self.lh = LogHandler(self.q)
 
-        lh.setLevel(logging.INFO)
-        self.log.addHandler(lh)
+        self.lh.setLevel(logging.INFO)
+        self.log.addHandler(self.lh)
+        self.drawn_count = -1
 
         if self.config.plain_ascii_tui:
             self.icon = {
@@ -43,7 +44,11 @@ class Log_TUI(CursesTUI_Component):
                 'ERROR': '‼️'
             }
 
+    def changed(self) -> bool:
+        return self.lh.count != self.drawn_count
+
     def get_lines(self) -> List[str]:
+        self.drawn_count = self.lh.count
         lines = []
         for record in self.q:
             icon = self.icon[record.levelname]
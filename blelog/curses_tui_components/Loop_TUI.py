@@ -0,0 +1,27 @@
+"""
+blelog/curses_tui_components/Loop_TUI.py
+'Event Loop' Section of the curses dashboard, showing loop lag and slow
+callbacks.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+"""
+from typing import List
+
+from blelog.LoopMonitor import LoopLagMonitor
+from blelog.TUI import CursesTUI_Component
+
+
+class Loop_TUI(CursesTUI_Component):
+    def __init__(self, monitor: LoopLagMonitor):
+        self.monitor = monitor
+
+    def get_lines(self) -> List[str]:
+        return self.monitor.summary_lines()
+
+    def title(self) -> str:
+        return 'EVENT LOOP'
@@ -11,14 +11,20 @@ included LICENSE file or <https://opensource.org/licenses/MIT>.
 """
 import tabulate
 import time
-from typing import List
+from typing import List, Union
 
-from blelog.Scanner import Scanner, SeenDeviceState
+from blelog.Configuration import Configuration
+from blelog.Scanner import Scanner, SeenDevice, SeenDeviceState
 from blelog.TUI import CursesTUI_Component
+from blelog.curses_tui_components.TableView import TableView, help_line
+
+# Devices with an average RSSI (in dBm) of at least this are shown by the
+# 'strong signal' filter:
+strong_rssi_dbm = -70
 
 
 class Scanner_TUI(CursesTUI_Component):
-    def __init__(self, scnr: Scanner, config):
+    def __init__(self, scnr: Scanner, config: Configuration):
         self.scnr = scnr
 
         if config.plain_ascii_tui:
@@ -26,35 +32,68 @@ class Scanner_TUI(CursesTUI_Component):
                 SeenDeviceState.RECENTLY_SEEN: '',
                 SeenDeviceState.NOT_SEEN: '',
             }
+            self.plus_minus = '+/-'
         else:
             self.state_icon = {
                 SeenDeviceState.RECENTLY_SEEN: '✅ ',
                 SeenDeviceState.NOT_SEEN: '❔ ',
             }
+            self.plus_minus = '±'
+
+        self.view = TableView(
+            sort_keys=[
+                ('name', lambda d: d.get_name_repr()),
+                ('address', lambda d: d.adr),
+                ('RSSI', lambda d: d.rssi_mean),
+                ('time since scan', self._since_scan_key),
+            ],
+            filters=[
+                ('all', lambda d: True),
+                ('recently seen', lambda d: d.state == SeenDeviceState.RECENTLY_SEEN),
+                ('not seen', lambda d: d.state == SeenDeviceState.NOT_SEEN),
+                ('strong signal', lambda d: d.rssi_mean is not None and d.rssi_mean >= strong_rssi_dbm),
+            ],
+            page_rows=config.tui_page_rows)
 
     def get_lines(self) -> List[str]:
-        scnr = self.scnr
-        headers = ['Name', 'Address', 'State', 'Time Since Scan (s)', 'RSSI']
+        headers = ['Name', 'Address', 'State', 'Time Since Scan (s)', 'RSSI (avg %s std)' % self.plus_minus]
         rows = []
 
-        for d in scnr.seen_devices.values():
+        t_now = time.monotonic_ns()
+        for d in self.view.select(self.scnr.seen_devices.values()):
             name = d.get_name_repr()
             adr = d.adr
             state = self.state_icon[d.state] + str(d.state)
 
             if d.last_seen is not None:
-                t = round((time.monotonic_ns() - d.last_seen)/1e9, 2)
+                t = round((t_now - d.last_seen)/1e9, 2)
             else:
                 t = ''
 
-            if d.state == SeenDeviceState.RECENTLY_SEEN and d.rssi is not None:
-                rssi = str(d.rssi)
+            if d.state == SeenDeviceState.RECENTLY_SEEN and d.rssi_mean is not None:
+                rssi = '%.0f %s %.0f' % (d.rssi_mean, self.plus_minus, d.rssi_std())
             else:
                 rssi = ''
 
             rows.append([name, adr, state, t, rssi])
 
-        return tabulate.tabulate(rows, headers, tablefmt='plain').splitlines()
+        lines = [self.view.status(), '']
+        lines.extend(tabulate.tabulate(rows, headers, tablefmt='plain').splitlines())
+        return lines
+
+    @staticmethod
+    def _since_scan_key(d: SeenDevice) -> Union[None, int]:
+        # Most recently seen first:
+        return -d.last_seen if d.last_seen is not None else None
+
+    def selectable(self) -> bool:
+        return True
+
+    def handle_key(self, key: int) -> bool:
+        return self.view.handle_key(key)
+
+    def key_help(self) -> str:
+        return help_line
 
     def title(self) -> str:
         return 'SCANNER'
@@ -0,0 +1,42 @@
+"""
+blelog/curses_tui_components/Sequence_TUI.py
+'Sequence' Section of the curses dashboard, showing packet loss.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+"""
+from typing import List
+
+import tabulate
+
+from blelog.consumers.sequence import Consumer_sequence
+from blelog.TUI import CursesTUI_Component
+
+
+class Sequence_TUI(CursesTUI_Component):
+    def __init__(self, consumer: Consumer_sequence):
+        self.consumer = consumer
+        self.drawn_update = -1
+
+    def changed(self) -> bool:
+        return self.consumer.update_count != self.drawn_update
+
+    def get_lines(self) -> List[str]:
+        self.drawn_update = self.consumer.update_count
+        headers = ['Device', 'Characteristic', 'Received', 'Lost', 'Loss %', 'Recent Loss %',
+                   'Gaps', 'Duplicates', 'Reordered', 'Resyncs']
+        rows = []
+
+        for s in self.consumer.stats.values():
+            rows.append([s.device_name, s.char_name, s.received, s.lost,
+                         100 * s.loss_rate(), 100 * s.recent_loss_rate(),
+                         s.gaps, s.duplicates, s.reordered, s.resyncs])
+
+        return tabulate.tabulate(rows, headers, tablefmt='plain', floatfmt='.2f').splitlines()
+
+    def title(self) -> str:
+        return 'SEQUENCE'
@@ -0,0 +1,102 @@
+"""
+blelog/curses_tui_components/TableView.py
+Sorting, filtering and paging for TUI components that list many devices.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+A TableView picks the items that are shown on the current page. Only these
+are formatted by the component, so the cost of a frame depends on the page
+size and not on the number of devices.
+
+Sort keys return None for items without a value, which are always sorted
+last. Only the first pages are sorted (with heapq.nsmallest/nlargest).
+
+Keys (when the component is selected with TAB):
+    's': Next sort key          'r': Reverse sort order
+    'f': Next filter            PgUp/PgDn/Home/End: Change page
+"""
+import curses
+import heapq
+import math
+from typing import Any, Callable, Iterable, List, Tuple
+
+# (name, key function):
+SortKey = Tuple[str, Callable[[Any], Any]]
+# (name, predicate):
+Filter = Tuple[str, Callable[[Any], bool]]
+
+help_line = '\'s\': Sort   \'r\': Reverse   \'f\': Filter   PgUp/PgDn: Page'
+
+
+class TableView:
+    def __init__(self, sort_keys: List[SortKey], filters: List[Filter], page_rows: int) -> None:
+        self.sort_keys = sort_keys
+        self.filters = filters
+        self.page_rows = max(1, page_rows)
+
+        self.sort_idx = 0
+        self.descending = False
+        self.filter_idx = 0
+        self.page = 0
+
+        # Results of the last select():
+        self.match_count = 0
+        self.page_count = 1
+
+    def handle_key(self, key: int) -> bool:
+        """Returns True if the key was used"""
+        if key == ord('s'):
+            self.sort_idx = (self.sort_idx + 1) % len(self.sort_keys)
+            self.page = 0
+        elif key == ord('r'):
+            self.descending = not self.descending
+            self.page = 0
+        elif key == ord('f'):
+            self.filter_idx = (self.filter_idx + 1) % len(self.filters)
+            self.page = 0
+        elif key == curses.KEY_NPAGE:
+            self.page += 1
+        elif key == curses.KEY_PPAGE:
+            self.page = max(0, self.page - 1)
+        elif key == curses.KEY_HOME:
+            self.page = 0
+        elif key == curses.KEY_END:
+            self.page = self.page_count - 1
+        else:
+            return False
+        return True
+
+    def select(self, items: Iterable[Any]) -> List[Any]:
+        """Filter and sort items, and return those on the current page"""
+        _, predicate = self.filters[self.filter_idx]
+        matches = [i for i in items if predicate(i)]
+
+        self.match_count = len(matches)
+        self.page_count = max(1, math.ceil(self.match_count / self.page_rows))
+        self.page = min(self.page, self.page_count - 1)
+
+        _, key = self.sort_keys[self.sort_idx]
+        n = (self.page + 1) * self.page_rows
+        if self.descending:
+            def desc_key(i: Any) -> Tuple[bool, Any]:
+                v = key(i)
+                return (v is not None, v)
+            ordered = heapq.nlargest(n, matches, key=desc_key)
+        else:
+            def asc_key(i: Any) -> Tuple[bool, Any]:
+                v = key(i)
+                return (v is None, v)
+            ordered = heapq.nsmallest(n, matches, key=asc_key)
+
+        return ordered[self.page * self.page_rows:]
+
+    def status(self) -> str:
+        return 'Sort: %s (%s)   Filter: %s   Page %i/%i   (%i shown of %i matching)' % (
+            self.sort_keys[self.sort_idx][0], 'desc' if self.descending else 'asc',
+            self.filters[self.filter_idx][0], self.page + 1, self.page_count,
+            min(self.page_rows, self.match_count - self.page * self.page_rows), self.match_count)
@@ -0,0 +1,49 @@
+"""
+blelog/curses_tui_components/Throughput_TUI.py
+'Throughput' Section of the curses dashboard.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+"""
+from typing import List
+
+import tabulate
+
+from blelog.consumers.throughput import Consumer_throughput
+from blelog.TUI import CursesTUI_Component
+
+
+class Throughput_TUI(CursesTUI_Component):
+    def __init__(self, consumer: Consumer_throughput):
+        self.consumer = consumer
+        self.drawn_tick = -1
+
+    def changed(self) -> bool:
+        # Everything shown is updated once per tick:
+        return self.consumer.tick_count != self.drawn_tick
+
+    def get_lines(self) -> List[str]:
+        c = self.consumer
+        self.drawn_tick = c.tick_count
+        headers = ['Device', 'Characteristic', 'Notifs/s', 'Rows/s', 'kB/s', 'Notifs', 'Rows', 'MB']
+        rows = []
+
+        channels = sorted(c.channels.items(), key=lambda item: -item[1].byte_rate)
+        for (adr, _), ch in channels:
+            rows.append(self._row(c.devices[adr].name, ch.name, ch))
+
+        rows.append(self._row(c.total.name, '', c.total))
+
+        return tabulate.tabulate(rows, headers, tablefmt='plain', floatfmt='.1f').splitlines()
+
+    def _row(self, device, char, stats) -> List:
+        return [device, char,
+                stats.notif_rate, stats.row_rate, stats.byte_rate/1e3,
+                stats.notifs_total, stats.rows_total, stats.bytes_total/1e6]
+
+    def title(self) -> str:
+        return 'THROUGHPUT'
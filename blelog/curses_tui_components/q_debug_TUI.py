@@ -37,7 +37,7 @@ class q_TUI(CursesTUI_Component):
 
         for consumer in self.consum_mgr.consumers:
             i = q_info(
-                name=consumer.__class__.__name__,
+                name=consumer.name(),
                 size=consumer.input_q.qsize()
             )
             q_s.append(i)
@@ -90,6 +90,25 @@ value 42, should return:
 
 Note the double list!
 
+# Batch decoders
+
+Optionally, a characteristic can also be given a batch decoder. Instead of a
+single notification, it receives a list of all notifications that arrived
+from the same device at about the same time, and decodes them all at once.
+
+Instead of rows, a batch decoder returns the data as columns: A list with one
+list/numpy array per column header, each holding the values of all rows.
+For example 1, the result should be:
+
+    ```py
+    [[1, 2],      # idx
+     [101, 202]]  # data
+    ```
+
+Decoding many notifications in one numpy operation is much faster than
+decoding them one at a time, which matters for devices that send a lot of
+notifications. If a batch decoder is given, the normal decoder is not used.
+
 # Logging/Printing: IMPORTANT!
 
 If you wish to print any debug information, **do not** use
@@ -112,6 +131,8 @@ import logging
 import struct
 from typing import Any, List
 
+import numpy as np
+
 
 def decode_demo_char(data: bytearray) -> List[List[Any]]:
     # Each notification consists of 50 readings, with each
@@ -142,3 +163,22 @@ def decode_demo_char(data: bytearray) -> List[List[Any]]:
         result.append([idx_val, data_val])
 
     return result
+
+
+# One demo_char reading: 16-bit little-endian unsigned index, and 16-bit
+# little-endian signed value:
+demo_char_dtype = np.dtype([('idx', '<u2'), ('data', '<i2')])
+
+
+def decode_demo_char_batch(payloads: List[bytearray]) -> List[Any]:
+    # Batch version of decode_demo_char, returns an 'idx' and a 'data' column.
+    log = logging.getLogger('log')
+
+    # Validate data length:
+    valid = [p for p in payloads if len(p) == 200]
+    if len(valid) != len(payloads):
+        log.warning('Malformed demo data, rejecting...')
+
+    # Decode all notifications at once:
+    readings = np.frombuffer(b''.join(valid), dtype=demo_char_dtype)
+    return [readings['idx'], readings['data']]
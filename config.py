@@ -9,7 +9,7 @@ This work is licensed under the terms of the MIT license.  For a copy, see the
 included LICENSE file or <https://opensource.org/licenses/MIT>.
 ---------------------------------
 """
-from blelog.Configuration import Characteristic, Configuration, TUI_Mode
+from blelog.Configuration import Adapter, Characteristic, Configuration, Subplot, TUI_Mode
 from char_decoders import *
 
 config = Configuration(
@@ -62,8 +62,22 @@ config = Configuration(
 
             # Column names for the information returned by the decoder function:
             # See `char_decoders.py` for more infos.
-            column_headers=['idx', 'data']
+            column_headers=['idx', 'data'],
 
+            # Sequence counter column (optional):
+            # If the data contains a counter that increments by one for
+            # every row, name its column here to detect lost, duplicate,
+            # and reordered data. Set to 'None' to disable.
+            sequence_column='idx',
+
+            # The value at which the sequence counter wraps around to zero:
+            sequence_modulus=2**16,
+
+            # Batch decoder function (optional):
+            # Decodes many notifications at once, which is much faster at
+            # high notification rates. Used instead of 'data_decoder' if set.
+            # See `char_decoders.py` for more infos.
+            batch_decoder=decode_demo_char_batch,
         ),
 
         # ... Additional characteristics
@@ -79,8 +93,26 @@ config = Configuration(
     # Maximum time the scan performed during a connection can take before
     # being aborted:
     # (This is a bleak parameter, and is not documented very well. Sorry.)
+    # (Usually, BLELog connects to the device seen by its own scanner, and
+    # bleak does not need to scan.)
     connection_timeout_scan=20,
 
+    # Cached services:
+    # If enabled, the GATT services discovered during the first connection
+    # to a device are reused when reconnecting (Linux and Windows only), which
+    # makes reconnecting much faster. Only enable this if the services of
+    # your devices do not change (for example after a firmware update)!
+    use_cached_services=False,
+
+    # Notification sockets (Linux only, opt-in):
+    # If enabled, notifications are received through a socket acquired from
+    # BlueZ ('AcquireNotify') instead of as D-Bus messages. This uses much
+    # less CPU at high notification rates. If a socket can't be acquired for
+    # a characteristic, BLELog falls back to normal notifications.
+    # This relies on internals of bleak's BlueZ backend that are not part of
+    # its public API, and may break with other bleak versions.
+    bluez_acquire_notify=False,
+
     # Maximum number of simultaneous connection attempts:
     # Anything higher than one tends to cause instability.
     max_simultaneous_connection_attempts=1,
@@ -91,16 +123,75 @@ config = Configuration(
     initial_characteristic_timeout=10,
 
     # Manager Interval:
-    # Time in seconds between connection manager attempting to
-    # create new connections
+    # The connection manager attempts to create new connections as soon as
+    # a device is seen or a connection slot becomes free. Additionally, it
+    # re-checks all devices every this many seconds:
     mgr_interval=1,
 
+    # Connection retries:
+    # After a failed connection attempt, a device is not retried for
+    # 'backoff_initial_s' seconds. This delay doubles with every further
+    # failure in a row (up to 'backoff_max_s'), and is scaled by the type
+    # of failure (see ConnectionMgr.py). Devices whose last attempt
+    # succeeded are always connected to first.
+    backoff_initial_s=2,
+    backoff_max_s=300,
+
+    # Random reduction of the retry delay, as a fraction (0 to 1) of it.
+    # Avoids retrying many devices at the same time:
+    backoff_jitter=0.5,
+
+    # A connection that is lost within this many seconds after being
+    # established counts as failed:
+    backoff_early_disconnect_s=10,
+
+    # File in which the connection successes and failures of every device
+    # are kept across restarts (opt-in). Devices that failed repeatedly
+    # are then still backed off after a restart. None to disable:
+    # connection_history_file='connection_history.json',
+    connection_history_file=None,
+
+    # ===================== Adapters ============================
+    # Bluetooth adapters to connect through. If left empty, the system's
+    # default adapter is used, with the connection limits given above.
+    # Otherwise, each adapter has its own limits (and the ones above are
+    # ignored), and new connections are placed on the least loaded adapter.
+    # Adapters are identified by name (for example 'hci0' on Linux).
+    # Adapters with 'scan=True' scan for devices. If none does, the
+    # system's default adapter is used for scanning.
+    adapters=[
+        # Adapter(
+        #     name='hci0',
+        #     max_active_connections=3,
+        #     max_simultaneous_connection_attempts=1,
+        #     scan=True,
+        # ),
+        # Adapter(
+        #     name='hci1',
+        #     max_active_connections=3,
+        #     max_simultaneous_connection_attempts=1,
+        # ),
+    ],
+
     # ================== Scanner Parameters ======================
+    # Continuous scanning (opt-in):
+    # If enabled, the scanner runs without interruption and devices are
+    # picked up as soon as an advertisement arrives. Otherwise, BLElog scans
+    # in cycles of 'scan_duration' seconds, and only learns about devices
+    # at the end of each cycle.
+    # Some BlueZ setups do not cope well with a scanner that is never
+    # stopped. If devices stop being discovered, disable this again.
+    continuous_scanning=False,
+
     # Time, in seconds, a scan should last:
     # Increasing this may help if devices are not being discovered:
+    # (With continuous scanning: Time to wait before retrying if the
+    # scanner fails to start.)
     scan_duration=3,
 
     # Time, in seconds, to pause between scans:
+    # (With continuous scanning: Interval at which seen-timeouts are
+    # checked.)
     scan_cooldown=0.1,
 
     # Last-seen timeout:
@@ -109,6 +200,37 @@ config = Configuration(
     # device will be marked as 'recently seen' after being seen.
     seen_timeout=20,
 
+    # Ignored devices:
+    # Devices whose name does not match any of the regexes above are
+    # ignored (and their name not checked again) for this long, in seconds,
+    # or until they change their name:
+    scan_ignore_timeout=300,
+
+    # Maximum number of ignored devices to remember. If more are seen, the
+    # oldest entries are forgotten:
+    scan_ignore_max_devices=4096,
+
+    # ================== Signal Strength ======================
+    # The scanner keeps a smoothed average and standard deviation of each
+    # device's RSSI. Devices with a strong and stable signal are connected
+    # to first.
+
+    # Smoothing factor (0 to 1) applied to every new RSSI reading. Smaller
+    # values average over more readings:
+    rssi_smoothing=0.2,
+
+    # A device's signal score is its average RSSI minus this factor times
+    # the standard deviation of its RSSI:
+    rssi_stability_weight=1.0,
+
+    # Devices whose signal scores are within the same band of this many dB
+    # are considered equally good, and are connected to in turn:
+    rssi_priority_band=6,
+
+    # Minimum average RSSI (in dBm) required before attempting to connect
+    # to a device. Set to None to try all devices regardless of signal:
+    connect_min_rssi=None,
+
     # ================== Consumer Settings ======================
     # Enable/disable logging of data to CSV files:
     log2csv_enabled=True,
@@ -127,6 +249,12 @@ config = Configuration(
     # Limit batch size to avoid huge memory usage if producer is very fast
     log2sqlite_batch_size=1000,
 
+    # Run log2csv and log2sqlite in their own worker processes:
+    # Keeps writing data from slowing down the reception of notifications,
+    # and lets it use another CPU core. Workers are restarted if they crash
+    # or stop responding. See blelog/consumers/worker.py.
+    consumer_workers=False,
+
     # Automatically open the data plot GUI on startup:
     # Useful in 'CONSOLE' tui mode, as the plotter cannot
     # be manually opened.
@@ -137,6 +265,45 @@ config = Configuration(
     # for any reason. Useful during testing/in CONSOLE mode.
     plotter_exit_on_plot_close=False,
 
+    # Number of points shown per trace in the live plot:
+    # Data is decimated (keeping the minimum and maximum of each bucket of
+    # samples) so that about this many points are passed on to the
+    # plot every 'plotter_window_s' seconds, no matter how fast devices
+    # stream.
+    plotter_point_budget=300,
+
+    # Time span (in seconds) the live plot should cover:
+    plotter_window_s=10,
+
+    # Maximum frame rate (in frames per second) of the live plot:
+    plotter_target_fps=20,
+
+    # CPU budget of the live plot, as a fraction of one CPU core:
+    # If the plot uses more, its frame rate is reduced to leave room for
+    # data reception and logging.
+    plotter_cpu_budget=0.5,
+
+    # Interval (in seconds) at which the live plot's frame rate, frame times
+    # and CPU usage are logged. Set to None to disable:
+    plotter_stats_report_period_s=60,
+
+    # Live plot layout:
+    # A list of subplots, shown from top to bottom. Each subplot shows
+    # the given columns of one characteristic, with one trace per
+    # connected device. Only columns listed here are sent to the plot.
+    plotter_subplots=[
+        Subplot(
+            title="Demo Characteristic: 'Data' Column",
+            characteristic='demo_char',
+            columns=['data'],
+        ),
+        Subplot(
+            title="Demo Characteristic: 'Idx' Column",
+            characteristic='demo_char',
+            columns=['idx'],
+        ),
+    ],
+
     # ================== General Settings ======================
 
     # Text file name for status log output:
@@ -155,7 +322,52 @@ config = Configuration(
     # CURSE TUI update interval (in seconds):
     curse_tui_interval=0.33,
 
+    # Number of devices shown per page in the CURSE TUI's scanner and
+    # connection tables. Select a table with TAB to sort, filter and page
+    # through it:
+    tui_page_rows=20,
+
+    # Metrics endpoint port:
+    # If set, performance metrics (queue depths, data rates, connection
+    # states, ...) are served at http://<metrics_host>:<metrics_port>/metrics
+    # in the Prometheus text format. Set to 'None' to disable.
+    metrics_port=None,
+
+    # Metrics endpoint address:
+    # '127.0.0.1' only allows local access. Use '0.0.0.0' to allow scraping
+    # from other hosts.
+    metrics_host='127.0.0.1',
+
+    # Profiler report folder:
+    # The profiler is started and stopped with the 'p' key in the CURSES
+    # TUI, or by sending SIGUSR1 to BLELog (Linux only). Reports are written
+    # to this folder when it is stopped.
+    profiler_output_dir='.',
+
+    # asyncio debug mode:
+    # Adds a lot of overhead to every task and callback. Only enable it when
+    # debugging BLELog itself.
+    asyncio_debug=False,
+
+    # Event loop monitor interval (in seconds):
+    # How often the delay of the event loop ('lag') is measured.
+    loop_monitor_interval_s=0.05,
+
+    # Slow callback threshold (in seconds):
+    # If the event loop is blocked for longer than this (for example by a slow
+    # decoder), a warning with the responsible code is logged.
+    loop_slow_callback_s=0.1,
+
     # Time period (in seconds) over which to calculate RX throughput.
     # set to `None` to disable.
-    throughput_period_s=2
+    throughput_period_s=2,
+
+    # CSV file to record the throughput of each device and characteristic
+    # into, every 'throughput_period_s' seconds.
+    # Set to 'None' to disable.
+    throughput_log_file=None,
+
+    # Time period (in seconds) over which data loss is reported, for
+    # characteristics with a 'sequence_column'.
+    sequence_report_period_s=10,
 )
@@ -14,38 +14,64 @@ included LICENSE file or <https://opensource.org/licenses/MIT>.
 The function plot(...) defined below is called by BLELog to display a live
 graph of the data received.
 
-You *will* have to update this file and adjust the plots to fit the data
-you are receiving and wanting to display.
+By default, it shows the subplots configured with 'plotter_subplots' in
+config.py, with one trace per device. For most setups, adjusting that
+setting is all that is needed. If you need something fancier, adjust this
+file.
 
 # Overview
 
 The plot function does the following:
 
-    - Set up a matplotlib plot
-    - Set up some deques to hold the most recent data
-    - Set up a matplotlib plot
-    - define the function 'animate', which gets called by
-      matplotlib repeatedly to update the plot
+    - Set up a matplotlib figure with one subplot per configured subplot
+    - Set up a LiveRenderer
+    - define the function 'update', which gets called by the renderer
+      at the start of every frame to fetch new data
 
-animate(_) in turn does the following:
+update() in turn does the following:
 
-    - Get data from the input data_queue, and send it to the correct deque
-    - Clear the plot
-    - Re-draw the plot with the most recent data.
+    - Attach to any newly announced data buffers, and add a trace (line)
+      to every subplot that shows that column
+    - Read new samples from each buffer, and push them into the correct traces
 
-Data arrives via the process-safe and thread-safe queue 'data_queue' in the
-form of NotifData objects:
+The renderer (see blelog/PlotRenderer.py) takes care of drawing. It creates
+all matplotlib artists once, keeps the most recent 'point_budget' samples
+of each trace in a preallocated numpy ring buffer, and only redraws the
+lines (blitting) at up to 'plotter_target_fps' frames per second.
+Avoid calling ax.clear(), ax.plot() or fig.tight_layout() every frame - it
+is very slow.
+
+Data arrives through shared memory: BLELog keeps one SharedRingBuffer per
+device and plotted characteristic column. Whenever
+a new buffer is created, a RingBufferInfo describing it arrives through the
+process-safe and thread-safe queue 'channel_queue':
 
     @dataclass
-    class NotifData:
+    class RingBufferInfo:
         device_adr: str                  # Bluetooth address
         device_name_repr: str            # Alias, Device Name, or address
-        characteristic: Characteristic   # The characteristic that received this
-                                         # data (as defined in config.py)
-        data: List[List[Any]]            # The output of the decoder function
-                                         # (as defined in char_decoders.py and
-                                         # set in config.py)
-        data_raw: bytearray              # Raw received data
+        characteristic: str              # Characteristic name (as defined
+                                         # in config.py)
+        column: str                      # Column name (as defined in
+                                         # config.py)
+        shm_name: str                    # Shared memory block name
+        capacity: int                    # Size of the ring buffer
+
+New samples are read with SharedRingBuffer.read(cursor), which returns a
+numpy array with everything written since the last read.
+
+Data is min/max decimated before it is written to the buffers, so that
+only about 'point_budget' points arrive per 'plotter_window_s' seconds (both
+set in config.py), no matter how fast devices stream.
+
+Plot settings from config.py arrive in 'settings':
+
+    @dataclass
+    class PlotSettings:
+        point_budget: int                # Points shown per trace
+        target_fps: float                # Maximum plot frame rate
+        cpu_budget: float                # CPU budget (fraction of a core)
+        subplots: List[Subplot]          # Subplot layout
 
 # Important Notes
 
@@ -62,7 +88,10 @@ a *completely separate* python interpreter. This means that this function
 
 It's only means of communication are:
 
-    - data_queue: A process- and thread-safe queue where data arrives.
+    - channel_queue: A process- and thread-safe queue where new data
+      buffers are announced.
+
+    - The shared memory data buffers themselves.
 
     - getLogger('log'): A logger that can be used for debug output - It too
       gets re-routed back to the main BLELog process using a queue.
@@ -74,91 +103,73 @@ and avoids it from interfering with data logging.
 import logging
 import multiprocessing as mp
 import queue
-from collections import deque
 
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 
-from blelog.ConsumerMgr import NotifData
+from blelog.PlotRenderer import LiveRenderer, PlotSettings
+from blelog.SharedRingBuffer import RingBufferInfo, SharedRingBuffer
 
 
-def plot(data_queue: mp.Queue):
+def plot(channel_queue: mp.Queue, settings: PlotSettings):
     # If you want to print anything, don't use print(..) -
     # Use the logger:
     log = logging.getLogger('log')
     # log.info('Helllooooooo wooooorld!')
 
-    # Place to store the address of the device we are plotting data from, to
-    # avoid plotting data from two simulatanously connected devices in the same plot:
-    # Note: This plot function will only plot data for the first device it receives
-    # notifications from.
-
-    plot_device_adr = []
-
-    # Setup plot with 2 subplots:
-    fig1, (ax1, ax2) = plt.subplots(2)
-    axs = [ax1, ax2]
-
-    # Setup deques to hold data that will be plotted:
-    # 'maxlen' controls the maximum number of data points shown.
-    data_dqs = {
-        'demo_idx': deque(maxlen=300),
-        'demo_data': deque(maxlen=300),
-    }
-
-    # Animation function called repeatedly by matplotlib.
-    # Grabs data from the input queues and pushes it to the correct
-    # deque before updating the plot.
-    def animate(_):
-        # Grab as much data from the input queue as possible:
-        while True:
-            try:
-                # Get a NotifData object:
-                notif_data = data_queue.get_nowait()  # type: NotifData
-
-                if len(plot_device_adr) == 0:
-                    # We have not received any data yet. Remember the
-                    # address of this device and ignore any data
-                    # originating from other addresses from here
-                    # on out:
-                    plot_device_adr.append(notif_data.device_adr)
-                    log.info(f"Plotter showing data for device `{notif_data.device_name_repr}`")
-                else:
-                    # Ignore data if coming from any address other than
-                    # the one we received data from first:
-                    if notif_data.device_adr not in notif_data.device_adr:
-                        continue
-
-                # Process each notification and put the data into the
-                # correct deques:
-                # 'notif_data.data' contains the return value of the char decoder function.
-                if notif_data.characteristic.name == "demo_char":
-                    for row in notif_data.data:
-                        data_dqs['demo_idx'].append(row[0])
-                        data_dqs['demo_data'].append(row[1])
-                # elif notif_data.characteristic.name == "some other char"
-                # ...
-                else:
-                    log.warn(f"Plotter received data from unknown char '{notif_data.characteristic.name}'")
+    if len(settings.subplots) == 0:
+        log.warning("No subplots configured, nothing to plot. See 'plotter_subplots' in config.py.")
+        return
 
-            except queue.Empty:
-                break
+    # Shared memory buffers, the read cursor for each, and the traces
+    # that show their data:
+    buffers = []  # [[SharedRingBuffer, cursor, List[Trace]], ...]
 
-        # Clear
-        for ax in axs:
-            ax.clear()
+    # Setup plot with one subplot per configured subplot:
+    fig1, axs = plt.subplots(len(settings.subplots), squeeze=False)
+    axs = axs[:, 0]
 
-        # titles
-        ax1.set_title("Demo Characteristic: 'Data' Column")
-        ax2.set_title("Demo Characteristic: 'Idx' Column")
+    # titles
+    for ax, subplot in zip(axs, settings.subplots):
+        ax.set_title(subplot.title)
 
-        # plot data
-        ax1.plot(data_dqs['demo_data'], linewidth=0.5, label="red")
-        ax2.plot(data_dqs['demo_idx'], linewidth=0.5, label="red")
+    # Called by the renderer at the start of every frame.
+    # Grabs data from the shared buffers and pushes it to the correct
+    # traces.
+    def update():
+        # Attach to any new buffers, and add traces for them:
+        while True:
+            try:
+                info = channel_queue.get_nowait()  # type: RingBufferInfo
+            except queue.Empty:
+                break
 
-        # adjust layout
-        fig1.tight_layout()
+            traces = []
+            for ax, subplot in zip(axs, settings.subplots):
+                if subplot.characteristic == info.characteristic and info.column in subplot.columns:
+                    if len(subplot.columns) == 1:
+                        label = info.device_name_repr
+                    else:
+                        label = "%s: %s" % (info.device_name_repr, info.column)
+                    traces.append(renderer.add_trace(ax, linewidth=0.5, label=label))
+                    ax.legend(loc='upper left', fontsize='small')
+
+            if len(traces) != 0:
+                log.info(f"Plotter showing '{info.column}' of '{info.characteristic}' for `{info.device_name_repr}`")
+                buffers.append([SharedRingBuffer.attach(info), None, traces])
+
+        # Grab all new data and push it into the correct traces:
+        for entry in buffers:
+            buf, cursor, traces = entry
+            new_data, entry[1] = buf.read(cursor)
+            for trace in traces:
+                trace.extend(new_data)
+
+    # Setup renderer:
+    # Each trace shows the most recent 'settings.point_budget' points.
+    renderer = LiveRenderer(fig1, settings, update)
 
     # Start plot
-    _ = FuncAnimation(fig1, animate)  # type: ignore
-    plt.show()
+    renderer.show()
+
+    for buf, _, _ in buffers:
+        buf.close()
@@ -0,0 +1,174 @@
+"""
+tests/test_AcquireNotify.py
+Tests for blelog/AcquireNotify.py, using a simulated BlueZ backend.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Run from the repository root with:
+    python -m unittest discover tests
+
+Notification sockets are simulated with socket.socketpair(), and BlueZ's
+D-Bus interface with a stub bus that returns prepared replies.
+"""
+import asyncio
+import copy
+import socket
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from bleak.exc import BleakDBusError, BleakError
+from dbus_fast import MessageType
+
+import config
+from blelog.AcquireNotify import NotifySocket, acquire_notify
+from blelog.ActiveConnection import ActiveConnection
+
+
+def seqpacket_pair():
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+
+class StubBus:
+    """Answers every call with 'reply', and records the messages"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def call(self, msg):
+        self.calls.append(msg)
+        return self.reply
+
+
+def stub_client(bus):
+    char = SimpleNamespace(path='/org/bluez/hci0/dev_AA/service0010/char0011')
+    client = mock.Mock()
+    client._backend = SimpleNamespace(_bus=bus)
+    client.services.get_characteristic.return_value = char
+    client.start_notify = mock.AsyncMock()
+    return client, char
+
+
+def error_reply():
+    return SimpleNamespace(message_type=MessageType.ERROR, error_name='org.bluez.Error.NotPermitted',
+                           body=['Notify acquired'], unix_fds=[])
+
+
+class TestNotifySocket(unittest.IsolatedAsyncioTestCase):
+    async def test_packets_are_passed_to_callback(self):
+        ours, theirs = seqpacket_pair()
+        received = []
+        sock = NotifySocket(ours.detach(), 23, received.append)
+        sock.start()
+
+        for payload in [b'\x01\x02', b'\x03', b'\x04\x05\x06']:
+            theirs.send(payload)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(received, [bytearray(b'\x01\x02'), bytearray(b'\x03'), bytearray(b'\x04\x05\x06')])
+        self.assertTrue(all(isinstance(r, bytearray) for r in received))
+
+        sock.close()
+        theirs.close()
+
+    async def test_peer_closing_calls_closed_callback(self):
+        ours, theirs = seqpacket_pair()
+        closed = []
+        sock = NotifySocket(ours.detach(), 23, lambda data: None, lambda: closed.append(True))
+        sock.start()
+
+        theirs.close()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(closed, [True])
+        self.assertEqual(sock.sock.fileno(), -1)
+
+    async def test_close_does_not_call_closed_callback(self):
+        ours, theirs = seqpacket_pair()
+        closed = []
+        sock = NotifySocket(ours.detach(), 23, lambda data: None, lambda: closed.append(True))
+        sock.start()
+
+        sock.close()
+        sock.close()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(closed, [])
+        theirs.close()
+
+
+class TestAcquireNotify(unittest.IsolatedAsyncioTestCase):
+    async def test_success_returns_fd_and_mtu(self):
+        reply = SimpleNamespace(message_type=MessageType.METHOD_RETURN, body=[0, 247], unix_fds=[42])
+        bus = StubBus(reply)
+        client, char = stub_client(bus)
+
+        fd, mtu = await acquire_notify(client, char)
+
+        self.assertEqual((fd, mtu), (42, 247))
+        self.assertEqual(bus.calls[0].member, 'AcquireNotify')
+        self.assertEqual(bus.calls[0].path, char.path)
+
+    async def test_error_reply_raises(self):
+        client, char = stub_client(StubBus(error_reply()))
+        with self.assertRaises(BleakDBusError):
+            await acquire_notify(client, char)
+
+    async def test_without_bus_raises(self):
+        client, char = stub_client(None)
+        with self.assertRaises(BleakError):
+            await acquire_notify(client, char)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'AcquireNotify is only used on Linux')
+class TestEnableNotifications(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config = copy.deepcopy(config.config)
+        self.config.validate_and_normalise()
+        self.config.bluez_acquire_notify = True
+        self.char = self.config.characteristics[0]
+
+    def connection(self):
+        return ActiveConnection('aa:bb:cc:dd:ee:ff', 'test', self.config, asyncio.Queue())
+
+    async def test_falls_back_to_start_notify(self):
+        client, _ = stub_client(StubBus(error_reply()))
+        con = self.connection()
+
+        await con._enable_notifications(client, self.char)
+
+        client.start_notify.assert_awaited_once()
+        self.assertEqual(con.notify_sockets, [])
+
+    async def test_socket_closing_disconnects(self):
+        ours, theirs = seqpacket_pair()
+        reply = SimpleNamespace(message_type=MessageType.METHOD_RETURN, body=[0, 23], unix_fds=[ours.detach()])
+        client, _ = stub_client(StubBus(reply))
+        con = self.connection()
+
+        await con._enable_notifications(client, self.char)
+        client.start_notify.assert_not_awaited()
+        self.assertEqual(len(con.notify_sockets), 1)
+
+        theirs.send(b'\x00' * 4)
+        await asyncio.sleep(0.05)
+        self.assertIsNotNone(con.last_notif[self.char.uuid])
+        self.assertFalse(con.did_disconnect)
+
+        theirs.close()
+        await asyncio.sleep(0.05)
+        self.assertTrue(con.did_disconnect)
+        self.assertTrue(con.wake.is_set())
+
+        con._close_notify_sockets()
+
+
+if __name__ == '__main__':
+    unittest.main()
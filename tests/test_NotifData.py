@@ -0,0 +1,75 @@
+"""
+tests/test_NotifData.py
+Tests for the row/column conversion of NotifData, and for decoders that
+return rows of different lengths.
+
+BLELog
+Copyright (C) 2024 Philipp Schilk
+
+This work is licensed under the terms of the MIT license.  For a copy, see the
+included LICENSE file or <https://opensource.org/licenses/MIT>.
+---------------------------------
+
+Run from the repository root with:
+    python -m unittest discover tests
+"""
+import asyncio
+import copy
+import dataclasses
+import logging
+import unittest
+
+import config
+from blelog.ActiveConnection import ActiveConnection
+from blelog.ConsumerMgr import NotifData
+
+
+class TestNotifData(unittest.TestCase):
+    def setUp(self):
+        self.char = copy.deepcopy(config.config.characteristics[0])
+
+    def test_rows_to_cols(self):
+        d = NotifData('AA', 'AA', self.char, [[1, 2], [3, 4], [5, 6]], bytearray())
+        self.assertEqual(d.cols(), [[1, 3, 5], [2, 4, 6]])
+        self.assertEqual(d.row_count(), 3)
+
+    def test_cols_to_rows(self):
+        d = NotifData('AA', 'AA', self.char, None, bytearray(), columns=[[1, 3], [2, 4]])
+        self.assertEqual(d.rows(), [[1, 2], [3, 4]])
+        self.assertEqual(d.row_count(), 2)
+
+    def test_ragged_rows_raise(self):
+        d = NotifData('AA', 'AA', self.char, [[1, 2], [3]], bytearray())
+        with self.assertRaises(ValueError):
+            d.cols()
+
+
+class TestDecode(unittest.TestCase):
+    def setUp(self):
+        self.config = copy.deepcopy(config.config)
+        self.config.validate_and_normalise()
+        self.char = self.config.characteristics[0]
+        self.con = ActiveConnection('aa:bb:cc:dd:ee:ff', 'test', self.config, asyncio.Queue())
+        self.con.log = logging.getLogger('test_NotifData')
+        self.con.log.disabled = True
+
+    def test_ragged_rows_are_decoder_errors(self):
+        def decoder(data):
+            return [[0] * b for b in data]
+        char = dataclasses.replace(self.char, data_decoder=decoder, batch_decoder=None)
+
+        result = self.con._decode(char, [bytearray([2, 2]), bytearray([2, 1]), bytearray([2])])
+
+        self.assertEqual(result.rows(), [[0, 0], [0, 0], [0, 0]])
+        self.assertEqual(result.cols(), [[0, 0, 0], [0, 0, 0]])
+        self.assertEqual(self.con.decoder_errors, 1)
+
+    def test_ragged_columns_are_decoder_errors(self):
+        char = dataclasses.replace(self.char, batch_decoder=lambda payloads: [[1, 2], [3]])
+
+        self.assertIsNone(self.con._decode(char, [bytearray([0])]))
+        self.assertEqual(self.con.decoder_errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()